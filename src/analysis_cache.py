@@ -0,0 +1,135 @@
+import json
+import time
+import hashlib
+from database import get_manager
+from config import (
+    ANALYSIS_CACHE_TTL,
+    ANALYSIS_CACHE_MAX_BYTES
+)
+
+
+def normalize_preferences(preferences: dict) -> dict:
+    """正規化故事偏好，讓只差在空白的輸入對應到同一筆快取"""
+    return {
+        "theme": preferences['theme'].strip(),
+        "genre": preferences['genre'].strip(),
+        "tone": preferences['tone'].strip(),
+        "key_elements": [e.strip() for e in preferences['key_elements'] if e.strip()]
+    }
+
+
+class AnalysisCache:
+    """
+    思考鏈分析結果的持久化快取
+
+    以內容雜湊為鍵，存放各方向的分析與最終創作指南，
+    超過有效期限的項目會被移除，總大小超過上限時依LRU淘汰。
+    """
+    NAME = 'analysis'
+
+    def __init__(self, db_path, ttl=ANALYSIS_CACHE_TTL, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.db = get_manager(db_path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(preferences: dict, templates: list, params: dict) -> str:
+        """以正規化偏好、提示詞模板與模型參數計算快取鍵"""
+        material = json.dumps({
+            "preferences": normalize_preferences(preferences),
+            "templates": templates,
+            "params": params
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        查詢快取
+
+        Returns:
+            dict | None: 命中時回傳 {'sub_analyses': [...], 'guide': str}
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT sub_analyses, guide FROM analysis_cache WHERE cache_key = ? AND created_at > ?",
+                (key, now - self.ttl)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE analysis_cache SET last_accessed = ? WHERE cache_key = ?",
+                    (now, key)
+                )
+            self._count(conn, hit=row is not None)
+
+        if not row:
+            return None
+        return {"sub_analyses": json.loads(row[0]), "guide": row[1]}
+
+    def put(self, key: str, sub_analyses: list, guide: str):
+        """寫入快取並執行淘汰"""
+        sub_json = json.dumps(sub_analyses, ensure_ascii=False)
+        size = len(sub_json.encode('utf-8')) + len(guide.encode('utf-8'))
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("""
+                INSERT INTO analysis_cache
+                (cache_key, sub_analyses, guide, size, created_at, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    sub_analyses = excluded.sub_analyses,
+                    guide = excluded.guide,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    last_accessed = excluded.last_accessed
+            """, (key, sub_json, guide, size, now, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """移除過期項目，並依最近使用時間淘汰超出大小上限的部分"""
+        conn.execute(
+            "DELETE FROM analysis_cache WHERE created_at <= ?",
+            (now - self.ttl,)
+        )
+        conn.execute("""
+            DELETE FROM analysis_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key,
+                           SUM(size) OVER (ORDER BY last_accessed DESC, cache_key) AS running
+                    FROM analysis_cache
+                ) WHERE running > ?
+            )
+        """, (self.max_bytes,))
+
+    def _count(self, conn, hit: bool):
+        """累計命中與未命中次數"""
+        column = 'hits' if hit else 'misses'
+        conn.execute(
+            f"INSERT INTO cache_stats (name, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(name) DO UPDATE SET {column} = {column} + 1",
+            (self.NAME,)
+        )
+
+    def stats(self) -> dict:
+        """回傳快取筆數、大小與命中統計"""
+        conn = self.db.connection()
+        entries, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache"
+        ).fetchone()
+        counters = conn.execute(
+            "SELECT hits, misses FROM cache_stats WHERE name = ?",
+            (self.NAME,)
+        ).fetchone() or (0, 0)
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": counters[0],
+            "misses": counters[1]
+        }
+
+    def clear(self):
+        """清空快取與統計"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM analysis_cache")
+            conn.execute("DELETE FROM cache_stats WHERE name = ?", (self.NAME,))
@@ -0,0 +1,344 @@
+import os
+import json
+import gzip
+import time
+import struct
+from itertools import islice
+from contextlib import contextmanager, nullcontext
+from blob_store import compress, decompress
+
+# 故事庫的匯出與匯入。
+# 匯出以單一查詢的游標逐批讀取版本，還原內容後立即寫出；匯入逐批以 executemany 寫入，
+# 每批一個交易。兩者都不會一次載入整個故事庫，記憶體用量與檔案大小無關。
+#
+# 檔案格式：
+# - jsonl：每行一個版本（含所屬故事的偏好設定），副檔名為 .gz 時以 gzip 壓縮
+# - columnar：有安裝 pyarrow 時寫為 Parquet；否則為分批的欄式壓縮格式，
+#   每批的各欄位值以 JSON 陣列存放後壓縮，同一欄的值相鄰，重複的主題、類型與語氣壓縮率高
+# 匯入時依檔案開頭自動判斷格式。
+
+# 每筆記錄的欄位，依故事編號與版本號排序；同一故事的版本在檔案中相鄰
+COLUMNS = (
+    'story_id', 'session_id', 'theme', 'genre', 'tone', 'elements', 'story_created_at',
+    'version', 'prompt', 'content', 'feedback', 'rating', 'created_at'
+)
+_INTEGER_COLUMNS = ('story_id', 'version', 'rating')
+
+# 欄式壓縮格式：檔頭為 magic 與格式版本，之後每批為 (壓縮方式, 筆數, 長度) 與壓縮後的內容
+_CHUNK_MAGIC = b'STCH'
+_CHUNK_FORMAT_VERSION = 1
+_CHUNK_HEADER = struct.Struct('<4sI')
+_FRAME_HEADER = struct.Struct('<4sII')
+_PARQUET_MAGIC = b'PAR1'
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _pyarrow():
+    """有安裝 pyarrow 時回傳 (pyarrow, pyarrow.parquet)，否則為 None"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        return None
+    return pyarrow, pyarrow.parquet
+
+
+def _batched(iterable, size: int):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_records(store, batch_size: int = 500):
+    """依故事編號與版本號逐筆產生所有版本的匯出記錄"""
+    for row in store.iter_all_versions(batch_size):
+        yield {name: row[name] for name in COLUMNS}
+
+
+def _open_text(path, mode: str):
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def write_jsonl(path, records):
+    """每行寫入一筆記錄，回傳筆數"""
+    count = 0
+    with _open_text(path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write("\n")
+            count += 1
+    return count
+
+
+def _to_columns(batch: list) -> dict:
+    """將一批記錄轉為欄位 -> 值的列表，關鍵元素存為 JSON 字串"""
+    columns = {name: [record.get(name) for record in batch] for name in COLUMNS}
+    columns['elements'] = [json.dumps(value, ensure_ascii=False) for value in columns['elements']]
+    return columns
+
+
+def write_columnar(path, records, batch_size: int = 500):
+    """
+    每 batch_size 筆寫為一批欄式資料
+
+    Returns:
+        tuple: (筆數, 實際的格式 parquet 或 chunks)
+    """
+    arrow = _pyarrow()
+    count = 0
+    if arrow is not None:
+        pa, pq = arrow
+        schema = pa.schema([
+            (name, pa.int64() if name in _INTEGER_COLUMNS else pa.string()) for name in COLUMNS
+        ])
+        with pq.ParquetWriter(str(path), schema, compression='zstd') as writer:
+            for batch in _batched(records, batch_size):
+                writer.write_table(pa.Table.from_pydict(_to_columns(batch), schema=schema))
+                count += len(batch)
+        return count, 'parquet'
+
+    with open(path, 'wb') as f:
+        f.write(_CHUNK_HEADER.pack(_CHUNK_MAGIC, _CHUNK_FORMAT_VERSION))
+        for batch in _batched(records, batch_size):
+            data = json.dumps(_to_columns(batch), ensure_ascii=False).encode('utf-8')
+            codec, body = compress(data)
+            f.write(_FRAME_HEADER.pack(codec.encode('ascii'), len(batch), len(body)))
+            f.write(body)
+            count += len(batch)
+    return count, 'chunks'
+
+
+def detect_format(path) -> str:
+    """依檔案開頭判斷格式：parquet、chunks 或 jsonl（含 gzip 壓縮）"""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    if head == _PARQUET_MAGIC:
+        return 'parquet'
+    if head == _CHUNK_MAGIC:
+        return 'chunks'
+    return 'jsonl'
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as f:
+        magic, version = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+        if version != _CHUNK_FORMAT_VERSION:
+            raise ValueError(f"不支援的匯出檔版本: {version}")
+        while True:
+            header = f.read(_FRAME_HEADER.size)
+            if not header:
+                return
+            if len(header) < _FRAME_HEADER.size:
+                raise ValueError("匯出檔不完整")
+            codec, rows, length = _FRAME_HEADER.unpack(header)
+            body = f.read(length)
+            if len(body) < length:
+                raise ValueError("匯出檔不完整")
+            columns = json.loads(decompress(codec.decode('ascii'), body))
+            yield from (dict(zip(COLUMNS, values)) for values in zip(*(columns[name] for name in COLUMNS)))
+
+
+def _read_parquet(path, batch_size: int):
+    arrow = _pyarrow()
+    if arrow is None:
+        raise ValueError("讀取 Parquet 檔需要安裝 pyarrow")
+    parquet_file = arrow[1].ParquetFile(str(path))
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(COLUMNS)):
+        yield from batch.to_pylist()
+
+
+def _read_jsonl(path):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == _GZIP_MAGIC
+    opener = gzip.open(path, 'rt', encoding='utf-8') if compressed else open(path, encoding='utf-8')
+    with opener as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError(f"第 {line_no} 行不是有效的 JSON") from None
+
+
+def read_records(path, batch_size: int = 500):
+    """依檔案格式逐筆產生記錄"""
+    fmt = detect_format(path)
+    if fmt == 'parquet':
+        return _read_parquet(path, batch_size)
+    if fmt == 'chunks':
+        return _read_chunks(path)
+    return _read_jsonl(path)
+
+
+def _normalize(number: int, record: dict) -> dict:
+    """
+    檢查必填欄位並統一型別
+
+    Raises:
+        ValueError: 記錄不是物件、缺少必填欄位，或版本號、評分、關鍵元素的值不符
+    """
+    if not isinstance(record, dict):
+        raise ValueError(f"第 {number} 筆記錄不是物件")
+    missing = [name for name in ('story_id', 'version', 'theme', 'genre', 'tone', 'content')
+               if record.get(name) in (None, '')]
+    if missing:
+        raise ValueError(f"第 {number} 筆記錄缺少欄位: {', '.join(missing)}")
+    elements = record.get('elements') or []
+    if isinstance(elements, str):
+        elements = json.loads(elements) if elements.startswith('[') else elements.split(',')
+    if not isinstance(elements, list) or not all(isinstance(e, str) for e in elements):
+        raise ValueError(f"第 {number} 筆記錄的 elements 必須是字串列表")
+    version = _to_int(record['version'])
+    if version is None or version < 1:
+        raise ValueError(f"第 {number} 筆記錄的 version 必須是大於 0 的整數")
+    rating = record.get('rating')
+    if rating not in (None, ''):
+        rating = _to_int(rating)
+        if rating is None or not 1 <= rating <= 5:
+            raise ValueError(f"第 {number} 筆記錄的 rating 必須是 1-5 的整數")
+    else:
+        rating = None
+    return dict(record, version=version, rating=rating,
+                elements=json.dumps(elements, ensure_ascii=False), prompt=record.get('prompt') or '')
+
+
+def _to_int(value):
+    """整數或整數字串轉為 int，其他值回傳 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip('-').isdigit():
+        return int(value)
+    return None
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def restore_indexes(db, owner: int = None) -> int:
+    """
+    重建匯入期間移除的索引，回傳重建的數量
+
+    Args:
+        owner: 只重建此行程移除的索引；未指定時只重建移除它們的行程已不存在的索引，
+            其他命令在匯入進行中啟動時不會提前重建
+    """
+    conn = db.connection()
+    if not conn.execute("SELECT 1 FROM deferred_indexes LIMIT 1").fetchone():
+        return 0
+    with db.transaction() as conn:
+        rows = [
+            (name, sql, pid) for name, sql, pid in conn.execute("SELECT name, sql, pid FROM deferred_indexes")
+            if (pid == owner if owner is not None else pid is None or not _process_alive(pid))
+        ]
+        for name, sql, _ in rows:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+                conn.execute(sql)
+        conn.executemany("DELETE FROM deferred_indexes WHERE name = ?", [(name,) for name, _, _ in rows])
+    return len(rows)
+
+
+@contextmanager
+def deferred_indexes(db, tables=('stories', 'story_versions')):
+    """
+    暫時移除資料表的次要索引，結束時（含發生錯誤）一次重建
+
+    大量逐批寫入時不必在每次插入時更新索引；移除的索引與目前的行程編號記錄在 deferred_indexes，
+    行程被強制終止時，下次開啟資料庫（init_db）會自動重建。主鍵與唯一索引不受影響。
+    """
+    pid = os.getpid()
+    placeholders = ','.join('?' * len(tables))
+    with db.transaction() as conn:
+        rows = conn.execute(f"""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({placeholders})
+        """, tables).fetchall()
+        conn.executemany(
+            "INSERT OR REPLACE INTO deferred_indexes (name, sql, pid) VALUES (?, ?, ?)",
+            [(name, sql, pid) for name, sql in rows]
+        )
+        for name, _ in rows:
+            conn.execute(f'DROP INDEX "{name}"')
+    try:
+        yield
+    finally:
+        restore_indexes(db, owner=pid)
+
+
+def import_records(store, records, batch_size: int = 500, defer_indexes: bool = True, progress=None) -> dict:
+    """
+    將記錄寫入故事庫，每 batch_size 筆以 executemany 寫入並提交一次
+
+    匯入的故事取得新的故事編號，原編號只用來辨識同一故事的版本（須在檔案中相鄰，匯出檔即是如此）。
+    版本間指標不匯入，之後由 history 或 rescore 補算；全文檢索索引在下次檢索前建立。
+    發生錯誤時，已提交的批次保留。
+
+    Raises:
+        ValueError: 記錄不符格式，或同一故事有重複的版本號
+
+    Args:
+        progress: 每批提交後以目前的統計呼叫
+
+    Returns:
+        dict: rows、stories 與 elapsed
+    """
+    stats = {"rows": 0, "stories": 0, "elapsed": 0.0}
+    start = time.perf_counter()
+    current = None   # (匯出檔中的故事編號, 新的故事編號, 已匯入的版本號)
+    numbered = enumerate(records, start=1)
+
+    with deferred_indexes(store.db) if defer_indexes else nullcontext():
+        for batch in _batched(numbered, batch_size):
+            with store.db.transaction() as conn:
+                next_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM stories").fetchone()[0]
+                stories, versions = [], []
+                for number, record in batch:
+                    record = _normalize(number, record)
+                    if current is None or current[0] != record['story_id']:
+                        next_id += 1
+                        current = (record['story_id'], next_id, set())
+                        stories.append((
+                            next_id, record.get('session_id') or 'import', record['theme'], record['genre'],
+                            record['tone'], record['elements'], record.get('story_created_at')
+                        ))
+                    if record['version'] in current[2]:
+                        raise ValueError(
+                            f"第 {number} 筆記錄的版本 {record['version']} 與故事 {record['story_id']} 的前一筆重複"
+                        )
+                    current[2].add(record['version'])
+                    versions.append((
+                        current[1], record['version'], record.get('feedback'), record['rating'],
+                        record.get('created_at'), store.blobs.acquire(record['prompt']),
+                        store.blobs.acquire(record['content'])
+                    ))
+                conn.executemany("""
+                    INSERT INTO stories (id, session_id, theme, genre, tone, elements, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                """, stories)
+                conn.executemany("""
+                    INSERT INTO story_versions
+                    (story_id, version, prompt, content, feedback, rating, created_at, prompt_ref, content_ref)
+                    VALUES (?, ?, '', '', ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+                """, versions)
+            stats["rows"] += len(versions)
+            stats["stories"] += len(stories)
+            stats["elapsed"] = time.perf_counter() - start
+            if progress:
+                progress(stats)
+
+    stats["elapsed"] = time.perf_counter() - start
+    return stats
@@ -0,0 +1,834 @@
+import os
+import sys
+import time
+import random
+import signal
+import sqlite3
+import tempfile
+import threading
+import statistics
+import subprocess
+from pathlib import Path
+import json
+import platform
+from datetime import datetime
+import click
+import corpus
+from config import BASE_DIR
+from fake_llm_server import FakeChatServer
+
+# 基準測試工具，所有模型呼叫都導向本地模擬服務
+
+
+def _use_fake_server(server: FakeChatServer):
+    """讓 OpenAI 客戶端連到模擬服務"""
+    os.environ['OPENAI_BASE_URL'] = server.base_url
+    os.environ['OPENAI_API_KEY'] = 'fake-key'
+
+
+@click.group()
+def cli():
+    """效能基準測試"""
+    pass
+
+
+@cli.command()
+@click.option('--latency', default=0.5, show_default=True, help='模擬服務的基本延遲（秒）')
+@click.option('--jitter', default=0.5, show_default=True, help='額外隨機延遲上限（秒）')
+@click.option('--workers', default=5, show_default=True, help='並行模式的請求上限')
+@click.option('--rounds', default=3, show_default=True, help='每種模式重複次數')
+@click.option('--transport', type=click.Choice(['http', 'inproc']), default='http', show_default=True,
+              help='http 經由本地 HTTP 模擬服務與 OpenAI 客戶端，inproc 直接在行程內模擬')
+def cot(latency, jitter, workers, rounds, transport):
+    """比較思考鏈分析依序與並行執行的耗時"""
+    from llm_backend import set_backend, create_backend
+    from fake_llm_server import FakeBackend
+
+    server = None
+    if transport == 'http':
+        server = FakeChatServer(latency=latency, jitter=jitter, seed=42).start()
+        _use_fake_server(server)
+        set_backend(create_backend('openai'))
+    else:
+        set_backend(FakeBackend(latency=latency, jitter=jitter, seed=42))
+
+    import main
+
+    preferences = {
+        "theme": "AI",
+        "genre": "短文",
+        "tone": "樂觀",
+        "key_elements": ["機器人", "城市"]
+    }
+
+    try:
+        for label, max_workers in [("依序", 1), ("並行", workers)]:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                main.analyze_with_chain_of_thought(preferences, max_workers=max_workers, use_cache=False)
+                timings.append(time.perf_counter() - start)
+            click.echo(
+                f"{label} (workers={max_workers}): "
+                f"平均 {sum(timings) / len(timings):.2f} 秒，"
+                f"最快 {min(timings):.2f} 秒"
+            )
+        click.echo(f"單次呼叫延遲範圍: {latency:.2f} ~ {latency + jitter:.2f} 秒（共 6 次呼叫，其中 5 次可並行）")
+    finally:
+        if server:
+            server.stop()
+
+
+def _naive_save(db_path, story_id, version, prompt, content):
+    """舊做法：每次寫入都重新連線並使用預設的日誌模式"""
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("""
+            INSERT INTO story_versions (story_id, version, prompt, content)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(story_id, version) DO UPDATE SET
+                prompt = excluded.prompt, content = excluded.content
+        """, (story_id, version, prompt, content))
+
+
+def _naive_read(db_path, story_id, version):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute(
+            "SELECT content FROM story_versions WHERE story_id = ? AND version = ?",
+            (story_id, version)
+        ).fetchone()
+
+
+def _run_writers(save, workers, per_worker):
+    """以多個執行緒同時寫入，回傳 (耗時, 錯誤數)"""
+    errors = []
+
+    def work(worker_id):
+        for version in range(1, per_worker + 1):
+            try:
+                save(worker_id + 1, version)
+            except sqlite3.Error as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start, len(errors)
+
+
+@cli.command()
+@click.option('--count', default=2000, show_default=True, help='寫入與讀取的版本數')
+@click.option('--workers', default=8, show_default=True, help='同時寫入的執行緒數')
+def db(count, workers):
+    """比較每次重新連線與共用 WAL 連接的寫入、讀取吞吐量"""
+    from migrations import migrate
+    from story_store import StoryStore
+
+    content = "故事內容" * 250
+    prompt = "提示詞" * 100
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for label in ("每次重新連線", "共用WAL連接"):
+            db_path = Path(tmp) / f"{label}.db"
+            stories_sql = (
+                "INSERT INTO stories (session_id, theme, genre, tone, elements) "
+                "VALUES (?, 'AI', '短文', '樂觀', '[]')"
+            )
+            if label == "共用WAL連接":
+                store = StoryStore(db_path)
+                migrate(store.db.connection())
+                with store.db.transaction() as conn:
+                    conn.executemany(stories_sql, [(f"bench-{i}",) for i in range(workers)])
+                save = lambda sid, v: store.save_version(sid, v, prompt, content)
+                read = lambda sid, v: store.get_version(sid, v)
+            else:
+                store = None
+                with sqlite3.connect(db_path) as conn:
+                    migrate(conn)
+                    conn.executemany(stories_sql, [(f"bench-{i}",) for i in range(workers)])
+                save = lambda sid, v: _naive_save(db_path, sid, v, prompt, content)
+                read = lambda sid, v: _naive_read(db_path, sid, v)
+
+            start = time.perf_counter()
+            for version in range(1, count + 1):
+                save(1, version)
+            insert_rate = count / (time.perf_counter() - start)
+
+            keys = [random.randint(1, count) for _ in range(count)]
+            start = time.perf_counter()
+            for version in keys:
+                read(1, version)
+            read_rate = count / (time.perf_counter() - start)
+
+            elapsed, errors = _run_writers(save, workers, count // workers)
+            concurrent_rate = (count // workers) * workers / elapsed
+
+            click.echo(
+                f"{label}: 寫入 {insert_rate:,.0f} 筆/秒，讀取 {read_rate:,.0f} 筆/秒，"
+                f"{workers} 執行緒同時寫入 {concurrent_rate:,.0f} 筆/秒（錯誤 {errors} 次）"
+            )
+            if store:
+                store.db.close()
+
+
+def _max_difference(expected, actual):
+    """兩組評估結果中最大的數值差異"""
+    diff = 0.0
+    for e, a in zip(expected, actual):
+        diff = max(diff, abs(e['bleu_score'] - a['bleu_score']), abs(e['change_rate'] - a['change_rate']))
+        for key, value in e['rouge_scores'].items():
+            diff = max(diff, abs(value - a['rouge_scores'][key]))
+    return diff
+
+
+@cli.command()
+@click.option('--pairs', 'pair_count', default=300, show_default=True, help='批次評估的版本對數')
+@click.option('--length', default=1000, show_default=True, help='每段文本的字數')
+@click.option('--sample', default=10, show_default=True, help='逐對計算時抽樣的版本對數')
+def metrics(pair_count, length, sample):
+    """比較逐對計算與批次向量化計算的評估指標"""
+    from nltk.translate.bleu_score import sentence_bleu
+    from rouge_chinese import Rouge
+    from evaluation import StoryEvaluator
+    from batch_metrics import evaluate_pairs
+    from tokenizer import tokenize
+
+    pairs = [(tokenize(old), tokenize(new)) for old, new in corpus.synthetic_pairs(pair_count, length)]
+    sampled = pairs[:sample]
+
+    # 原始做法：nltk 與 rouge_chinese 逐對計算
+    rouge = Rouge()
+    start = time.perf_counter()
+    library_results = []
+    for old, new in sampled:
+        scores = rouge.get_scores(" ".join(new.tokens), " ".join(old.tokens))[0]
+        library_results.append({
+            "bleu_score": sentence_bleu([old.tokens], new.tokens),
+            "change_rate": len(old.token_set ^ new.token_set) / len(old.token_set | new.token_set),
+            "rouge_scores": {
+                "rouge_l_f": scores["rouge-l"]["f"],
+                "rouge_1_f": scores["rouge-1"]["f"],
+                "rouge_2_f": scores["rouge-2"]["f"]
+            }
+        })
+    library_per_pair = (time.perf_counter() - start) / len(sampled)
+
+    # StoryEvaluator 逐對計算
+    evaluator = StoryEvaluator(store=object())
+    start = time.perf_counter()
+    single_results = [evaluator.evaluate_story_changes(old, new) for old, new in sampled]
+    single_per_pair = (time.perf_counter() - start) / len(sampled)
+
+    # 批次計算全部版本對
+    start = time.perf_counter()
+    batch_results = evaluate_pairs(pairs)
+    batch_per_pair = (time.perf_counter() - start) / len(pairs)
+
+    click.echo(f"nltk/rouge_chinese 逐對: {library_per_pair * 1000:.2f} 毫秒/對")
+    click.echo(f"StoryEvaluator 逐對:   {single_per_pair * 1000:.2f} 毫秒/對")
+    click.echo(
+        f"evaluate_pairs 批次:   {batch_per_pair * 1000:.3f} 毫秒/對 "
+        f"（{pair_count} 對，較原始做法快 {library_per_pair / batch_per_pair:,.0f} 倍）"
+    )
+    click.echo(
+        f"最大差異: 與函式庫 {_max_difference(library_results, batch_results):.2e}，"
+        f"與逐對計算 {_max_difference(single_results, batch_results):.2e}"
+    )
+
+
+# 冷啟動量測的命令，每個子命令都以 --help 量測解析前的載入成本
+_STARTUP_COMMANDS = [
+    ["--help"],
+    ["create-story", "--help"],
+    ["cache-stats", "--help"],
+    ["cache-stats"],
+]
+
+
+@cli.command('import-time')
+@click.option('--rounds', default=5, show_default=True, help='每個命令重複啟動次數')
+def import_time(rounds):
+    """量測各子命令在全新行程中的啟動時間"""
+    main_path = Path(__file__).with_name('main.py')
+    with tempfile.TemporaryDirectory() as tmp:
+        # 使用暫存資料庫，避免量測時修改專案資料
+        env = dict(os.environ, STORY_DB_PATH=str(Path(tmp) / 'stories.db'))
+        for args in _STARTUP_COMMANDS:
+            timings = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, str(main_path)] + args,
+                    env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True
+                )
+                timings.append(time.perf_counter() - start)
+            click.echo(
+                f"main.py {' '.join(args)}: 中位數 {statistics.median(timings) * 1000:.0f} 毫秒，"
+                f"最快 {min(timings) * 1000:.0f} 毫秒"
+            )
+
+
+# 端對端測試的互動輸入：生成第一版後提供一次反饋
+_E2E_INPUT = "AI\n短文\n樂觀\n機器人,城市\ny\n多一點對話\n4\ny\n"
+
+
+@cli.command()
+@click.option('--stories', default=5, show_default=True, help='執行 create-story 的次數')
+@click.option('--parallel', default=1, show_default=True, help='同時執行的 create-story 行程數')
+@click.option('--latency', default=0.2, show_default=True, help='模擬服務的基本延遲（秒）')
+@click.option('--jitter', default=0.1, show_default=True, help='額外隨機延遲上限（秒）')
+@click.option('--token-rate', default=500.0, show_default=True, help='模擬服務每秒生成的 token 數，0 表示不限')
+@click.option('--error-rate', default=0.0, show_default=True, help='模擬服務請求失敗的機率')
+@click.option('--transport', type=click.Choice(['http', 'inproc']), default='inproc', show_default=True,
+              help='http 經由本地 HTTP 模擬服務與 OpenAI 客戶端，inproc 在 create-story 行程內模擬')
+def e2e(stories, parallel, latency, jitter, token_rate, error_rate, transport):
+    """以模擬服務量測 create-story（含思考鏈分析與一次反饋）的端對端吞吐量"""
+    result = _run_e2e(stories, parallel, latency, jitter, token_rate, error_rate, transport)
+    click.echo(
+        f"完成 {result['completed']} 次，失敗 {result['failed']} 次，耗時 {result['elapsed_seconds']:.2f} 秒"
+        f"（{transport}，{parallel} 個行程）"
+    )
+    if result['completed']:
+        click.echo(
+            f"吞吐量: {result['stories_per_min']:.1f} 篇/分鐘，"
+            f"單次 p50 {result['session_p50_seconds']:.2f} 秒，p95 {result['session_p95_seconds']:.2f} 秒"
+        )
+
+
+def _run_e2e(stories, parallel, latency, jitter, token_rate, error_rate, transport) -> dict:
+    """在獨立行程中執行 create-story，回傳吞吐量與每次工作階段的耗時"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    main_path = Path(__file__).with_name('main.py')
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, STORY_DB_PATH=str(Path(tmp) / 'stories.db'))
+        if transport == 'http':
+            server = FakeChatServer(
+                latency=latency, jitter=jitter, token_rate=token_rate, error_rate=error_rate, seed=42
+            ).start()
+            env.update(LLM_BACKEND='openai', OPENAI_BASE_URL=server.base_url, OPENAI_API_KEY='fake-key')
+        else:
+            env.update(
+                LLM_BACKEND='fake', FAKE_LLM_LATENCY=str(latency), FAKE_LLM_JITTER=str(jitter),
+                FAKE_LLM_TOKEN_RATE=str(token_rate), FAKE_LLM_ERROR_RATE=str(error_rate)
+            )
+
+        def run(_):
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, str(main_path), 'create-story', '--no-cache'],
+                input=_E2E_INPUT, env=env, capture_output=True, text=True
+            )
+            ok = result.returncode == 0 and '發生錯誤' not in result.stderr
+            return time.perf_counter() - start, ok
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                results = list(executor.map(run, range(stories)))
+            elapsed = time.perf_counter() - start
+        finally:
+            if server:
+                server.stop()
+
+    timings = sorted(t for t, ok in results if ok)
+    return {
+        "completed": len(timings),
+        "failed": len(results) - len(timings),
+        "elapsed_seconds": elapsed,
+        "stories_per_min": len(timings) / elapsed * 60,
+        "session_p50_seconds": statistics.median(timings) if timings else None,
+        "session_p95_seconds": (statistics.quantiles(timings, n=20)[-1] if len(timings) > 1
+                                else timings[0] if timings else None)
+    }
+
+
+def _median_p95(values: list) -> tuple:
+    values = sorted(values)
+    if not values:
+        return None, None
+    return statistics.median(values), (statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0])
+
+
+def _run_daemon(sessions, parallel, latency, rounds=3) -> dict:
+    """
+    啟動常駐服務，以客戶端同時執行多個工作階段（生成第一版、一次反饋、結束），
+    回傳各請求的延遲、吞吐量，以及 history 命令以全新行程執行與經由服務執行的啟動時間
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from story_client import StoryClient
+
+    src_dir = Path(__file__).parent
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, STORY_DB_PATH=str(Path(tmp) / 'stories.db'), LLM_BACKEND='fake',
+                   FAKE_LLM_LATENCY=str(latency), FAKE_LLM_JITTER='0', FAKE_LLM_TOKEN_RATE='0',
+                   FAKE_LLM_ERROR_RATE='0')
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, str(src_dir / 'main.py'), 'serve', '--port', '0', '--quiet'],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        try:
+            url = server.stdout.readline().strip()
+            if not url:
+                raise click.ClickException("常駐服務啟動失敗")
+            startup = time.perf_counter() - start
+            client = StoryClient(url)
+            latencies = {"create": [], "revise": [], "finish": []}
+
+            def timed(kind, method, path, body=None):
+                request_start = time.perf_counter()
+                result = client.request(method, path, body)
+                latencies[kind].append(time.perf_counter() - request_start)
+                return result
+
+            def run(i):
+                session_start = time.perf_counter()
+                result = timed("create", 'POST', '/sessions', {
+                    "theme": "AI", "genre": "短文", "tone": "樂觀",
+                    "key_elements": ["機器人", f"城市{i}"], "no_cache": True
+                })
+                key = result['session_id']
+                timed("revise", 'POST', f'/sessions/{key}/revisions', {"feedback": "多一點對話", "rating": 4})
+                timed("finish", 'POST', f'/sessions/{key}/finish')
+                return time.perf_counter() - session_start, result['story_id']
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                results = list(executor.map(run, range(sessions)))
+            elapsed = time.perf_counter() - start
+
+            # 同一個查詢分別以全新行程與經由服務執行，比較每次命令的啟動成本
+            story_id = str(results[0][1])
+            commands = {
+                "cli_history": [sys.executable, str(src_dir / 'main.py'), 'history', story_id],
+                "client_history": [sys.executable, str(src_dir / 'story_client.py'), '--url', url,
+                                   'history', story_id]
+            }
+            startup_times = {}
+            for name, command in commands.items():
+                timings = []
+                for _ in range(rounds):
+                    command_start = time.perf_counter()
+                    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   check=True)
+                    timings.append(time.perf_counter() - command_start)
+                startup_times[f"{name}_seconds"] = statistics.median(timings)
+        finally:
+            server.send_signal(signal.SIGINT)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+
+    report = {
+        "startup_seconds": startup,
+        "sessions_per_min": sessions / elapsed * 60,
+        "session_p50_seconds": _median_p95([t for t, _ in results])[0]
+    }
+    for kind, values in latencies.items():
+        p50, p95 = _median_p95(values)
+        report[f"{kind}_p50_ms"] = p50 * 1000
+        report[f"{kind}_p95_ms"] = p95 * 1000
+    report.update(startup_times)
+    return report
+
+
+@cli.command()
+@click.option('--sessions', default=10, show_default=True, help='工作階段數')
+@click.option('--parallel', default=4, show_default=True, help='同時進行的工作階段數')
+@click.option('--latency', default=0.2, show_default=True, help='模擬模型的基本延遲（秒）')
+def daemon(sessions, parallel, latency):
+    """量測常駐服務的請求延遲與吞吐量，並比較全新行程與客戶端執行 history 的耗時"""
+    result = _run_daemon(sessions, parallel, latency)
+    click.echo(f"服務啟動 {result['startup_seconds']:.2f} 秒，"
+               f"吞吐量 {result['sessions_per_min']:.1f} 個工作階段/分鐘（{parallel} 個同時進行）")
+    for kind in ("create", "revise", "finish"):
+        click.echo(f"{kind}: p50 {result[f'{kind}_p50_ms']:.1f} 毫秒，p95 {result[f'{kind}_p95_ms']:.1f} 毫秒")
+    click.echo(f"history: 全新行程 {result['cli_history_seconds'] * 1000:.0f} 毫秒，"
+               f"經由服務 {result['client_history_seconds'] * 1000:.0f} 毫秒")
+
+
+def _bench_tokenize(count, length, seed) -> dict:
+    """jieba 詞典載入時間與分詞吞吐量"""
+    from tokenizer import tokenize, warm_up
+
+    start = time.perf_counter()
+    warm_up()
+    load_seconds = time.perf_counter() - start
+
+    # 每段文本都不同，不會命中分詞快取
+    samples = corpus.texts(count, length, seed)
+    chars = sum(len(t) for t in samples)
+    start = time.perf_counter()
+    tokens = sum(len(tokenize(t)) for t in samples)
+    elapsed = time.perf_counter() - start
+    return {
+        "jieba_load_seconds": load_seconds,
+        "chars_per_sec": chars / elapsed,
+        "tokens_per_sec": tokens / elapsed
+    }
+
+
+# 詞典載入量測的工作行程：載入後等待所有行程就緒，再讀取記憶體用量
+_DICT_WORKER = """
+import sys, json, time
+start = time.perf_counter()
+from tokenizer import tokenize, warm_up
+warm_up()
+tokenize(sys.argv[1])
+load_seconds = time.perf_counter() - start
+print("ready", flush=True)
+sys.stdin.readline()
+memory = {}
+with open('/proc/self/smaps_rollup') as f:
+    for line in f:
+        parts = line.split()
+        if parts[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+            memory[parts[0][:-1]] = int(parts[1]) / 1024
+print(json.dumps({"load_seconds": load_seconds, "rss_mb": memory['Rss'], "pss_mb": memory['Pss'],
+                  "private_mb": memory['Private_Clean'] + memory['Private_Dirty']}))
+"""
+
+
+def _bench_dictionary(workers, seed) -> dict:
+    """
+    同時啟動多個工作行程，比較jieba內建載入與 mmap 詞典檔的載入時間與每個行程的記憶體用量
+
+    RSS 包含共用的頁面；PSS 將共用頁面平均分攤到各行程，較能反映實際的記憶體成本。
+    """
+    sample = corpus.texts(1, 500, seed)[0]
+    src_dir = str(Path(__file__).parent)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('jieba', 'mmap'):
+            env = dict(os.environ, JIEBA_DICT_MODE=mode, JIEBA_DICT_DIR=str(Path(tmp) / 'jieba'),
+                       PYTHONPATH=src_dir)
+            if mode == 'mmap':
+                # 先建立詞典檔，量測的是之後每個行程的載入成本
+                subprocess.run([sys.executable, '-c', "from tokenizer import warm_up; warm_up()"],
+                               env=env, cwd=src_dir, check=True)
+            processes = [
+                subprocess.Popen([sys.executable, '-c', _DICT_WORKER, sample], env=env, cwd=src_dir,
+                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.stdout.readline()
+            reports = []
+            for process in processes:
+                output, _ = process.communicate("\n")
+                reports.append(json.loads(output))
+            for key in ('load_seconds', 'rss_mb', 'pss_mb', 'private_mb'):
+                results[f"{mode}_{key}"] = statistics.mean(r[key] for r in reports)
+    return results
+
+
+@cli.command()
+@click.option('--workers', default=4, show_default=True, help='同時啟動的工作行程數')
+@click.option('--seed', default=0, show_default=True, help='合成語料的隨機種子')
+def dictionary(workers, seed):
+    """比較jieba內建載入與 mmap 詞典檔在多個行程中的載入時間與記憶體用量"""
+    results = _bench_dictionary(workers, seed)
+    for mode in ('jieba', 'mmap'):
+        click.echo(
+            f"{mode}: 載入 {results[f'{mode}_load_seconds'] * 1000:.0f} 毫秒，"
+            f"每個行程 RSS {results[f'{mode}_rss_mb']:.1f} MB、PSS {results[f'{mode}_pss_mb']:.1f} MB、"
+            f"私有 {results[f'{mode}_private_mb']:.1f} MB"
+        )
+
+
+def _bench_metrics(count, length, sample, seed) -> dict:
+    """逐對與批次計算 BLEU、ROUGE 與變化率的耗時"""
+    from evaluation import StoryEvaluator
+    from batch_metrics import evaluate_pairs
+    from tokenizer import tokenize
+
+    pairs = [(tokenize(old), tokenize(new)) for old, new in corpus.synthetic_pairs(count, length, seed)]
+    evaluator = StoryEvaluator(store=object())
+    sampled = pairs[:sample]
+
+    timings = {}
+    for name, func in (("bleu", lambda o, n: evaluator.calculate_bleu_score(o, n)),
+                       ("rouge", lambda o, n: evaluator.calculate_rouge_scores(o, n)),
+                       ("change_rate", lambda o, n: evaluator.calculate_change_rate(o, n)),
+                       ("evaluate_story_changes", lambda o, n: evaluator.evaluate_story_changes(o, n))):
+        start = time.perf_counter()
+        for old, new in sampled:
+            func(old, new)
+        timings[f"{name}_ms_per_pair"] = (time.perf_counter() - start) / len(sampled) * 1000
+
+    start = time.perf_counter()
+    evaluate_pairs(pairs)
+    timings["bulk_ms_per_pair"] = (time.perf_counter() - start) / len(pairs) * 1000
+    return timings
+
+
+def _bench_history(sizes, length, seed) -> dict:
+    """analyze_version_history 在不同版本數下的耗時，cold 需要補算指標，warm 直接讀取已保存的指標"""
+    from evaluation import StoryEvaluator
+    from migrations import migrate
+    from story_store import StoryStore
+
+    results = {}
+    for size in sizes:
+        versions = corpus.version_chain(size, length, seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = StoryStore(Path(tmp) / 'history.db')
+            migrate(store.db.connection())
+            story_id = store.create_story('bench', 'AI', '短文', '樂觀', ['機器人'])
+            with store.db.transaction():
+                for number, content in enumerate(versions, start=1):
+                    store.save_version(story_id, number, 'prompt', content, '反饋', 4)
+            evaluator = StoryEvaluator(store)
+
+            start = time.perf_counter()
+            evaluator.analyze_version_history(story_id)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            evaluator.analyze_version_history(story_id)
+            warm = time.perf_counter() - start
+            store.db.close()
+        results[f"versions_{size}"] = {"cold_seconds": cold, "warm_seconds": warm}
+    return results
+
+
+def _bench_save_story(count, length, seed) -> dict:
+    """main.save_story 的新增與覆蓋寫入速率"""
+    import main
+    from migrations import migrate
+    from story_store import StoryStore
+
+    contents = corpus.texts(2, length, seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # save_story 寫入模組層級的 story_store，量測時改指向暫存資料庫
+        original = main.story_store
+        main.story_store = StoryStore(Path(tmp) / 'save.db')
+        try:
+            migrate(main.story_store.db.connection())
+            story_id = main.story_store.create_story('bench', 'AI', '短文', '樂觀', ['機器人'])
+            rates = {}
+            for label, content in (("insert", contents[0]), ("update", contents[1])):
+                start = time.perf_counter()
+                for version in range(1, count + 1):
+                    main.save_story(story_id, version, 'prompt', content, '反饋', 4)
+                rates[f"{label}_per_sec"] = count / (time.perf_counter() - start)
+            main.story_store.db.close()
+        finally:
+            main.story_store = original
+    return rates
+
+
+def _populate_archive(store, stories, versions_per_story, length, seed):
+    """以合成語料建立故事庫，每個故事的各版本由前一版修改而來"""
+    rng = random.Random(seed)
+    for index in range(stories):
+        with store.db.transaction():
+            story_id = store.create_story('bench', 'AI', '短文', '樂觀', ['機器人', '城市'])
+            chain = corpus.version_chain(versions_per_story, length, rng.randrange(1 << 30))
+            for number, content in enumerate(chain, start=1):
+                store.save_version(story_id, number, f"提示詞 {index}", content, '多一點對話', 4)
+
+
+# 執行 main.py 並在結束時回報行程的最大 RSS（VmHWM）。
+# 不使用 wait4 的 ru_maxrss，因為它包含 fork 時父行程的記憶體
+_PEAK_WRAPPER = """
+import os, sys, runpy, atexit
+def report():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                sys.stderr.write(f"\\npeak_rss_kb {line.split()[1]}\\n")
+atexit.register(report)
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+runpy.run_path(sys.argv[0], run_name='__main__')
+"""
+
+
+def _run_measured(args, env) -> tuple:
+    """執行 main.py 的命令，回傳 (耗時, 最大 RSS MB)"""
+    main_path = str(Path(__file__).with_name('main.py'))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', _PEAK_WRAPPER, main_path] + args, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    peak = [line.split()[1] for line in result.stderr.splitlines() if line.startswith('peak_rss_kb ')]
+    if result.returncode != 0 or not peak:
+        raise click.ClickException(f"main.py {' '.join(args)} 失敗: {result.stderr.strip()}")
+    return elapsed, int(peak[-1]) / 1024
+
+
+def _bench_archive(sizes, length, seed) -> dict:
+    """
+    不同大小的故事庫以各格式匯出、再匯入到新的資料庫的速率與最大 RSS
+
+    每個步驟在獨立行程中執行；記憶體用量不隨版本數增加，代表讀寫都是逐批進行。
+    """
+    from migrations import migrate
+    from story_store import StoryStore
+
+    # SQLite 的頁面快取與 mmap 會隨資料庫變大而增加（上限由設定決定），
+    # 量測時固定為較小的值，RSS 的差異才反映匯出與匯入本身
+    base_env = dict(os.environ, DB_MMAP_SIZE='0', DB_CACHE_SIZE_KB='4096')
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            source = Path(tmp) / 'source.db'
+            store = StoryStore(source)
+            migrate(store.db.connection())
+            _populate_archive(store, size // 5, 5, length, seed)
+            store.db.close()
+            rows = size // 5 * 5
+            report = {}
+            for fmt, name in (('jsonl', 'archive.jsonl.gz'), ('columnar', 'archive.cols')):
+                path = str(Path(tmp) / name)
+                env = dict(base_env, STORY_DB_PATH=str(source))
+                seconds, rss = _run_measured(['export', path, '--format', fmt], env)
+                report[f"{fmt}_export_rows_per_sec"] = rows / seconds
+                report[f"{fmt}_export_rss_mb"] = rss
+                report[f"{fmt}_bytes"] = os.path.getsize(path)
+                env = dict(base_env, STORY_DB_PATH=str(Path(tmp) / f'{fmt}.db'))
+                seconds, rss = _run_measured(['import', path], env)
+                report[f"{fmt}_import_rows_per_sec"] = rows / seconds
+                report[f"{fmt}_import_rss_mb"] = rss
+        results[f"versions_{size}"] = report
+    return results
+
+
+@cli.command()
+@click.option('--sizes', default='1000,4000', show_default=True, help='以逗號分隔的故事庫版本數')
+@click.option('--length', default=1000, show_default=True, help='每個版本的字數')
+@click.option('--seed', default=0, show_default=True, help='合成語料的隨機種子')
+def archive(sizes, length, seed):
+    """量測 export、import 在不同大小故事庫下的速率與最大記憶體用量"""
+    results = _bench_archive([int(size) for size in sizes.split(',')], length, seed)
+    for label, report in results.items():
+        for fmt in ('jsonl', 'columnar'):
+            click.echo(
+                f"{label} {fmt}: 檔案 {report[f'{fmt}_bytes']:,} bytes，"
+                f"匯出 {report[f'{fmt}_export_rows_per_sec']:,.0f} 筆/秒（RSS {report[f'{fmt}_export_rss_mb']:.1f} MB），"
+                f"匯入 {report[f'{fmt}_import_rows_per_sec']:,.0f} 筆/秒（RSS {report[f'{fmt}_import_rss_mb']:.1f} MB）"
+            )
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+@cli.command()
+@click.option('--quick', is_flag=True, help='縮小資料量，快速檢查')
+@click.option('--seed', default=0, show_default=True, help='合成語料的隨機種子')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='結果 JSON 路徑，預設為 data/benchmarks/<時間>-<提交>.json')
+@click.option('--skip-e2e', is_flag=True, help='略過端對端工作階段量測')
+def suite(quick, seed, output, skip_e2e):
+    """執行完整基準測試並將結果存為 JSON，可用 compare 比較不同提交"""
+    length = 1000
+    sizes = (10, 100) if quick else (10, 100, 1000)
+    commit, dirty = _git_commit()
+    results = {}
+
+    click.echo("分詞...")
+    results["tokenize"] = _bench_tokenize(50 if quick else 300, length, seed)
+    click.echo("jieba 詞典載入...")
+    results["jieba_dict"] = _bench_dictionary(2 if quick else 4, seed)
+    click.echo("評估指標...")
+    results["metrics"] = _bench_metrics(100 if quick else 500, length, 10 if quick else 30, seed)
+    click.echo("版本歷史分析...")
+    results["history"] = _bench_history(sizes, length, seed)
+    click.echo("保存故事...")
+    results["save_story"] = _bench_save_story(200 if quick else 2000, length, seed)
+    click.echo("匯出與匯入...")
+    results["archive"] = _bench_archive((500,) if quick else (2000,), length, seed)
+    if not skip_e2e:
+        click.echo("端對端工作階段...")
+        results["e2e"] = _run_e2e(2 if quick else 5, 1, 0.05, 0.0, 0.0, 0.0, 'inproc')
+        click.echo("常駐服務...")
+        results["daemon"] = _run_daemon(4 if quick else 10, 2, 0.05)
+
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "quick": quick
+        },
+        "results": results
+    }
+    if output is None:
+        directory = BASE_DIR / 'data' / 'benchmarks'
+        directory.mkdir(parents=True, exist_ok=True)
+        output = directory / f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json"
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for key, value in _flatten(results).items():
+        click.echo(f"{key}: {value:,.3f}")
+    click.echo(f"結果已保存至 {output}")
+
+
+def _flatten(results: dict, prefix: str = "") -> dict:
+    """將巢狀結果攤平為 {'a.b': 數值}"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.1, show_default=True, help='視為退步的變化比例')
+def compare(baseline, current, threshold):
+    """比較兩次 suite 的結果，_per_sec 越高越好，其餘耗時越低越好"""
+    with open(baseline, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(current, encoding='utf-8') as f:
+        new = json.load(f)
+    click.echo(f"{old['meta'].get('commit')} -> {new['meta'].get('commit')}")
+
+    old_flat, new_flat = _flatten(old['results']), _flatten(new['results'])
+    regressions = 0
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        before, after = old_flat[key], new_flat[key]
+        if not before or key.endswith(('completed', 'failed')):
+            continue
+        change = (after - before) / before
+        worse = -change if key.endswith('_per_sec') or key.endswith('_per_min') else change
+        flag = ""
+        if worse > threshold:
+            flag = "  << 退步"
+            regressions += 1
+        elif worse < -threshold:
+            flag = "  進步"
+        click.echo(f"{key}: {before:,.3f} -> {after:,.3f} ({change:+.1%}){flag}")
+    if regressions:
+        click.echo(f"共 {regressions} 項退步超過 {threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
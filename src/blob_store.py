@@ -0,0 +1,259 @@
+import re
+import json
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from database import get_manager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 以內容雜湊定址的文字儲存。
+# 提示詞與故事內容依段落切分，每個段落只存一次並以雜湊引用：
+# 修改版的提示詞包含前一版的完整故事與創作指南，這些段落都會與既有的內容共用。
+# 原文較大的內容會壓縮，引用次數歸零時刪除。
+
+# 分段方式：在段落結尾切開的機率為 1/CHUNK_SPREAD，只由段落本身的雜湊決定，
+# 因此同一串段落嵌入在不同提示詞中時仍會切出相同的分段；分段超過 CHUNK_MAX_BYTES 時強制切開
+CHUNK_SPREAD = 3
+CHUNK_MAX_BYTES = 2048
+# 分段至少這麼長才單獨存放，較短的直接寫在段落清單中
+CHUNK_MIN_BYTES = 64
+# 原文至少這麼長才嘗試壓縮
+COMPRESS_MIN_BYTES = 128
+# 解碼後文字的快取筆數，內容不會改變，不需要失效處理
+TEXT_CACHE_SIZE = 256
+
+_PARAGRAPH_BREAK = re.compile(r'(\n+)')
+
+
+def compress(data: bytes):
+    """有安裝 zstandard 時使用 zstd，否則使用 zlib"""
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    return 'zlib', zlib.compress(data, 6)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'none':
+        return data
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"無法解壓縮的格式: {codec}")
+
+
+def text_hash(text: str) -> str:
+    """128 位元的 BLAKE2b 雜湊，段落清單中的每個引用只佔 32 字元"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _is_boundary(paragraph: str) -> bool:
+    return hashlib.blake2b(paragraph.encode('utf-8'), digest_size=1).digest()[0] % CHUNK_SPREAD == 0
+
+
+def split_chunks(text: str) -> list:
+    """
+    依段落切分為分段清單
+
+    Returns:
+        list: 足夠長的分段為 (hash, 分段)，其餘片段（分段間的換行、短分段）為字串，依序串接即為原文
+    """
+    entries = []
+
+    def add(piece):
+        if len(piece.encode('utf-8')) >= CHUNK_MIN_BYTES:
+            entries.append((text_hash(piece), piece))
+        elif entries and isinstance(entries[-1], str):
+            entries[-1] += piece
+        else:
+            entries.append(piece)
+
+    pieces = _PARAGRAPH_BREAK.split(text)
+    current, size = [], 0
+    for index in range(0, len(pieces), 2):
+        paragraph = pieces[index]
+        separator = pieces[index + 1] if index + 1 < len(pieces) else ""
+        if not paragraph:
+            if current:
+                current.append(separator)
+            elif separator:
+                add(separator)
+            continue
+        current.append(paragraph)
+        size += len(paragraph.encode('utf-8'))
+        if separator and (_is_boundary(paragraph) or size >= CHUNK_MAX_BYTES):
+            add("".join(current))
+            add(separator)
+            current, size = [], 0
+        elif separator:
+            current.append(separator)
+    if current:
+        add("".join(current))
+    return entries
+
+
+def _encode(data: bytes):
+    if len(data) >= COMPRESS_MIN_BYTES:
+        codec, body = compress(data)
+        if len(body) < len(data):
+            return codec, body
+    return 'none', data
+
+
+class BlobStore:
+    """
+    blobs 資料表的存取
+
+    每筆內容以原文的雜湊為鍵：kind 為 text 時 body 即原文；
+    為 chunks 時 body 是段落清單 (JSON)，字串為直接寫入的片段，[hash] 為引用的段落。
+    refs 記錄引用此內容的版本欄位與段落清單數，由 acquire / release 在同一交易中維護。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = get_manager(db_path)
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def acquire(self, text: str) -> str:
+        """存入文字（已存在時只增加引用次數）並回傳雜湊"""
+        key = text_hash(text)
+        with self.db.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE blobs SET refs = refs + 1 WHERE hash = ?", (key,)
+            ).rowcount
+            if updated:
+                return key
+
+            # 只有一個段落或全是短片段時，直接存放原文
+            entries = split_chunks(text)
+            if len(entries) > 1 and any(isinstance(e, tuple) for e in entries):
+                manifest = []
+                for entry in entries:
+                    if isinstance(entry, str):
+                        manifest.append(entry)
+                    else:
+                        self.acquire(entry[1])
+                        manifest.append([entry[0]])
+                kind, data = 'chunks', json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+            else:
+                kind, data = 'text', text.encode('utf-8')
+            codec, body = _encode(data)
+            conn.execute(
+                "INSERT INTO blobs (hash, kind, codec, body, size, refs) VALUES (?, ?, ?, ?, ?, 1)",
+                (key, kind, codec, body, len(text.encode('utf-8')))
+            )
+        return key
+
+    def release(self, key: str):
+        """減少引用次數，歸零時刪除，段落清單引用的段落也一併減少"""
+        with self.db.transaction() as conn:
+            conn.execute("UPDATE blobs SET refs = refs - 1 WHERE hash = ?", (key,))
+            self.release_orphan(key)
+
+    def release_orphan(self, key: str):
+        """引用次數已歸零時刪除，用於引用已由刪除觸發器減少的內容"""
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT refs, kind, codec, body FROM blobs WHERE hash = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] > 0:
+                return
+            self._delete(conn, key, row[1], row[2], row[3])
+
+    def _delete(self, conn, key: str, kind: str, codec: str, body: bytes):
+        conn.execute("DELETE FROM blobs WHERE hash = ?", (key,))
+        if kind == 'chunks':
+            for entry in json.loads(decompress(codec, body)):
+                if isinstance(entry, list):
+                    self.release(entry[0])
+
+    def collect_garbage(self) -> int:
+        """刪除不再被引用的內容（例如直接以 SQL 刪除版本後留下的），回傳刪除筆數"""
+        removed = 0
+        with self.db.transaction() as conn:
+            while True:
+                rows = conn.execute(
+                    "SELECT hash, kind, codec, body FROM blobs WHERE refs <= 0 LIMIT 100"
+                ).fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    self._delete(conn, *row)
+                removed += len(rows)
+        return removed
+
+    def get(self, key: str) -> str:
+        """
+        依雜湊讀回原文
+
+        Raises:
+            KeyError: 找不到對應的內容
+        """
+        with self._cache_lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return text
+
+        conn = self.db.connection()
+        row = conn.execute("SELECT kind, codec, body FROM blobs WHERE hash = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        data = decompress(row[1], row[2]).decode('utf-8')
+        if row[0] == 'chunks':
+            manifest = json.loads(data)
+            leaves = self._get_leaves(conn, [e[0] for e in manifest if isinstance(e, list)])
+            data = "".join(e if isinstance(e, str) else leaves[e[0]] for e in manifest)
+
+        with self._cache_lock:
+            self._cache[key] = data
+            while len(self._cache) > TEXT_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return data
+
+    @staticmethod
+    def _get_leaves(conn, keys: list) -> dict:
+        """一次讀取段落清單引用的所有段落"""
+        leaves = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            rows = conn.execute(
+                f"SELECT hash, codec, body FROM blobs WHERE hash IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            for key, codec, body in rows:
+                leaves[key] = decompress(codec, body).decode('utf-8')
+        missing = set(unique) - leaves.keys()
+        if missing:
+            raise KeyError(missing.pop())
+        return leaves
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
+    def stats(self) -> dict:
+        """內容筆數、實際存放大小與未被引用的筆數"""
+        conn = self.db.connection()
+        row = conn.execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(kind = 'chunks'), 0),
+                   COALESCE(SUM(codec != 'none'), 0),
+                   COALESCE(SUM(length(body)), 0),
+                   COALESCE(SUM(refs <= 0), 0)
+            FROM blobs
+        """).fetchone()
+        return {
+            "entries": row[0],
+            "manifests": row[1],
+            "compressed": row[2],
+            "stored_bytes": row[3],
+            "orphans": row[4]
+        }
@@ -5,27 +5,70 @@ import sqlite3
 # 基礎配置
 BASE_DIR = Path(__file__).parent.parent
 DATA_DIR = BASE_DIR / 'data'
-DB_PATH = DATA_DIR / 'stories.db'
-
-# 打印路径
-print(f"專案根目錄 (BASE_DIR): {str(BASE_DIR)}")
-print(f"資料目錄 (DATA_DIR): {str(DATA_DIR)}")
-print(f"資料庫路徑 (DB_PATH): {str(DB_PATH)}")
-
-# 資料庫初始化SQL
-INIT_DB = """
-DROP TABLE IF EXISTS story_records;
-
-CREATE TABLE story_records (
-    version INTEGER PRIMARY KEY,        -- 版本號作為主鍵
-    theme TEXT NOT NULL,               -- 主題
-    genre TEXT NOT NULL,               -- 類型
-    tone TEXT NOT NULL,                -- 語氣
-    elements TEXT NOT NULL,            -- 關鍵元素 (JSON字符串)
-    prompt TEXT NOT NULL,              -- 使用的提示詞
-    content TEXT NOT NULL,             -- 生成的內容
-    feedback TEXT,                     -- 用戶反饋
-    rating INTEGER,                    -- 用戶評分 (1-5)
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-"""
+DB_PATH = Path(os.getenv('STORY_DB_PATH', DATA_DIR / 'stories.db'))
+
+# SQLite 連接設定
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', 30))            # 等待寫入鎖的秒數
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 64 * 1024))     # 每條連接的頁面快取大小
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 256 * 1024 * 1024))     # 記憶體映射讀取的大小上限
+
+# 模型服務設定
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'openai')      # openai 或 fake（本地模擬，不需網路）
+LLM_MODEL = os.getenv('LLM_MODEL', 'gpt-4o-mini')
+FAKE_LLM_LATENCY = float(os.getenv('FAKE_LLM_LATENCY', 0.5))      # 模擬服務的基本延遲秒數
+FAKE_LLM_JITTER = float(os.getenv('FAKE_LLM_JITTER', 0.0))        # 額外隨機延遲上限
+FAKE_LLM_TOKEN_RATE = float(os.getenv('FAKE_LLM_TOKEN_RATE', 0))  # 每秒生成的 token 數，0 表示不限
+FAKE_LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', 0))  # 請求失敗的機率
+
+# 模型呼叫的容錯設定
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 4))             # 可重試錯誤的最多重試次數
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', 0.5))       # 指數退避的基本秒數
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', 20))          # 單次退避的上限秒數
+LLM_CALL_DEADLINE = float(os.getenv('LLM_CALL_DEADLINE', 180))     # 每次呼叫（含重試）的總期限秒數
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', 0))             # 每秒最多送出的請求數，0 表示不限制
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', 5))               # 速率限制允許的瞬間請求數
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5)) # 連續失敗幾次後開啟斷路器
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', 30))      # 斷路器開啟後多久放行試探請求
+
+# 思考鏈分析設定
+COT_MAX_WORKERS = int(os.getenv('COT_MAX_WORKERS', 5))   # 同時送出的分析請求上限，1 表示依序執行
+COT_TIMEOUT = float(os.getenv('COT_TIMEOUT', 60))        # 單次分析請求的逾時秒數
+
+# 串流生成時將已生成內容寫入資料庫的間隔秒數
+STREAM_SAVE_INTERVAL = float(os.getenv('STREAM_SAVE_INTERVAL', 2.0))
+
+# 分詞結果在記憶體中快取的文本數
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 256))
+
+# jieba 詞典載入方式：mmap 使用預先建立、各行程共用頁面的詞典檔（見 prefix_dict.py），jieba 使用其內建的載入方式
+JIEBA_DICT_MODE = os.getenv('JIEBA_DICT_MODE', 'mmap')
+JIEBA_DICT_DIR = Path(os.getenv('JIEBA_DICT_DIR', DATA_DIR / 'jieba'))   # 詞典檔存放目錄
+JIEBA_USER_DICT = os.getenv('JIEBA_USER_DICT')                           # 使用者詞典（jieba 格式），一併建入詞典檔
+
+# 思考鏈分析快取設定
+ANALYSIS_CACHE_TTL = float(os.getenv('ANALYSIS_CACHE_TTL', 7 * 24 * 3600))          # 快取有效秒數
+ANALYSIS_CACHE_MAX_BYTES = int(os.getenv('ANALYSIS_CACHE_MAX_BYTES', 20 * 1024 * 1024))  # 快取總大小上限
+
+# 根據反饋重新生成時的提示詞預算（以本地估算的 token 數計）
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 2500))   # 整個提示詞的上限
+GUIDE_TOKEN_BUDGET = int(os.getenv('GUIDE_TOKEN_BUDGET', 300))      # 濃縮後創作指南的上限
+PATCH_MIN_RATING = int(os.getenv('PATCH_MIN_RATING', 4))            # 達到此評分時只請模型回傳修改的段落
+
+# 每輪根據反饋重新生成時同時產生的候選版本數，1 表示只生成一個版本
+STORY_CANDIDATES = int(os.getenv('STORY_CANDIDATES', 1))
+CANDIDATE_RETENTION_WEIGHT = float(os.getenv('CANDIDATE_RETENTION_WEIGHT', 0.6))  # 候選評分中保留比例所佔的權重，其餘為關鍵元素涵蓋率
+
+# 常駐服務（serve）設定
+STORY_SERVER_HOST = os.getenv('STORY_SERVER_HOST', '127.0.0.1')
+STORY_SERVER_PORT = int(os.getenv('STORY_SERVER_PORT', 8780))
+STORY_SESSION_TTL = float(os.getenv('STORY_SESSION_TTL', 3600))   # 工作階段閒置多少秒後關閉
+
+# 模型回應快取設定
+RESPONSE_CACHE_MODE = os.getenv('RESPONSE_CACHE_MODE', 'off')   # off、on、record 或 replay
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 100 * 1024 * 1024))  # 壓縮後總大小上限
+
+def print_paths():
+    """打印路径"""
+    print(f"專案根目錄 (BASE_DIR): {str(BASE_DIR)}")
+    print(f"資料目錄 (DATA_DIR): {str(DATA_DIR)}")
+    print(f"資料庫路徑 (DB_PATH): {str(DB_PATH)}")
@@ -0,0 +1,104 @@
+import random
+
+# 基準測試使用的合成中文語料。相同的種子永遠產生相同的文本，
+# 讓不同提交之間的量測結果可以互相比較。
+
+CHARS = (
+    "的一是不了人我在有他這中大來上國個到說們為子和你地出道也時年得就那要下以生會自著去之過家學對可她"
+    "裡後小麼心多天而能好都然沒日於起還發成事只作當想看文無開手十用主行方又如前所本見經頭面公同三已老"
+    "從動兩長知民樣現分將外但身些與高意進把法此實回二理美點月明其種聲全工己話兒者向情部正名定女問力機"
+)
+
+# 常見詞語，讓分詞結果接近一般故事文本，而不是逐字切分
+WORDS = (
+    "機器人 城市 夜晚 記憶 陽光 街道 朋友 孩子 母親 父親 老師 學校 未來 過去 時間 世界 故事 秘密 "
+    "夢想 希望 勇氣 孤獨 溫柔 安靜 突然 慢慢 終於 已經 開始 結束 離開 回來 發現 相信 知道 明白 "
+    "看見 聽見 感覺 想起 忘記 等待 尋找 守護 微笑 眼淚 聲音 窗外 雨水 星空 海邊 森林 山谷 火車 "
+    "咖啡 書本 信件 照片 鑰匙 房間 門口 天空 月亮 花園 程式 資料 系統 螢幕 訊號 電路 實驗 科學"
+).split()
+
+_SENTENCE_END = "。！？"
+
+
+def generate_sentence(rng: random.Random) -> str:
+    """以常見詞語與單字組成一句話"""
+    parts = []
+    for _ in range(rng.randint(3, 8)):
+        if rng.random() < 0.6:
+            parts.append(rng.choice(WORDS))
+        else:
+            parts.append("".join(rng.choice(CHARS) for _ in range(rng.randint(1, 3))))
+        if rng.random() < 0.15:
+            parts.append("，")
+    if rng.random() < 0.1:
+        parts = ["「"] + parts + ["」"]
+    return "".join(parts) + rng.choice(_SENTENCE_END)
+
+
+def generate_text(rng: random.Random, length: int) -> str:
+    """產生約 length 字的文本，每三到五句一段"""
+    paragraphs, sentences, size = [], [], 0
+    target = rng.randint(3, 5)
+    while size < length:
+        sentence = generate_sentence(rng)
+        sentences.append(sentence)
+        size += len(sentence)
+        if len(sentences) >= target:
+            paragraphs.append("".join(sentences))
+            sentences, target = [], rng.randint(3, 5)
+    if sentences:
+        paragraphs.append("".join(sentences))
+    return "\n\n".join(paragraphs)
+
+
+def revise(rng: random.Random, text: str, rate: float) -> str:
+    """以約 rate 的比例改寫、刪除或新增句子，模擬根據反饋修改後的版本"""
+    paragraphs = []
+    for paragraph in text.split("\n\n"):
+        sentences, current = [], ""
+        for char in paragraph:
+            current += char
+            if char in _SENTENCE_END:
+                sentences.append(current)
+                current = ""
+        if current:
+            sentences.append(current)
+
+        revised = []
+        for sentence in sentences:
+            roll = rng.random()
+            if roll < rate * 0.6:
+                revised.append(generate_sentence(rng))
+            elif roll < rate * 0.8:
+                continue
+            elif roll < rate:
+                revised.extend([sentence, generate_sentence(rng)])
+            else:
+                revised.append(sentence)
+        if revised:
+            paragraphs.append("".join(revised))
+    return "\n\n".join(paragraphs)
+
+
+def texts(count: int, length: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [generate_text(rng, length) for _ in range(count)]
+
+
+def synthetic_pairs(count: int, length: int, seed: int = 0) -> list:
+    """產生 (舊版本, 修改後版本) 的文本對"""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(count):
+        old = generate_text(rng, length)
+        pairs.append((old, revise(rng, old, rng.uniform(0.05, 0.5))))
+    return pairs
+
+
+def version_chain(count: int, length: int, seed: int = 0) -> list:
+    """產生一個故事連續 count 個版本的內容，每一版由前一版修改而來"""
+    rng = random.Random(seed)
+    versions = [generate_text(rng, length)]
+    while len(versions) < count:
+        versions.append(revise(rng, versions[-1], rng.uniform(0.05, 0.5)))
+    return versions
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from config import (
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE
+)
+
+
+class ConnectionManager:
+    """
+    共用的 SQLite 連接管理
+
+    每個執行緒持有一條長期存在的連接，避免每次操作都重新連線，
+    並讓 sqlite3 的預編譯語句快取在多次呼叫之間重複使用。
+    資料庫使用 WAL 模式，讀取不會被寫入阻塞，多個寫入者則透過
+    busy_timeout 排隊，而不是直接回報 database is locked。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT,
+            isolation_level=None,          # 由 transaction() 明確控制交易
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute("PRAGMA foreign_keys = ON")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """取得目前執行緒的連接，fork 出的子行程會自動重新連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        寫入交易
+
+        以 BEGIN IMMEDIATE 在交易開始時就取得寫入鎖，多個寫入者會在
+        busy_timeout 內依序等待，不會在提交時才因鎖升級失敗。
+        已在交易中時直接沿用外層交易，讓多筆寫入可以合併為一次提交。
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close_thread(self):
+        """關閉目前執行緒的連接，供處理完請求即結束的執行緒釋放連接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """關閉所有執行緒的連接"""
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path) -> ConnectionManager:
+    """取得指定資料庫共用的連接管理器"""
+    key = str(db_path)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = ConnectionManager(key)
+        return _managers[key]
@@ -1,80 +1,141 @@
+import sys
+import math
 import sqlite3
-import jieba
-from nltk.translate.bleu_score import sentence_bleu
-from rouge_chinese import Rouge
-from config import DB_PATH
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_PATH, CANDIDATE_RETENTION_WEIGHT
+from prompt_engineering import RATING_RETENTION
+from story_store import StoryStore
+from tokenizer import TokenizedText, tokenize, serialize_tokens, deserialize_tokens
+from tracing import tracer, traced
 
 class StoryEvaluator:
-    def __init__(self):
+    def __init__(self, store=None):
         """初始化評估器"""
-        self.conn = sqlite3.connect(DB_PATH)
-        self.cursor = self.conn.cursor()
-        self.rouge = Rouge()
+        self.store = store or StoryStore(DB_PATH)
         
-    def __del__(self):
-        """關閉資料庫連接"""
-        self.conn.close()
+    def get_story_versions(self, story_id):
+        """獲取故事的所有版本號"""
+        return self.store.get_version_numbers(story_id)
         
-    def get_story_versions(self):
-        """獲取所有故事版本"""
-        self.cursor.execute("SELECT version FROM story_records ORDER BY version")
-        return [row[0] for row in self.cursor.fetchall()]
-        
-    def get_story_content(self, version):
+    def get_story_content(self, story_id, version):
         """獲取指定版本的故事內容"""
-        self.cursor.execute(
-            "SELECT content FROM story_records WHERE version = ?",
-            (version,)
-        )
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        result = self.store.get_version(story_id, version)
+        return result['content'] if result else None
         
-    def get_story_feedback(self, version):
+    def get_story_feedback(self, story_id, version):
         """獲取指定版本的反饋"""
-        self.cursor.execute(
-            "SELECT feedback, rating FROM story_records WHERE version = ?",
-            (version,)
-
-        return self.cursor.fetchone()
+        result = self.store.get_version(story_id, version)
+        return (result['feedback'], result['rating']) if result else None
+        
+    def tokenize(self, text):
+        """取得分詞結果，已是 TokenizedText 時直接回傳"""
+        if isinstance(text, TokenizedText):
+            return text
+        return tokenize(text)
         
     def tokenize_chinese(self, text):
         """將中文文本分詞"""
-        return list(jieba.cut(text))
+        return self.tokenize(text).tokens
         
     def calculate_bleu_score(self, reference, candidate):
-        """計算BLEU分數"""
-        reference_tokens = [self.tokenize_chinese(reference)]
-        candidate_tokens = self.tokenize_chinese(candidate)
-        return sentence_bleu(reference_tokens, candidate_tokens)
+        """
+        計算BLEU分數
+
+        與 nltk 的 sentence_bleu 預設設定相同（1至4-gram 等權重、不平滑），
+        但直接使用預先算好的 n-gram 計數。
+        """
+        reference = self.tokenize(reference)
+        candidate = self.tokenize(candidate)
+        
+        numerators, denominators = [], []
+        for n in range(1, 5):
+            candidate_counts = candidate.ngram_counts(n)
+            reference_counts = reference.ngram_counts(n)
+            numerators.append(sum(
+                min(count, reference_counts[ngram])
+                for ngram, count in candidate_counts.items()
+            ))
+            denominators.append(max(1, sum(candidate_counts.values())))
+        
+        # 沒有任何相同的詞時分數為0
+        if numerators[0] == 0:
+            return 0
+        
+        # 長度懲罰
+        ref_len, hyp_len = len(reference), len(candidate)
+        if hyp_len > ref_len:
+            brevity_penalty = 1
+        elif hyp_len == 0:
+            brevity_penalty = 0
+        else:
+            brevity_penalty = math.exp(1 - ref_len / hyp_len)
+        
+        # 某一階沒有重疊時以極小值代替，使分數趨近於0
+        precisions = [
+            num / den if num else sys.float_info.min
+            for num, den in zip(numerators, denominators)
+        ]
+        return brevity_penalty * math.exp(math.fsum(0.25 * math.log(p) for p in precisions))
         
     def calculate_rouge_scores(self, reference, candidate):
-        """計算ROUGE分數"""
-        try:
-            # 計算ROUGE分數
-            scores = self.rouge.get_scores(candidate, reference)
-            
-            # 提取各項ROUGE分數
-            rouge_l = scores[0]["rouge-l"]
-            rouge_1 = scores[0]["rouge-1"]
-            rouge_2 = scores[0]["rouge-2"]
-            
-            return {
-                "rouge_l_f": rouge_l["f"],  # F1分數
-                "rouge_1_f": rouge_1["f"],  # ROUGE-1 F1分數
-                "rouge_2_f": rouge_2["f"]   # ROUGE-2 F1分數
-            }
-        except Exception as e:
-            print(f"計算ROUGE分數時發生錯誤: {str(e)}")
+        """
+        計算ROUGE分數
+
+        以分詞結果計算，ROUGE-1/2 比較不重複的 n-gram 集合，ROUGE-L 使用最長公共子序列，
+        與 rouge_chinese 對以空格分隔的詞序列計算的結果相同。
+        """
+        reference = self.tokenize(reference)
+        candidate = self.tokenize(candidate)
+        
+        if not reference.tokens or not candidate.tokens:
+            print("計算ROUGE分數時發生錯誤: 內容為空")
             return {
                 "rouge_l_f": 0.0,
                 "rouge_1_f": 0.0,
                 "rouge_2_f": 0.0
             }
         
+        def f_score(overlap, evaluated_count, reference_count):
+            precision = overlap / evaluated_count if evaluated_count else 0.0
+            recall = overlap / reference_count if reference_count else 0.0
+            return 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+        
+        rouge_n = {}
+        for n in (1, 2):
+            candidate_ngrams = candidate.ngram_counts(n).keys()
+            reference_ngrams = reference.ngram_counts(n).keys()
+            overlap = len(candidate_ngrams & reference_ngrams)
+            rouge_n[n] = f_score(overlap, len(candidate_ngrams), len(reference_ngrams))
+        
+        lcs = self._lcs_length(reference.tokens, candidate.tokens)
+        
+        return {
+            "rouge_l_f": f_score(lcs, len(candidate), len(reference)),  # F1分數
+            "rouge_1_f": rouge_n[1],  # ROUGE-1 F1分數
+            "rouge_2_f": rouge_n[2]   # ROUGE-2 F1分數
+        }
+        
+    @staticmethod
+    def _lcs_length(x, y):
+        """最長公共子序列長度，逐列動態規劃只保留兩列"""
+        if len(x) < len(y):
+            x, y = y, x
+        previous = [0] * (len(y) + 1)
+        for token in x:
+            current = [0]
+            for j, other in enumerate(y):
+                if token == other:
+                    current.append(previous[j] + 1)
+                else:
+                    current.append(max(previous[j + 1], current[j]))
+            previous = current
+        return previous[-1]
+        
     def calculate_change_rate(self, old_content, new_content):
         """計算內容變化率"""
-        old_tokens = set(self.tokenize_chinese(old_content))
-        new_tokens = set(self.tokenize_chinese(new_content))
+        old_tokens = self.tokenize(old_content).token_set
+        new_tokens = self.tokenize(new_content).token_set
         
         # 計算變化的字詞比例
         changed_tokens = len(old_tokens.symmetric_difference(new_tokens))
@@ -82,8 +143,13 @@ class StoryEvaluator:
         
         return changed_tokens / total_tokens if total_tokens > 0 else 0
         
+    @traced('eval.changes')
     def evaluate_story_changes(self, old_content, new_content, preferences=None):
         """評估故事的變化"""
+        # 每段文本只分詞一次，所有指標共用
+        old_content = self.tokenize(old_content)
+        new_content = self.tokenize(new_content)
+        
         # 基本評估指標
         bleu_score = self.calculate_bleu_score(old_content, new_content)
         change_rate = self.calculate_change_rate(old_content, new_content)
@@ -97,71 +163,198 @@ class StoryEvaluator:
             "rouge_scores": rouge_scores
         }
         
-    def analyze_version_history(self):
-        """分析故事版本歷史"""
+    def evaluate_pairs(self, pairs):
+        """
+        批次評估多個版本對
+
+        Args:
+            pairs: [(舊內容, 新內容), ...]
+
+        Returns:
+            list[dict]: 每對的評估結果，格式與 evaluate_story_changes 相同
+        """
+        # numpy 只在批次評估時載入
+        from batch_metrics import evaluate_pairs
+        return evaluate_pairs(pairs)
+        
+    @traced('eval.rank_candidates')
+    def rank_candidates(self, previous_content, candidates, rating, key_elements):
+        """
+        為同一輪的候選版本評分並排序
+
+        保留比例以 1 - 變化率估計，越接近評分對應的目標（RATING_RETENTION）越好；
+        涵蓋率為候選內容中出現的關鍵元素比例。兩者依 CANDIDATE_RETENTION_WEIGHT 加權。
+
+        Args:
+            candidates: 候選內容列表
+            rating: 使用者給上一版本的評分
+
+        Returns:
+            list[dict]: 依分數由高到低排列，每筆包含 index（在 candidates 中的位置）、
+            score、retention、coverage 與 evaluation（與上一版本的比較結果）
+        """
+        target = RATING_RETENTION[rating]
+        elements = [e.strip() for e in key_elements if e.strip()]
+        evaluations = self.evaluate_pairs([(previous_content, content) for content in candidates])
+        ranked = []
+        for index, (content, evaluation) in enumerate(zip(candidates, evaluations)):
+            retention = 1 - evaluation['change_rate']
+            coverage = sum(e in content for e in elements) / len(elements) if elements else 1.0
+            ranked.append({
+                'index': index,
+                'score': (CANDIDATE_RETENTION_WEIGHT * (1 - abs(retention - target))
+                          + (1 - CANDIDATE_RETENTION_WEIGHT) * coverage),
+                'retention': retention,
+                'coverage': coverage,
+                'evaluation': evaluation
+            })
+        ranked.sort(key=lambda c: c['score'], reverse=True)
+        return ranked
+        
+    @traced('eval.record_metrics')
+    def record_version_metrics(self, story_id, version, content,
+                               previous_version=None, previous_content=None, evaluation=None):
+        """
+        保存新版本的分詞結果、長度與和前一版本的比較指標
+
+        Args:
+            evaluation: evaluate_story_changes 已算出的結果，提供時直接沿用不重新計算
+        """
+        if previous_version is not None and evaluation is None:
+            evaluation = self.evaluate_story_changes(previous_content, content)
+        tokens = serialize_tokens(self.tokenize(content))
+        tracer.current().set(bytes_written=len(tokens.encode('utf-8')))
+        self.store.save_tokens(story_id, version, tokens)
+        self.store.save_metrics(
+            story_id, version, len(content),
+            from_version=previous_version,
+            evaluation=evaluation if previous_version is not None else None
+        )
+        
+    def _backfill_metrics(self, story_id):
+        """補算尚未保存指標的版本，例如舊資料或內容被覆蓋過的版本"""
+        versions = self.store.get_versions(story_id)
+        stored = {row['version'] for row in self.store.get_version_history(story_id)
+                  if row['content_length'] is not None}
+        # 已保存分詞結果的版本直接載入，不再重新分詞
+        for row in versions:
+            if row['tokens'] is not None:
+                tokenize(row['content'], deserialize_tokens(row['tokens']))
+        missing = [
+            (versions[i-1] if i > 0 else None, row)
+            for i, row in enumerate(versions) if row['version'] not in stored
+        ]
+        # 缺少的版本對一次批次計算
+        evaluations = iter(self.evaluate_pairs([
+            (previous['content'], row['content']) for previous, row in missing if previous
+        ]))
+        for previous, row in missing:
+            self.record_version_metrics(
+                story_id, row['version'], row['content'],
+                previous_version=previous['version'] if previous else None,
+                previous_content=previous['content'] if previous else None,
+                evaluation=next(evaluations) if previous else None
+            )
+        
+    @traced('eval.history')
+    def analyze_version_history(self, story_id):
+        """
+        分析故事版本歷史
+
+        版本間的指標在每個版本保存時只計算一次並寫入 version_metrics，
+        這裡直接由已保存的資料組成報告，只有缺少指標的版本才會補算。
+        """
         try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cursor = conn.cursor()
-                
-                # 獲取所有版本
-                versions = cursor.execute(
-                    "SELECT version, content FROM story_records ORDER BY version"
-                ).fetchall()
-                
-                if not versions:
-                    return None
-                    
-                version_count = len(versions)
-                
-                # 分析內容長度變化
-                content_length_trend = []
-                for version, content in versions:
-                    content_length_trend.append({
-                        'version': version,
-                        'length': len(content)
-                    })
-                
-                # 分析版本間的變化
-                version_changes = []
-                for i in range(len(versions)-1):
-                    v1_content = versions[i][1]
-                    v2_content = versions[i+1][1]
-                    
-                    # 計算BLEU分數和變化率
-                    bleu_score = self.calculate_bleu_score(v1_content, v2_content)
-                    change_rate = self.calculate_change_rate(v1_content, v2_content)
-                    
-                    # 計算ROUGE分數
-                    rouge_scores = self.calculate_rouge_scores(v1_content, v2_content)
-                    
-                    version_changes.append({
-                        'from_version': versions[i][0],
-                        'to_version': versions[i+1][0],
-                        'bleu_score': bleu_score,
-                        'change_rate': change_rate,
-                        'rouge_scores': rouge_scores
-                    })
-                
-                # 獲取反饋記錄
-                feedback_analysis = []
-                for version, _ in versions:
-                    feedback = cursor.execute(
-                        "SELECT version, feedback FROM story_records WHERE version = ? AND feedback IS NOT NULL",
-                        (version,)
-                    ).fetchone()
-                    if feedback:
-                        feedback_analysis.append({
-                            'version': feedback[0],
-                            'feedback': feedback[1]
-                        })
+            history = self.store.get_version_history(story_id)
+            
+            if not history:
+                return None
+            
+            if any(row['content_length'] is None for row in history):
+                self._backfill_metrics(story_id)
+                history = self.store.get_version_history(story_id)
                 
-                return {
-                    'version_count': version_count,
-                    'content_length_trend': content_length_trend,
-                    'version_changes': version_changes,
-                    'feedback_analysis': feedback_analysis
+            version_count = len(history)
+            
+            # 分析內容長度變化
+            content_length_trend = [
+                {'version': row['version'], 'length': row['content_length']}
+                for row in history
+            ]
+            
+            # 整理版本間的變化
+            version_changes = [
+                {
+                    'from_version': row['from_version'],
+                    'to_version': row['version'],
+                    'bleu_score': row['bleu_score'],
+                    'change_rate': row['change_rate'],
+                    'rouge_scores': row['rouge_scores']
                 }
+                for row in history if row['from_version'] is not None
+            ]
+            
+            # 整理反饋記錄
+            feedback_analysis = [
+                {'version': row['version'], 'feedback': row['feedback']}
+                for row in history if row['feedback'] is not None
+            ]
+            
+            return {
+                'version_count': version_count,
+                'content_length_trend': content_length_trend,
+                'version_changes': version_changes,
+                'feedback_analysis': feedback_analysis
+            }
                 
         except sqlite3.Error as e:
             print(f"分析版本歷史時發生錯誤: {str(e)}")
-            return None 
\ No newline at end of file
+            return None
+
+
+class BackgroundEvaluator:
+    """
+    在背景執行緒計算評估指標
+
+    新版本保存後立即送出，使用者閱讀故事與輸入反饋時同時進行分詞與 BLEU/ROUGE 計算。
+    只有一個工作執行緒，工作依送出順序執行，因此版本歷史分析一定在先前的指標寫入後才進行。
+    """
+
+    def __init__(self, evaluator: StoryEvaluator):
+        self.evaluator = evaluator
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='evaluation')
+        self._pending = set()
+
+    def _submit(self, fn, *args, **kwargs):
+        # 在送出時的 context 中執行，背景區段接在呼叫端目前的追蹤區段之下
+        future = self._executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+        return future
+
+    def record_version(self, story_id, version, content, previous_version=None, previous_content=None,
+                       evaluation=None):
+        """計算並保存新版本的指標，回傳 Future"""
+        return self._submit(
+            self.evaluator.record_version_metrics, story_id, version, content,
+            previous_version=previous_version, previous_content=previous_content,
+            evaluation=evaluation
+        )
+
+    def add_words(self, words):
+        """將自訂詞加入分詞詞典，排在之後送出的指標計算之前，回傳 Future"""
+        from tokenizer import add_words
+        return self._submit(add_words, words)
+
+    def analyze_history(self, story_id):
+        """在已送出的指標計算完成後分析版本歷史，回傳 Future"""
+        return self._submit(self.evaluator.analyze_version_history, story_id)
+
+    def close(self, wait: bool = True):
+        """等待尚未完成的工作（wait=False 時取消尚未開始的工作）並結束工作執行緒"""
+        if not wait:
+            for future in list(self._pending):
+                future.cancel()
+        # 常駐服務中每個工作階段都有自己的工作執行緒，結束前關閉它的資料庫連接
+        self._executor.submit(self.evaluator.store.db.close_thread)
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,254 @@
+import json
+import time
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_backend import LLMBackend, ChatResult, BackendError
+from corpus import CHARS
+
+# 本地模擬的 chat-completions 服務，供基準測試與負載測試在無網路環境下使用。
+# 同一段提示詞（與 seed 參數）永遠得到相同的回應內容；延遲、生成速度與錯誤率可設定。
+# 字元取自基準測試語料（corpus.CHARS），兩者保持一致。
+
+
+class FakeModel:
+    """
+    模擬模型的行為
+
+    Args:
+        latency: 每個請求開始回應前的基本延遲秒數
+        jitter: 在基本延遲上額外加入的隨機延遲上限
+        token_rate: 每秒生成的 token 數，0 表示立即生成完畢
+        error_rate: 請求失敗的機率，失敗時回傳 429（附 Retry-After）或 500
+        response_tokens: 回應的長度（以 token 計，不超過請求的 max_tokens）
+        seed: 隨機種子，讓每次測試的延遲與錯誤序列一致
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, token_rate=0.0, error_rate=0.0,
+                 response_tokens=200, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_rate = token_rate
+        self.error_rate = error_rate
+        self.response_tokens = response_tokens
+        self.request_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next_request(self):
+        """
+        決定下一個請求的延遲與是否失敗
+
+        Returns:
+            tuple[float, int | None]: (延遲秒數, 失敗時的狀態碼)
+        """
+        with self._lock:
+            self.request_count += 1
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            error = None
+            if self._random.random() < self.error_rate:
+                error = self._random.choice((429, 500))
+            return delay, error
+
+    def reply(self, messages: list, max_tokens: int = None, seed: int = None) -> str:
+        """依提示詞內容產生固定的回應，每個中文字算一個 token；指定 seed 時得到不同的回應"""
+        prompt = messages[-1].get('content', '') if messages else ''
+        if seed is not None:
+            prompt = f"{seed}\x00{prompt}"
+        rng = random.Random(int(hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:16], 16))
+        length = self.response_tokens if max_tokens is None else min(self.response_tokens, max_tokens)
+        paragraphs, sentence = [], []
+        for i in range(length):
+            sentence.append(rng.choice(CHARS))
+            if len(sentence) >= rng.randint(8, 20) or i == length - 1:
+                paragraphs.append("".join(sentence) + "。")
+                sentence = []
+        # 每三句組成一段
+        return "\n\n".join("".join(paragraphs[i:i + 3]) for i in range(0, len(paragraphs), 3))
+
+    def generation_time(self, tokens: int) -> float:
+        return tokens / self.token_rate if self.token_rate else 0.0
+
+    @staticmethod
+    def prompt_tokens(messages: list) -> int:
+        return sum(len(m.get('content', '')) for m in messages)
+
+
+class FakeBackend(LLMBackend):
+    """
+    在同一個行程內模擬模型服務，不經過 HTTP
+
+    與 OpenAI 客戶端相同地遵守 timeout：一般請求為整個請求的期限，串流為等待下一段內容的期限，
+    模擬的延遲超過時等到期限後拋出逾時錯誤。
+    """
+    name = 'fake'
+
+    def __init__(self, model: FakeModel = None, **options):
+        self.model = model or FakeModel(**options)
+
+    @staticmethod
+    def _wait(seconds: float, timeout: float = None):
+        if timeout is not None and seconds > timeout:
+            time.sleep(max(0.0, timeout))
+            raise BackendError(f"模擬的請求逾時（{max(0.0, timeout):.1f} 秒）", timeout=True)
+        time.sleep(seconds)
+
+    def _start(self, timeout: float = None):
+        delay, error = self.model.next_request()
+        self._wait(delay, timeout)
+        if error == 429:
+            raise BackendError("模擬的速率限制", status_code=429, retry_after=1.0)
+        if error:
+            raise BackendError("模擬的服務錯誤", status_code=error)
+
+    def chat(self, messages: list, **params) -> ChatResult:
+        timeout = params.get('timeout')
+        expires = time.monotonic() + timeout if timeout is not None else None
+        self._start(timeout)
+        content = self.model.reply(messages, params.get('max_tokens'), params.get('seed'))
+        self._wait(self.model.generation_time(len(content)),
+                   expires - time.monotonic() if expires is not None else None)
+        return ChatResult(content, self.model.prompt_tokens(messages), len(content))
+
+    def stream_chat(self, messages: list, **params):
+        timeout = params.get('timeout')
+        self._start(timeout)
+        content = self.model.reply(messages, params.get('max_tokens'), params.get('seed'))
+        for i in range(0, len(content), 4):
+            chunk = content[i:i + 4]
+            self._wait(self.model.generation_time(len(chunk)), timeout)
+            yield chunk
+
+
+class FakeChatHandler(BaseHTTPRequestHandler):
+    """模擬 OpenAI /v1/chat/completions 端點"""
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        model = self.server.model
+
+        # 模擬模型延遲與錯誤
+        delay, error = model.next_request()
+        time.sleep(delay)
+        if error:
+            self._error(error)
+            return
+
+        messages = body.get('messages', [])
+        content = model.reply(messages, body.get('max_tokens'), body.get('seed'))
+        if body.get('stream'):
+            self._stream(body, content)
+            return
+
+        time.sleep(model.generation_time(len(content)))
+        prompt_tokens = model.prompt_tokens(messages)
+        payload = {
+            "id": f"chatcmpl-fake-{model.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model', 'fake'),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content)
+            }
+        }
+        self._send_json(200, payload)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status):
+        """以 OpenAI 的錯誤格式回應，429 附帶 Retry-After"""
+        if status == 429:
+            error = {"message": "模擬的速率限制", "type": "rate_limit_error", "code": "rate_limit_exceeded"}
+            self._send_json(status, {"error": error}, {"Retry-After": "1"})
+        else:
+            error = {"message": "模擬的服務錯誤", "type": "server_error", "code": None}
+            self._send_json(status, {"error": error})
+
+    def _stream(self, body, content):
+        """以 server-sent events 逐段回傳內容"""
+        model = self.server.model
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        created = int(time.time())
+        for i in range(0, len(content), 4):
+            chunk = {
+                "id": f"chatcmpl-fake-{model.request_count}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get('model', 'fake'),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": content[i:i + 4]},
+                    "finish_reason": None
+                }]
+            }
+            time.sleep(model.generation_time(len(content[i:i + 4])))
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # 不輸出每個請求的存取日誌
+        pass
+
+
+class FakeChatServer(ThreadingHTTPServer):
+    """
+    以 HTTP 提供的模擬服務，參數與 FakeModel 相同
+
+    OpenAI 客戶端將 OPENAI_BASE_URL 設為 base_url 即可連上。
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        super().__init__((host, port), FakeChatHandler)
+        self.model = FakeModel(**options)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        return self.model.request_count
+
+    def start(self):
+        """在背景執行緒啟動服務"""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    server = FakeChatServer(port=8765)
+    print(f"模擬服務已啟動: {server.base_url}")
+    server.serve_forever()
@@ -0,0 +1,187 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    LLM_BACKEND,
+    LLM_RATE_LIMIT,
+    LLM_RATE_BURST,
+    FAKE_LLM_LATENCY,
+    FAKE_LLM_JITTER,
+    FAKE_LLM_TOKEN_RATE,
+    FAKE_LLM_ERROR_RATE
+)
+
+# 模型服務介面：main.py 只透過這裡的 chat / stream_chat / batch_chat 呼叫模型，
+# 實際的服務可以是 OpenAI，也可以是不需網路的本地模擬服務。
+
+
+class BackendError(Exception):
+    """
+    模型服務回報的錯誤
+
+    Args:
+        status_code: HTTP 狀態碼，連線錯誤或逾時時為 None
+        retry_after: 服務建議的重試等待秒數
+        timeout: 是否為逾時
+    """
+
+    def __init__(self, message: str, status_code: int = None, retry_after: float = None,
+                 timeout: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.timeout = timeout
+
+
+class ChatResult:
+    """一次對話請求的回應內容與服務回報的 token 用量"""
+    __slots__ = ('content', 'prompt_tokens', 'completion_tokens')
+
+    def __init__(self, content: str, prompt_tokens: int = None, completion_tokens: int = None):
+        self.content = content
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class LLMBackend:
+    """
+    模型服務介面
+
+    子類別實作 chat 與 stream_chat；batch_chat 預設以執行緒同時送出多個 chat 請求。
+    """
+    name = None
+
+    def chat(self, messages: list, **params) -> ChatResult:
+        raise NotImplementedError
+
+    def stream_chat(self, messages: list, **params):
+        """逐段產生回應文字"""
+        raise NotImplementedError
+
+    def batch_chat(self, requests: list, max_workers: int = 5) -> list:
+        """
+        同時送出多個請求
+
+        Args:
+            requests: [{'messages': [...], **params}, ...]
+
+        Returns:
+            list: 依輸入順序排列的 ChatResult，失敗的請求位置放入對應的例外
+        """
+        def run(request):
+            request = dict(request)
+            messages = request.pop('messages')
+            try:
+                return self.chat(messages, **request)
+            except Exception as e:
+                return e
+
+        workers = max(1, min(max_workers, len(requests)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, requests))
+
+
+class OpenAIBackend(LLMBackend):
+    """
+    OpenAI chat-completions 服務
+
+    金鑰與服務位址沿用 openai 套件的 OPENAI_API_KEY、OPENAI_BASE_URL 環境變數。
+    重試由 resilience.ResilientBackend 統一處理，因此關閉 openai 套件內建的重試。
+    """
+    name = 'openai'
+
+    def __init__(self, api_key: str = None, base_url: str = None):
+        import openai
+        self._openai = openai
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+    def _translate(self, e):
+        """將 openai 的例外轉為 BackendError，保留狀態碼與 Retry-After"""
+        openai = self._openai
+        if isinstance(e, openai.APITimeoutError):
+            return BackendError(str(e), timeout=True)
+        if isinstance(e, openai.APIStatusError):
+            retry_after = None
+            value = e.response.headers.get('retry-after') if e.response is not None else None
+            if value:
+                try:
+                    retry_after = float(value)
+                except ValueError:
+                    pass
+            return BackendError(str(e), status_code=e.status_code, retry_after=retry_after)
+        if isinstance(e, openai.APIConnectionError):
+            return BackendError(str(e))
+        return e
+
+    def chat(self, messages: list, **params) -> ChatResult:
+        try:
+            response = self.client.chat.completions.create(messages=messages, **params)
+        except self._openai.OpenAIError as e:
+            raise self._translate(e) from e
+        usage = response.usage
+        return ChatResult(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None
+        )
+
+    def stream_chat(self, messages: list, **params):
+        try:
+            response = self.client.chat.completions.create(messages=messages, stream=True, **params)
+            for chunk in response:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except self._openai.OpenAIError as e:
+            raise self._translate(e) from e
+
+
+def create_backend(name: str = LLM_BACKEND, resilient: bool = True) -> LLMBackend:
+    """
+    依名稱建立模型服務
+
+    Args:
+        name: 'openai' 或 'fake'（本地模擬，延遲、生成速度與錯誤率由 FAKE_LLM_* 環境變數設定）
+        resilient: 是否加上重試、期限、速率限制與斷路器（見 resilience.py）
+    """
+    if name == 'openai':
+        backend = OpenAIBackend()
+    elif name == 'fake':
+        from fake_llm_server import FakeBackend
+        backend = FakeBackend(
+            latency=FAKE_LLM_LATENCY,
+            jitter=FAKE_LLM_JITTER,
+            token_rate=FAKE_LLM_TOKEN_RATE,
+            error_rate=FAKE_LLM_ERROR_RATE
+        )
+    else:
+        raise ValueError(f"不支援的模型服務: {name}")
+
+    if not resilient:
+        return backend
+    from resilience import ResilientBackend
+    from rate_limiter import RateLimiter
+    limiter = RateLimiter(LLM_RATE_LIMIT, LLM_RATE_BURST) if LLM_RATE_LIMIT else None
+    return ResilientBackend(backend, limiter=limiter)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    """取得目前使用的模型服務，第一次使用時才建立"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: LLMBackend):
+    """替換目前使用的模型服務，例如基準測試改用本地模擬服務"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
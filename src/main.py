@@ -1,143 +1,190 @@
 import os
+import csv
 import click
 import sqlite3
-import logging
+import time
+import uuid
 from datetime import datetime
-from openai import OpenAI
+from functools import partial
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from config import (
-    INIT_DB,
+    print_paths,
     BASE_DIR,
     DATA_DIR,
-    DB_PATH
-    
+    DB_PATH,
+    LLM_MODEL,
+    RESPONSE_CACHE_MODE,
+    COT_MAX_WORKERS,
+    COT_TIMEOUT,
+    STREAM_SAVE_INTERVAL,
+    STORY_CANDIDATES,
+    STORY_SERVER_HOST,
+    STORY_SERVER_PORT,
+    STORY_SESSION_TTL
 )
 from prompt_engineering import (
     generate_story_prompt,
-    generate_regenerate_prompt,
     chain_of_thought,
-    SYSTEM_PROMPT
+    SYSTEM_PROMPT,
+    ANALYSIS_SUMMARY_REQUEST,
+    GUIDE_SYSTEM_PROMPT,
+    GUIDE_PROMPT_TEMPLATE,
+    RATING_RETENTION
 )
 import json
-import jieba
-from evaluation import StoryEvaluator
-
-# 設置jieba的日誌級別為WARNING以上，避免顯示載入訊息
-jieba.setLogLevel(logging.WARNING)
+from analysis_cache import AnalysisCache, normalize_preferences
+from migrations import migrate
+from archive import restore_indexes
+from story_store import StoryStore
+from rate_limiter import RateLimiter
+from llm_backend import get_backend, set_backend, create_backend, BackendError
+from resilience import ResilientBackend, find_resilience_layer
+from response_cache import ResponseCache, CachingBackend
+from search_index import SearchIndex
+from tracing import tracer, span, traced, format_summary
+from prompt_budget import assemble_regenerate_prompt, apply_patch, count_tokens
+from story_views import (
+    print_history_analysis,
+    print_prompt_stats,
+    print_generation,
+    print_session_summary,
+    print_search_results
+)
 
-# 預先載入jieba
-jieba.initialize()
+# openai（透過 llm_backend）、jieba、numpy 等較重的模組只在實際需要的命令中才載入，
+# 讓 --help 與簡單查詢不必付出這些初始化成本
 
 #程式碼全部都是繁體
-# 加載環境變量和初始化客戶端
+# 加載環境變量
 load_dotenv()
-client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+story_store = StoryStore(DB_PATH)
+analysis_cache = AnalysisCache(DB_PATH)
+response_cache = ResponseCache(DB_PATH)
+search_index = SearchIndex(DB_PATH)
+
+# 思考鏈分析與創作指南的模型參數，同時作為快取鍵的一部分
+COT_ANALYSIS_PARAMS = {"model": LLM_MODEL, "temperature": 0.7, "max_tokens": 300}
+COT_GUIDE_PARAMS = {"model": LLM_MODEL, "temperature": 0.7, "max_tokens": 1000}
+# 故事生成的模型參數
+STORY_PARAMS = {"model": LLM_MODEL, "temperature": 0.8, "max_tokens": 3000}
+
 
 def init_db():
-    """初始化資料庫"""
-    # 確保data目錄存在
-    DATA_DIR.mkdir(exist_ok=True)
-    # 連接資料庫並創建、初始化資料庫
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.executescript(INIT_DB)
-
-def save_story(version: int, theme: str, genre: str, tone: str, elements: list, 
-               prompt: str, content: str, feedback: str = None, rating: int = None):
-    #第一次生成(version=1)時feedback與rating為None
+    """初始化資料庫，首次執行時建立資料表，之後只做結構版本檢查與必要的遷移"""
+    # 確保資料庫所在目錄存在
+    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    migrate(story_store.db.connection())
+    # 上次匯入中途被終止時，重建當時暫時移除的索引
+    restore_indexes(story_store.db)
+
+def start_story(session_id: str, theme: str, genre: str, tone: str, elements: list) -> int:
     """
-    保存故事記錄
-    
+    建立新故事記錄
+
+    Returns:
+        int: 故事編號
+
     Raises:
         ValueError: 當輸入參數驗證失敗時
         sqlite3.Error: 當資料庫操作失敗時
     """
-    # 1. 輸入驗證
-    if not all([version, theme, genre, tone, elements, prompt, content]):
+    if not all([session_id, theme, genre, tone, elements]):
         raise ValueError("必填欄位不能為空")
     
-    if rating is not None and not (1 <= rating <= 5):
-        raise ValueError("評分必須在1-5之間")
-    
     if not isinstance(elements, list):
         raise ValueError("elements必須是列表類型")
     
-    # 2. 資料預處理
     try:
-        elements_json = json.dumps(elements, ensure_ascii=False)
-    except Exception as e:
+        return story_store.create_story(session_id, theme, genre, tone, elements)
+    except TypeError as e:
         raise ValueError(f"elements轉換JSON失敗: {str(e)}")
+    except sqlite3.Error as e:
+        raise sqlite3.Error(f"資料庫操作失敗: {str(e)}")
+
+@traced('db.save_story')
+def save_story(story_id: int, version: int, prompt: str, content: str,
+               feedback: str = None, rating: int = None):
+    #第一次生成(version=1)時feedback與rating為None
+    """
+    保存故事版本，同一版本重複保存時會覆蓋
     
-    # 3. 資料庫操作
+    Raises:
+        ValueError: 當輸入參數驗證失敗時
+        sqlite3.Error: 當資料庫操作失敗時
+    """
+    # 1. 輸入驗證
+    if not all([story_id, version, prompt, content]):
+        raise ValueError("必填欄位不能為空")
+    
+    if rating is not None and not (1 <= rating <= 5):
+        raise ValueError("評分必須在1-5之間")
+    
+    # 2. 資料庫操作
+    tracer.current().set(bytes_written=sum(
+        len(text.encode('utf-8')) for text in (prompt, content, feedback) if text
+    ))
     try:
-        # 連接資料庫
-        with sqlite3.connect(DB_PATH) as conn:
-            cursor = conn.cursor()
-            try:
-                # 檢查版本是否已存在
-                existing = cursor.execute(
-                    "SELECT version FROM story_records WHERE version = ?",
-                    (version,)
-                ).fetchone()
-                if existing:
-                    # 如果存在，則更新
-                    cursor.execute("""
-                        UPDATE story_records 
-                        SET theme = ?, genre = ?, tone = ?, elements = ?,
-                            prompt = ?, content = ?, feedback = ?, rating = ?
-                        WHERE version = ?
-                    """, (theme, genre, tone, elements_json, prompt, content, 
-                          feedback, rating, version))
-                else:
-                    # 如果不存在，則插入
-                    cursor.execute("""
-                        INSERT INTO story_records 
-                        (version, theme, genre, tone, elements, prompt, 
-                         content, feedback, rating)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    """, (version, theme, genre, tone, elements_json, prompt,
-                          content, feedback, rating))
-                conn.commit()
-                
-            except sqlite3.Error as e:
-                # 如果出錯，撤銷更改
-                conn.rollback()
-                raise sqlite3.Error(f"資料庫操作失敗: {str(e)}")     
+        story_store.save_version(story_id, version, prompt, content, feedback, rating)
     except sqlite3.Error as e:
-        raise sqlite3.Error(f"資料庫連接失敗: {str(e)}")
+        raise sqlite3.Error(f"資料庫操作失敗: {str(e)}")
 
-def analyze_with_chain_of_thought(preferences: dict) -> str:
+@traced('cot.analysis')
+def analyze_with_chain_of_thought(preferences: dict, max_workers: int = COT_MAX_WORKERS,
+                                  use_cache: bool = True) -> str:
     """
     使用思考鏈分析故事元素並生成精簡的背景分析
+
+    Args:
+        preferences: 故事偏好設定
+        max_workers: 同時送出的分析請求上限，1 表示依序執行
+        use_cache: 是否使用快取的分析結果，相同偏好可直接跳過整個分析階段
     """
     # 獲取所有思考提示詞
-    thought_prompts = chain_of_thought(preferences)
+    thought_prompts = chain_of_thought(normalize_preferences(preferences))
     analysis_results = []
     
-    # 為每個思考方向添加引導
-    summary_request = """
-
-    請以自由的方式總結你的想法：
-    - 提供2-3個最具啟發性的見解
-    - 說明這些見解如何幫助故事創作
-    - 用生動的語言表達你的思考
-    """
+    # 以偏好、提示詞模板與模型參數查詢快取
+    cache_key = None
+    if use_cache:
+        cache_key = analysis_cache.make_key(
+            preferences,
+            thought_prompts + [SYSTEM_PROMPT, ANALYSIS_SUMMARY_REQUEST,
+                               GUIDE_SYSTEM_PROMPT, GUIDE_PROMPT_TEMPLATE],
+            {"analysis": COT_ANALYSIS_PARAMS, "guide": COT_GUIDE_PARAMS}
+        )
+        cached = analysis_cache.get(cache_key)
+        tracer.current().set(cache_hit=cached is not None)
+        if cached:
+            return cached['guide']
     
-    # 對每個思考方向進行分析
-    for prompt in thought_prompts:
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": prompt + summary_request}
-                ],
-                temperature=0.7,
-                max_tokens=300
-            )
-            analysis_results.append(response.choices[0].message.content)
-        except Exception as e:
-            print(f"思考鏈分析時發生錯誤: {str(e)}")
-            continue
+    # 同時送出各思考方向的分析，並依原順序收集結果
+    requests = [
+        {
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt + ANALYSIS_SUMMARY_REQUEST}
+            ],
+            "timeout": COT_TIMEOUT,
+            **COT_ANALYSIS_PARAMS
+        }
+        for prompt in thought_prompts
+    ]
+    failed = 0
+    with span('cot.directions', requests=len(requests)) as directions_span:
+        for result in get_backend().batch_chat(requests, max_workers=max_workers):
+            if isinstance(result, Exception):
+                print(f"思考鏈分析時發生錯誤: {str(result)}")
+                failed += 1
+                continue
+            directions_span.set(prompt_tokens=result.prompt_tokens, completion_tokens=result.completion_tokens)
+            analysis_results.append(result.content)
+        directions_span.set(failed=failed)
+    if failed == len(thought_prompts):
+        raise BackendError("所有思考方向的分析都失敗")
+    if failed:
+        print(f"{failed}/{len(thought_prompts)} 個思考方向分析失敗，創作指南將缺少這些方向")
     
     # 將所有分析整合為上下文
     context = "\n\n創作思路：\n" + "\n---\n".join(
@@ -146,58 +193,400 @@ def analyze_with_chain_of_thought(preferences: dict) -> str:
     
     # 整合所有分析為創作指南
     try:
-        final_summary = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "您是一位深諳文學創作的智者，請將這些思考整合為富有洞見的創作指南。"},
-                {"role": "user", "content": f"""
-                請將這些創作思路提煉為一份優雅簡潔的創作指南：
-
-                {context}
-
-                要求：
-                - 提供富有啟發性的創作建議
-                - 保持文學性與實用性的平衡
-                - 讓每個建議都能啟發創作靈感
-                - 注重表達的優美與準確
-                """}
-            ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+        with span('cot.guide') as guide_span:
+            result = get_backend().chat(
+                [
+                    {"role": "system", "content": GUIDE_SYSTEM_PROMPT},
+                    {"role": "user", "content": GUIDE_PROMPT_TEMPLATE.format(context=context)}
+                ],
+                timeout=COT_TIMEOUT,
+                **COT_GUIDE_PARAMS
+            )
+            guide_span.set(prompt_tokens=result.prompt_tokens, completion_tokens=result.completion_tokens)
+        guide = result.content
         
-        return final_summary.choices[0].message.content
+        # 只快取所有方向都成功的完整結果
+        if cache_key and len(analysis_results) == len(thought_prompts):
+            analysis_cache.put(cache_key, analysis_results, guide)
+        return guide
     except Exception as e:
         print(f"最終總結生成失敗: {str(e)}")
         return context
 
-def call_openai_api(prompt: str) -> str:
-    """調用OpenAI API"""
+@traced('llm.generate')
+def call_openai_api(prompt: str, on_chunk=None, usage: dict = None) -> str:
+    """
+    調用OpenAI API
+
+    Args:
+        prompt: 提示詞
+        on_chunk: 若提供則以串流方式請求，每收到一段內容就以該段文字呼叫一次
+        usage: 若提供則填入服務回報的 prompt_tokens 與 completion_tokens（僅非串流模式）
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.8,
-            max_tokens=3000
-        )
-        return response.choices[0].message.content
+        if on_chunk is None:
+            result = get_backend().chat(messages, **STORY_PARAMS)
+            tracer.current().set(prompt_tokens=result.prompt_tokens, completion_tokens=result.completion_tokens)
+            if usage is not None and result.completion_tokens is not None:
+                usage['prompt_tokens'] = result.prompt_tokens
+                usage['completion_tokens'] = result.completion_tokens
+            return result.content
+
+        parts = []
+        for delta in get_backend().stream_chat(messages, **STORY_PARAMS):
+            parts.append(delta)
+            on_chunk(delta)
+        # 串流回應沒有用量資訊，記錄收到的段數與字數
+        tracer.current().set(stream=True, chunks=len(parts), characters=sum(len(p) for p in parts))
+        return "".join(parts)
+    except BackendError:
+        # 重試、期限與斷路器已在 resilience 處理，保留原本的錯誤類型
+        raise
     except Exception as e:
-        raise Exception(f"調用OpenAI API失敗: {str(e)}")
+        raise BackendError(f"調用模型服務失敗: {str(e)}") from e
+
+@traced('llm.candidates')
+def generate_candidates(prompt: str, count: int) -> list:
+    """
+    同時送出多個生成請求，回傳成功的候選內容
+
+    每個請求帶不同的 seed，啟用回應快取時各個候選分別記錄與回放。
+
+    Raises:
+        BackendError: 所有請求都失敗時
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+    results = get_backend().batch_chat(
+        [{"messages": messages, **STORY_PARAMS, "seed": seed} for seed in range(1, count + 1)],
+        max_workers=count
+    )
+    contents = [r.content for r in results if not isinstance(r, Exception)]
+    tracer.current().set(
+        candidates=count, failed=count - len(contents),
+        completion_tokens=sum(r.completion_tokens or 0 for r in results if not isinstance(r, Exception))
+    )
+    if not contents:
+        error = results[0]
+        if isinstance(error, BackendError):
+            raise error
+        raise BackendError(f"調用模型服務失敗: {str(error)}") from error
+    return contents
+
+def stream_story(prompt: str, save_partial, on_text) -> str:
+    """
+    串流生成故事，每收到一段內容就交給 on_text 顯示，並定期保存已生成的部分
+
+    中途發生錯誤或使用者按下 Ctrl-C 時，已生成的內容會先寫入資料庫再拋出例外。
+
+    Args:
+        prompt: 提示詞
+        save_partial: 以目前已生成的內容呼叫，用於寫入資料庫
+        on_text: 以每段新生成的文字呼叫
+    """
+    parts = []
+    last_saved = time.monotonic()
+
+    def on_chunk(text):
+        nonlocal last_saved
+        parts.append(text)
+        on_text(text)
+        if time.monotonic() - last_saved >= STREAM_SAVE_INTERVAL:
+            save_partial("".join(parts))
+            last_saved = time.monotonic()
+
+    try:
+        content = call_openai_api(prompt, on_chunk=on_chunk)
+    except BaseException:
+        if parts:
+            save_partial("".join(parts))
+        raise
+    return content
+
+def _finish_trace(profile: bool):
+    """顯示區段彙總並關閉追蹤檔"""
+    if profile:
+        click.echo("========================")
+        click.echo(format_summary(tracer.summary()))
+    tracer.close()
+
+def print_backend_metrics():
+    """顯示容錯層累計的模型呼叫統計"""
+    backend = find_resilience_layer(get_backend())
+    if backend is None:
+        return
+    stats = backend.metrics.snapshot()
+    click.echo("========================")
+    click.echo(
+        f"模型呼叫: {stats['calls']} 次，成功 {stats['successes']} 次，失敗 {stats['failures']} 次，"
+        f"重試 {stats['retries']} 次，斷路器拒絕 {stats['rejected']} 次"
+    )
+    click.echo(f"速率限制等待: {stats['rate_limited_seconds']:.2f} 秒")
+    if stats['latency_p50'] is not None:
+        click.echo(f"呼叫延遲（含重試）: p50 {stats['latency_p50']:.2f} 秒，p95 {stats['latency_p95']:.2f} 秒")
+    click.echo(f"斷路器狀態: {backend.breaker.state}")
+
+def show_history_report(future, wait: bool) -> bool:
+    """
+    背景分析完成時顯示報告
+
+    Args:
+        wait: 是否等待分析完成；不等待且尚未完成時只顯示提示
+
+    Returns:
+        bool: 是否已顯示（或分析失敗而不必再顯示）
+    """
+    if future is None:
+        return True
+    if not wait and not future.done():
+        click.echo("\n（版本歷史分析在背景計算中，完成後顯示）")
+        return False
+    try:
+        history_analysis = future.result()
+    except Exception as e:
+        click.echo(f"版本歷史分析失敗: {str(e)}", err=True)
+        return True
+    if history_analysis:
+        print_history_analysis(history_analysis)
+    return True
+
+
+def build_story_prompt(preferences: dict, analysis_context: str) -> str:
+    """將思考鏈分析結果加入第一版故事的提示詞"""
+    base_prompt = generate_story_prompt(preferences)
+    return f"""
+{base_prompt}
+
+故事構思參考：
+{analysis_context}
+
+請根據以上要求和構思建議，創作一個打動人心的故事。注意：
+1. 以上構思僅供參考，您可以有自己的創意發揮
+2. 請保持故事的連貫性和完整性
+3. 確保符合之前提到的所有要求
+"""
+
+class StorySession:
+    """
+    一次創作工作階段：思考鏈分析與第一版，之後依反饋逐輪重新生成
+
+    create-story 命令與常駐服務（serve）共用，各步驟回傳結果字典，顯示由呼叫端處理。
+    版本間指標在背景執行緒計算，版本歷史分析排在指標之後。
+
+    Args:
+        candidates: 每輪根據反饋同時生成的候選版本數
+        stream: 是否串流顯示，多個候選時只有第一版串流
+        custom_words: 將關鍵元素加入分詞詞典；jieba 詞典由整個行程共用，
+            常駐服務中同時進行的工作階段會互相影響分詞結果，因此服務不加入
+    """
+
+    def __init__(self, preferences: dict, cot_workers: int = COT_MAX_WORKERS, use_cache: bool = True,
+                 candidates: int = 1, stream: bool = False, custom_words: bool = True):
+        from evaluation import StoryEvaluator, BackgroundEvaluator
+        self.preferences = preferences
+        self.cot_workers = cot_workers
+        self.use_cache = use_cache
+        self.candidates = candidates
+        # 多個候選需要評分後才能決定顯示哪一個，因此重新生成時不串流
+        self.stream_revisions = stream and candidates == 1
+        # 初始化評估器，指標在背景計算，不阻塞生成與輸入
+        self.evaluator = StoryEvaluator(story_store)
+        self.background = BackgroundEvaluator(self.evaluator)
+        # 關鍵元素加入分詞詞典，計算指標時切為完整的詞
+        if custom_words:
+            self.background.add_words(preferences['key_elements'])
+        self.story_id = None
+        self.version = 0
+        self.content = None
+        self.analysis_context = None
+        self.history_report = None
+        self.started = time.perf_counter()
+        self.model_seconds = 0.0
+        # 常駐服務中同一工作階段的請求依序處理
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self._pending = None
+
+    def begin(self) -> str:
+        """思考鏈分析並建立故事記錄，回傳第一版的提示詞"""
+        preferences = self.preferences
+        # 使用思考鏈進行深入分析
+        self.analysis_context = analyze_with_chain_of_thought(
+            preferences, max_workers=self.cot_workers, use_cache=self.use_cache
+        )
+        # 將分析結果加入提示詞
+        prompt = build_story_prompt(preferences, self.analysis_context)
+        # 每次執行建立一個新故事，所有版本都歸在同一個故事下
+        self.story_id = start_story(uuid.uuid4().hex, preferences['theme'], preferences['genre'],
+                                    preferences['tone'], preferences['key_elements'])
+        # 第一個版本沒有feedback與rating
+        self._pending = {"version": 1, "prompt": prompt, "feedback": None, "rating": None, "stats": None}
+        return prompt
+
+    def revise(self, feedback: str, rating: int) -> dict:
+        """
+        根據反饋組裝下一版本的提示詞
+
+        Returns:
+            dict: 提示詞統計（見 assemble_regenerate_prompt，不含段落清單）
+        """
+        if not 1 <= rating <= 5:
+            raise ValueError("評分必須在1-5之間")
+        self.preferences['rating'] = rating  # 添加評分到preferences
+        # 串流模式需要即時顯示完整故事，因此不使用段落修改格式
+        prompt, prompt_stats = assemble_regenerate_prompt(
+            self.preferences, self.content, feedback, self.analysis_context,
+            allow_patch=not self.stream_revisions
+        )
+        self._pending = {"version": self.version + 1, "prompt": prompt, "feedback": feedback,
+                         "rating": rating, "stats": prompt_stats}
+        return {k: v for k, v in prompt_stats.items() if k != 'paragraphs'}
+
+    def generate(self, on_text=None) -> dict:
+        """
+        生成 begin 或 revise 準備好的版本並保存
+
+        Args:
+            on_text: 提供時以串流方式生成，每段新文字以此呼叫（多個候選的修改輪不串流）
+
+        Returns:
+            dict: story_id、version、content，段落修改時另有 patch，多個候選時另有 ranking
+        """
+        pending = self._pending
+        if pending is None:
+            raise ValueError("沒有待生成的版本")
+        version, prompt, prompt_stats = pending['version'], pending['prompt'], pending['stats']
+        save_version = partial(
+            save_story,
+            story_id=self.story_id,
+            version=version,
+            prompt=prompt,
+            feedback=pending['feedback'],
+            rating=pending['rating']
+        )
+        result = {"story_id": self.story_id, "version": version}
+        ranked, evaluation = None, None
+        generation_start = time.perf_counter()
+        if on_text is not None and (version == 1 or self.stream_revisions):
+            content = stream_story(prompt, lambda partial_content: save_version(content=partial_content), on_text)
+        elif version > 1 and self.candidates > 1:
+            responses = generate_candidates(prompt, self.candidates)
+            if prompt_stats['paragraphs'] is not None:
+                responses = [
+                    apply_patch(prompt_stats['paragraphs'], response) or response
+                    for response in responses
+                ]
+            # 以評分對應的保留比例與關鍵元素涵蓋率在本地選出最佳候選
+            ranked = self.evaluator.rank_candidates(
+                self.content, responses, pending['rating'], self.preferences['key_elements']
+            )
+            best = ranked[0]
+            content, evaluation = responses[best['index']], best['evaluation']
+            result['ranking'] = {
+                "count": len(responses),
+                "candidate": best['index'] + 1,
+                "score": best['score'],
+                "retention": best['retention'],
+                "target": RATING_RETENTION[pending['rating']],
+                "coverage": best['coverage']
+            }
+        else:
+            content = call_openai_api(prompt)
+            if prompt_stats and prompt_stats['paragraphs'] is not None:
+                # 模型只回傳修改的段落，套用到上一版本得到完整故事
+                patched = apply_patch(prompt_stats['paragraphs'], content)
+                if patched is not None:
+                    result['patch'] = {
+                        "response_tokens": count_tokens(content),
+                        "story_tokens": count_tokens(patched)
+                    }
+                    content = patched
+        self.model_seconds += time.perf_counter() - generation_start
+
+        # 保存新版本資訊，版本間指標在背景計算；其餘候選一併保存，之後可用 candidates 命令改選
+        with story_store.db.transaction():
+            save_version(content=content)
+            if ranked:
+                story_store.save_candidates(self.story_id, version, [
+                    dict(c, content=responses[c['index']], selected=c is ranked[0])
+                    for c in sorted(ranked, key=lambda c: c['index'])
+                ])
+        if version == 1:
+            self.background.record_version(self.story_id, version, content)
+        else:
+            self.background.record_version(
+                self.story_id, version, content,
+                previous_version=version - 1,
+                previous_content=self.content,
+                evaluation=evaluation
+            )
+            # 版本歷史分析排在指標計算之後
+            self.history_report = self.background.analyze_history(self.story_id)
+        self.version, self.content, self._pending = version, content, None
+        result['content'] = content
+        return result
+
+    def summary(self) -> dict:
+        """從開始到目前版本的耗時"""
+        return {
+            "story_id": self.story_id,
+            "version": self.version,
+            "elapsed": time.perf_counter() - self.started,
+            "model_seconds": self.model_seconds
+        }
+
+    def close(self, wait: bool = True):
+        """結束背景計算，wait 時等待已送出的指標寫入"""
+        self.background.close(wait=wait)
+
 
 @click.group()
-def cli():
+@click.option('--verbose', '-v', is_flag=True, help='顯示專案與資料庫路徑')
+@click.option('--backend', type=click.Choice(['openai', 'fake']), default=None,
+              help='模型服務，預設依 LLM_BACKEND 環境變數；fake 為不需網路的本地模擬')
+@click.option('--metrics', 'show_metrics', is_flag=True, help='結束時顯示模型呼叫的重試與延遲統計')
+@click.option('--response-cache', 'cache_mode', type=click.Choice(['off', 'on', 'record', 'replay']),
+              default=RESPONSE_CACHE_MODE, show_default=True,
+              help='模型回應快取：on 相同請求直接使用記錄，record 重新記錄，replay 只回放記錄、不呼叫模型')
+@click.option('--trace', 'trace_path', type=click.Path(dir_okay=False),
+              help='將各區段的耗時、token 用量與寫入量附加到 JSONL 追蹤檔')
+@click.option('--profile', is_flag=True, help='結束時顯示各區段的耗時彙總表')
+@click.pass_context
+def cli(ctx, verbose, backend, show_metrics, cache_mode, trace_path, profile):
     """AI故事生成工具"""
-    # 每次啟動時初始化資料庫
+    if verbose:
+        print_paths()
+    if trace_path or profile:
+        tracer.configure(trace_path, profile)
+        ctx.call_on_close(partial(_finish_trace, profile))
+    if backend:
+        set_backend(create_backend(backend))
+    if cache_mode != 'off':
+        set_backend(CachingBackend(get_backend(), response_cache, cache_mode))
+    if show_metrics:
+        ctx.call_on_close(print_backend_metrics)
+    # 每次啟動時檢查資料庫結構版本，保留既有的故事記錄
     init_db()
 
 @cli.command()
-def create_story():
+@click.option('--cot-workers', default=COT_MAX_WORKERS, show_default=True, type=click.IntRange(min=1),
+              help='思考鏈分析同時送出的請求數')
+@click.option('--no-cache', is_flag=True, help='略過思考鏈分析快取，重新分析')
+@click.option('--stream', is_flag=True, help='串流顯示生成中的故事，並定期保存已生成的部分')
+@click.option('--candidates', default=STORY_CANDIDATES, show_default=True, type=click.IntRange(1, 10),
+              help='每輪根據反饋同時生成的候選版本數，只顯示並保存評分最高的一個')
+def create_story(cot_workers, no_cache, stream, candidates):
     """創建新故事"""
-    # 初始化評估器
-    evaluator = StoryEvaluator()
+    from tokenizer import warm_up
+    
+    # 在使用者輸入與思考鏈分析的同時，於背景載入jieba詞典
+    threading.Thread(target=warm_up, daemon=True).start()
     
     # 獲取用戶輸入
     theme = click.prompt("主題 (如：AI/科幻/奇幻/愛情)", type=str)
@@ -211,118 +600,694 @@ def create_story():
         "tone": tone,
         "key_elements": key_elements
     }
+    session = StorySession(preferences, cot_workers=cot_workers, use_cache=not no_cache,
+                           candidates=candidates, stream=stream)
+    if stream and not session.stream_revisions:
+        click.echo("同時生成多個候選版本時，只有第一版以串流顯示", err=True)
+    on_text = partial(click.echo, nl=False) if stream else None
+    reported = True
     
     try:
-        # 使用思考鏈進行深入分析
-        analysis_context = analyze_with_chain_of_thought(preferences)
-        
-        # 生成初始故事
-        version = 1
-        # 將分析結果加入提示詞
-        base_prompt = generate_story_prompt(preferences)
-        prompt = f"""
-{base_prompt}
-
-故事構思參考：
-{analysis_context}
-
-請根據以上要求和構思建議，創作一個打動人心的故事。注意：
-1. 以上構思僅供參考，您可以有自己的創意發揮
-2. 請保持故事的連貫性和完整性
-3. 確保符合之前提到的所有要求
-"""
+        prompt = session.begin()
         print(f"\n生成故事的提示詞:\n{prompt}")
-        content = call_openai_api(prompt)
         
-        # 保存第一個版本，沒有feedback與rating
-        save_story(
-            version=version,
-            theme=theme,
-            genre=genre,
-            tone=tone,
-            elements=key_elements,
-            prompt=prompt,
-            content=content
-        )
-        
-        # 顯示故事
-        print("========================")
-        click.echo(f"\n第 {version} 版故事：\n")
-        click.echo(content)
+        # 生成初始故事，串流模式邊生成邊顯示
+        if stream:
+            print("========================")
+            click.echo(f"\n第 1 版故事：\n")
+        result = session.generate(on_text)
+        if stream:
+            click.echo()
+        else:
+            print_generation(result)
         
         # 循環獲取反饋並重新生成
         while click.confirm("\n您想要提供反饋嗎？"):
             feedback = click.prompt("請輸入您的反饋意見", type=str)
             rating = click.prompt("請給這個版本評分 (1-5)", type=int, default=3)
             
-            # 生成新版本    
-            version += 1
-            preferences['rating'] = rating  # 添加評分到preferences
-            base_prompt = generate_regenerate_prompt(preferences, content, feedback)
-            prompt = base_prompt + analysis_context
-            new_content = call_openai_api(prompt)
-            
-            # 評估故事變化
-            evaluation_results = evaluator.evaluate_story_changes(content, new_content, preferences)
-            
-            # 顯示評估結果
-            print("========================")
-            # 更新當前內容
-            content = new_content
-            
-            # 保存新版本資訊
-            save_story(
-                version=version,
-                theme=theme,
-                genre=genre,
-                tone=tone,
-                elements=key_elements,
-                prompt=prompt,
-                content=content,
-                feedback=feedback,
-                rating=rating
-            )
-            
-            # 顯示新版本
-            click.echo(f"\n第 {version} 版故事：\n")
-            click.echo(content)
-            
-            # 分析版本歷史
-            history_analysis = evaluator.analyze_version_history()
-            if history_analysis:
+            print_prompt_stats(session.revise(feedback, rating))
+            streaming = stream and session.stream_revisions
+            if streaming:
                 print("========================")
-                click.echo("\n版本歷史分析：")
-                click.echo(f"總版本數: {history_analysis['version_count']}")
-                
-                if history_analysis['content_length_trend']:
-                    click.echo("\n內容長度變化:")
-                    for length_data in history_analysis['content_length_trend']:
-                        click.echo(f"版本 {length_data['version']}: {length_data['length']} 字")
-                
-                if history_analysis.get('version_changes'):
-                    click.echo("\n版本間變化:")
-                    for change in history_analysis['version_changes']:
-                        click.echo(
-                            f"版本 {change['from_version']} -> {change['to_version']}:"
-                            f"\nBLEU分數: {change['bleu_score']:.2f}"
-                            f"\n變化率: {change['change_rate']:.2f}"
-                            f"\nROUGE-L: {change['rouge_scores']['rouge_l_f']:.2f}"
-                            f"\nROUGE-1: {change['rouge_scores']['rouge_1_f']:.2f}"
-                            f"\nROUGE-2: {change['rouge_scores']['rouge_2_f']:.2f}"
-                        )
-                
-                if history_analysis['feedback_analysis']:
-                    click.echo("\n歷史反饋:")
-                    for feedback_data in history_analysis['feedback_analysis']:
-                        click.echo(f"版本 {feedback_data['version']}: {feedback_data['feedback']}")
+                click.echo(f"\n第 {session.version + 1} 版故事：\n")
+            result = session.generate(on_text if streaming else None)
+            if streaming:
+                click.echo()
+            print_generation(result, show_content=not streaming)
+            
+            # 版本歷史分析完成時才顯示，不阻塞下一輪輸入
+            reported = show_history_report(session.history_report, wait=False)
             
             if click.confirm("您滿意這個版本嗎？", default=True):
                 break
+            if not reported and session.history_report.done():
+                reported = show_history_report(session.history_report, wait=True)
         
-        click.echo("\n感謝使用！")
+        # 離開前等待背景計算完成，確保指標都已寫入
+        if not reported:
+            show_history_report(session.history_report, wait=True)
+        print_session_summary(session.summary())
+        click.echo("感謝使用！")
         
     except Exception as e:
         click.echo(f"發生錯誤: {str(e)}", err=True)
+    finally:
+        session.close()
+
+class StoryService:
+    """
+    常駐服務的路由：以 HTTP 提供 create-story 的工作階段、版本歷史分析與全文檢索
+
+    工作階段保存在記憶體中，閒置超過 STORY_SESSION_TTL 秒後由 expire_sessions 關閉，
+    服務定期呼叫，沒有新的請求時也會回收；
+    同一工作階段的請求依序處理，不同工作階段可同時進行。
+    """
+
+    def __init__(self, session_ttl: float = STORY_SESSION_TTL):
+        self.session_ttl = session_ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._search_lock = threading.Lock()
+
+    def routes(self) -> list:
+        return [
+            ('POST', r'/sessions', self.create_session),
+            ('POST', r'/sessions/(\w+)/revisions', self.revise_session),
+            ('POST', r'/sessions/(\w+)/finish', self.finish_session),
+            ('GET', r'/stories/(\d+)/history', self.history),
+            ('GET', r'/search', self.search),
+        ]
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._sessions)}
+
+    def expire_sessions(self):
+        """關閉閒置超過 session_ttl 秒的工作階段，結束其背景計算與資料庫連接"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, session in self._sessions.items()
+                       if now - session.last_used > self.session_ttl and not session.lock.locked()]
+            sessions = [self._sessions.pop(key) for key in expired]
+        for session in sessions:
+            session.close(wait=False)
+
+    def _session(self, key: str) -> StorySession:
+        from story_server import RequestError
+        with self._lock:
+            session = self._sessions.get(key)
+        if session is None:
+            raise RequestError(404, f"找不到工作階段 {key}，可能已結束或閒置過久")
+        session.last_used = time.monotonic()
+        return session
+
+    @staticmethod
+    def _body(body) -> dict:
+        from story_server import RequestError
+        if not isinstance(body, dict):
+            raise RequestError(400, "請求內容必須是 JSON 物件")
+        return body
+
+    @staticmethod
+    def _int_field(body: dict, name: str, default: int) -> int:
+        from story_server import RequestError
+        value = body.get(name)
+        if value is None or value == '':
+            return default
+        try:
+            if isinstance(value, bool):
+                raise TypeError
+            return int(value)
+        except (TypeError, ValueError):
+            raise RequestError(400, f"{name} 必須是整數") from None
+
+    def create_session(self, query=None, body=None) -> dict:
+        """依偏好設定開始工作階段，完成思考鏈分析並生成第一版"""
+        from story_server import RequestError
+        body = self._body(body)
+        self.expire_sessions()
+        key_elements = body.get('key_elements') or []
+        if isinstance(key_elements, str):
+            key_elements = key_elements.split(',')
+        preferences = {
+            "theme": body.get('theme'),
+            "genre": body.get('genre'),
+            "tone": body.get('tone'),
+            "key_elements": key_elements
+        }
+        if not all(preferences.values()):
+            raise RequestError(400, "必填欄位不能為空: theme、genre、tone、key_elements")
+        if not all(isinstance(preferences[name], str) for name in ('theme', 'genre', 'tone')):
+            raise RequestError(400, "theme、genre、tone 必須是字串")
+        if not isinstance(key_elements, list) or not all(isinstance(e, str) for e in key_elements):
+            raise RequestError(400, "key_elements 必須是字串列表或以逗號分隔的字串")
+        cot_workers = self._int_field(body, 'cot_workers', COT_MAX_WORKERS)
+        candidates = self._int_field(body, 'candidates', STORY_CANDIDATES)
+        if cot_workers < 1:
+            raise RequestError(400, "cot_workers 必須大於 0")
+        session = StorySession(
+            preferences,
+            cot_workers=cot_workers,
+            use_cache=not body.get('no_cache'),
+            candidates=min(10, max(1, candidates)),
+            custom_words=False
+        )
+        try:
+            prompt = session.begin()
+            result = session.generate()
+        except BaseException:
+            session.close(wait=False)
+            raise
+        key = uuid.uuid4().hex
+        with self._lock:
+            self._sessions[key] = session
+        return dict(result, session_id=key, prompt=prompt)
+
+    def revise_session(self, key, query=None, body=None) -> dict:
+        """根據反饋與評分生成下一版本"""
+        from story_server import RequestError
+        body = self._body(body)
+        feedback = body.get('feedback')
+        if not feedback or not isinstance(feedback, str):
+            raise RequestError(400, "反饋不能為空，且必須是字串")
+        rating = self._int_field(body, 'rating', 3)
+        if not 1 <= rating <= 5:
+            raise RequestError(400, "評分必須在1-5之間")
+        session = self._session(key)
+        with session.lock:
+            prompt_stats = session.revise(feedback, rating)
+            result = session.generate()
+        return dict(result, prompt_stats=prompt_stats)
+
+    def finish_session(self, key, query=None, body=None) -> dict:
+        """結束工作階段，等待版本歷史分析完成後回傳報告與耗時"""
+        session = self._session(key)
+        with self._lock:
+            self._sessions.pop(key, None)
+        with session.lock:
+            history = None
+            try:
+                if session.history_report is not None:
+                    history = session.history_report.result()
+            finally:
+                session.close()
+            return dict(session.summary(), history=history)
+
+    def history(self, story_id, query=None, body=None) -> dict:
+        from evaluation import StoryEvaluator
+        from story_server import RequestError
+        history_analysis = StoryEvaluator(story_store).analyze_version_history(int(story_id))
+        if not history_analysis:
+            raise RequestError(404, f"找不到故事 {story_id} 的版本")
+        return {"history": history_analysis}
+
+    def search(self, query=None, body=None) -> dict:
+        """查詢參數為 q（以空白分隔的關鍵字）、theme、genre、tone、min_rating 與 limit"""
+        with self._search_lock:
+            indexed = search_index.sync() if search_index.pending_count() else 0
+        from story_server import RequestError
+        min_rating = self._int_field(query, 'min_rating', None)
+        limit = self._int_field(query, 'limit', 10)
+        start = time.perf_counter()
+        try:
+            results = search_index.search(
+                query.get('q', ''), theme=query.get('theme'), genre=query.get('genre'), tone=query.get('tone'),
+                min_rating=min_rating, limit=limit
+            )
+        except ValueError as e:
+            # 只有關鍵字分詞後沒有可檢索的詞時會拋出
+            raise RequestError(400, str(e)) from None
+        return {"results": results, "elapsed": time.perf_counter() - start, "indexed": indexed}
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close(wait=True)
+
+def read_preference_records(path: str, fmt: str = 'auto') -> list:
+    """
+    讀取批次生成的故事偏好
+
+    JSONL 每行一個物件，CSV 需有 theme、genre、tone、key_elements 欄位；
+    key_elements 可以是列表或以逗號分隔的字串。
+
+    Returns:
+        list[tuple]: (行號, 偏好設定)
+
+    Raises:
+        ValueError: 當格式不支援、記錄不是物件、欄位型別不符或缺少必填欄位時
+    """
+    if fmt == 'auto':
+        fmt = 'csv' if str(path).lower().endswith('.csv') else 'jsonl'
+
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            rows = [(i, row) for i, row in enumerate(csv.DictReader(f), start=2)]
+        elif fmt == 'jsonl':
+            rows = []
+            for i, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append((i, json.loads(line)))
+                except ValueError:
+                    raise ValueError(f"第 {i} 行不是有效的 JSON") from None
+        else:
+            raise ValueError(f"不支援的格式: {fmt}")
+
+    records = []
+    for line_no, row in rows:
+        if not isinstance(row, dict):
+            raise ValueError(f"第 {line_no} 行不是物件")
+        elements = row.get('key_elements') or []
+        if isinstance(elements, str):
+            elements = elements.split(',')
+        if not isinstance(elements, list) or not all(isinstance(e, str) for e in elements):
+            raise ValueError(f"第 {line_no} 行的 key_elements 必須是字串列表或以逗號分隔的字串")
+        if not all(isinstance(row.get(name) or '', str) for name in ('theme', 'genre', 'tone')):
+            raise ValueError(f"第 {line_no} 行的 theme、genre、tone 必須是字串")
+        preferences = {
+            "theme": (row.get('theme') or '').strip(),
+            "genre": (row.get('genre') or '').strip(),
+            "tone": (row.get('tone') or '').strip(),
+            "key_elements": [e.strip() for e in elements if e.strip()]
+        }
+        if not all(preferences.values()):
+            raise ValueError(f"第 {line_no} 行缺少必填欄位")
+        records.append((line_no, preferences))
+    return records
+
+def _generate_record(preferences: dict, cot_workers: int, use_cache: bool) -> dict:
+    """為單筆偏好執行思考鏈分析與第一版故事生成"""
+    start = time.perf_counter()
+    analysis_context = analyze_with_chain_of_thought(
+        preferences, max_workers=cot_workers, use_cache=use_cache
+    )
+    prompt = build_story_prompt(preferences, analysis_context)
+    usage = {}
+    content = call_openai_api(prompt, usage=usage)
+    if not content:
+        raise ValueError("模型回傳空白內容")
+    return {
+        "prompt": prompt,
+        "content": content,
+        "completion_tokens": usage.get('completion_tokens', 0),
+        "latency": time.perf_counter() - start
+    }
+
+def _save_generated(session_id: str, results: list) -> list:
+    """在同一個交易中寫入多篇生成結果，回傳故事編號"""
+    story_ids = []
+    with story_store.db.transaction():
+        for preferences, result in results:
+            story_id = start_story(
+                session_id, preferences['theme'], preferences['genre'],
+                preferences['tone'], preferences['key_elements']
+            )
+            save_story(story_id, 1, result['prompt'], result['content'])
+            story_ids.append(story_id)
+    return story_ids
+
+def _percentile(values: list, percent: float) -> float:
+    """最近排名法的百分位數"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+@cli.command()
+@click.argument('input_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'jsonl', 'csv']), default='auto',
+              show_default=True, help='輸入格式，auto 依副檔名判斷')
+@click.option('--workers', default=4, show_default=True, type=click.IntRange(min=1),
+              help='同時生成的故事數')
+@click.option('--rate', default=0.0, show_default=True, type=click.FloatRange(min=0),
+              help='每秒最多送出的模型請求數，0 表示不限制')
+@click.option('--cot-workers', default=COT_MAX_WORKERS, show_default=True, type=click.IntRange(min=1),
+              help='每篇故事思考鏈分析同時送出的請求數')
+@click.option('--commit-every', default=20, show_default=True, type=click.IntRange(min=1),
+              help='累積多少篇故事後合併為一次資料庫交易寫入')
+@click.option('--no-cache', is_flag=True, help='略過思考鏈分析快取，重新分析')
+def batch_generate(input_path, fmt, workers, rate, cot_workers, commit_every, no_cache):
+    """依檔案中的偏好設定批次生成故事"""
+    try:
+        records = read_preference_records(input_path, fmt)
+    except (ValueError, json.JSONDecodeError) as e:
+        click.echo(f"讀取輸入失敗: {str(e)}", err=True)
+        return
+    backend = get_backend()
+    layer = find_resilience_layer(backend)
+    previous_limiter = layer.limiter if layer else None
+    if rate:
+        if layer:
+            layer.limiter = RateLimiter(rate)
+        else:
+            set_backend(ResilientBackend(backend, limiter=RateLimiter(rate)))
+
+    # 同一次批次生成的故事屬於同一個工作階段
+    session_id = uuid.uuid4().hex
+    click.echo(f"共 {len(records)} 筆偏好，工作階段 {session_id}")
+
+    pending, latencies = [], []
+    completion_tokens = failures = saved = 0
+
+    def flush():
+        nonlocal saved, failures
+        if not pending:
+            return
+        try:
+            story_ids = _save_generated(session_id, [(prefs, result) for _, prefs, result in pending])
+        except (ValueError, sqlite3.Error) as e:
+            click.echo(f"寫入 {len(pending)} 篇故事失敗: {str(e)}", err=True)
+            failures += len(pending)
+        else:
+            for (line_no, _, _), story_id in zip(pending, story_ids):
+                click.echo(f"第 {line_no} 行 -> 故事 {story_id}")
+            saved += len(pending)
+        pending.clear()
+
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(_generate_record, preferences, cot_workers, not no_cache): (line_no, preferences)
+                for line_no, preferences in records
+            }
+            for future in as_completed(futures):
+                line_no, preferences = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    click.echo(f"第 {line_no} 行生成失敗: {str(e)}", err=True)
+                    failures += 1
+                    continue
+                latencies.append(result['latency'])
+                completion_tokens += result['completion_tokens']
+                pending.append((line_no, preferences, result))
+                if len(pending) >= commit_every:
+                    flush()
+            flush()
+    finally:
+        if layer:
+            layer.limiter = previous_limiter
+        set_backend(backend)
+    elapsed = time.perf_counter() - start
+
+    click.echo("========================")
+    click.echo(f"完成 {saved} 篇，失敗 {failures} 篇，耗時 {elapsed:.2f} 秒")
+    if saved:
+        click.echo(f"吞吐量: {saved / elapsed * 60:.1f} 篇/分鐘，{completion_tokens / elapsed:.1f} tokens/秒")
+        click.echo(
+            f"單篇延遲: p50 {_percentile(latencies, 50):.2f} 秒，"
+            f"p95 {_percentile(latencies, 95):.2f} 秒"
+        )
+
+@cli.command()
+@click.option('--clear', is_flag=True, help='清空思考鏈分析與模型回應快取')
+def cache_stats(clear):
+    """顯示思考鏈分析與模型回應快取統計"""
+    if clear:
+        analysis_cache.clear()
+        response_cache.clear()
+        click.echo("已清空快取")
+    for label, cache in (("思考鏈分析快取", analysis_cache), ("模型回應快取", response_cache)):
+        stats = cache.stats()
+        click.echo(f"{label}:")
+        click.echo(f"  快取筆數: {stats['entries']}")
+        click.echo(f"  快取大小: {stats['bytes']} bytes")
+        click.echo(f"  命中次數: {stats['hits']}")
+        click.echo(f"  未命中次數: {stats['misses']}")
+
+@cli.command()
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, type=click.IntRange(min=1),
+              help='工作行程數')
+@click.option('--chunk-size', default=20, show_default=True, type=click.IntRange(min=1),
+              help='每個工作包含的故事數，每批結果以一個交易寫入')
+@click.option('--reuse-tokens', is_flag=True, help='沿用已保存的分詞結果，只重新計算指標')
+@click.option('--resume', is_flag=True, help='繼續上次中斷的重新計算')
+def rescore(workers, chunk_size, reuse_tokens, resume):
+    """以多個行程重新計算所有故事的分詞結果與版本間指標"""
+    from concurrent.futures.process import BrokenProcessPool
+    from rescore import Rescorer
+    rescorer = Rescorer(DB_PATH, workers=workers, chunk_size=chunk_size)
+    run = rescorer.unfinished_run() if resume else None
+    if resume and run is None:
+        click.echo("沒有未完成的重新計算，開始新的一輪")
+    if run:
+        run_id, reuse_tokens = run
+        click.echo(f"繼續第 {run_id} 輪重新計算")
+    else:
+        run_id = rescorer.start_run(reuse_tokens)
+    total = rescorer.remaining(run_id)
+    click.echo(f"待處理故事: {total}，工作行程: {workers}")
+
+    def progress(stats):
+        rate = stats['pairs'] / stats['elapsed'] if stats['elapsed'] else 0
+        click.echo(f"\r已完成 {stats['stories']}/{total} 個故事，{stats['pairs']} 個版本對"
+                   f"（{rate:,.0f} 對/秒）", nl=False)
+
+    try:
+        stats = rescorer.run(run_id, reuse_tokens, progress=progress)
+    except KeyboardInterrupt:
+        click.echo("\n已中斷，已完成的故事都已保存，可用 rescore --resume 繼續", err=True)
+        return
+    except sqlite3.Error as e:
+        click.echo(f"\n資料庫錯誤: {str(e)}，可用 rescore --resume 繼續", err=True)
+        return
+    except BrokenProcessPool:
+        click.echo("\n工作行程異常結束，已完成的故事都已保存，可用 rescore --resume 繼續", err=True)
+        return
+    except Exception as e:
+        click.echo(f"\n重新計算失敗: {type(e).__name__}: {str(e)}，已完成的故事都已保存，"
+                   f"可用 rescore --resume 繼續", err=True)
+        return
+    click.echo(f"\n完成 {stats['stories']} 個故事、{stats['versions']} 個版本、{stats['pairs']} 個版本對，"
+               f"耗時 {stats['elapsed']:.1f} 秒")
+
+
+@cli.command()
+@click.option('--host', default=STORY_SERVER_HOST, show_default=True, help='監聽位址')
+@click.option('--port', default=STORY_SERVER_PORT, show_default=True, type=click.IntRange(0, 65535),
+              help='監聽埠，0 表示由系統指定')
+@click.option('--quiet', is_flag=True, help='不輸出每個請求的處理時間')
+def serve(host, port, quiet):
+    """啟動常駐服務，預先載入jieba、模型客戶端與資料庫，供 story_client.py 連線"""
+    from story_server import StoryServer
+    from tokenizer import warm_up
+    # 預先載入 numpy，第一個評估請求不必等待
+    import batch_metrics
+
+    start = time.perf_counter()
+    warm_up()
+    # 建立模型客戶端，之後所有請求共用同一個連線池
+    get_backend()
+    service = StoryService()
+    server = StoryServer(host, port, service.routes(), status=service.status,
+                         on_thread_exit=story_store.db.close_thread,
+                         housekeeping=service.expire_sessions,
+                         housekeeping_interval=min(60, STORY_SESSION_TTL / 2), quiet=quiet)
+    click.echo(f"故事服務已啟動: {server.url}（預先載入 {time.perf_counter() - start:.2f} 秒）", err=True)
+    # 實際的位址輸出到標準輸出，--port 0 時供啟動的程式讀取
+    click.echo(server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        click.echo("\n正在關閉服務...", err=True)
+    finally:
+        server.server_close()
+        service.close()
+
+
+@cli.command()
+@click.argument('story_id', type=int)
+def history(story_id):
+    """顯示故事的版本歷史分析，缺少的指標會先補算"""
+    from evaluation import StoryEvaluator
+    history_analysis = StoryEvaluator(story_store).analyze_version_history(story_id)
+    if not history_analysis:
+        click.echo(f"找不到故事 {story_id} 的版本", err=True)
+        return
+    print_history_analysis(history_analysis)
+
+
+@cli.command()
+@click.argument('story_id', type=int)
+@click.option('--version', type=int, help='只顯示此版本的候選')
+@click.option('--select', type=int, help='以此編號的候選取代該版本的內容（需同時指定 --version）')
+@click.option('--show', is_flag=True, help='顯示候選的完整內容')
+def candidates(story_id, version, select, show):
+    """查看或改選重新生成時保存的候選版本"""
+    try:
+        if select is not None:
+            if version is None:
+                raise click.UsageError("--select 需要同時指定 --version")
+            story_store.select_candidate(story_id, version, select)
+            click.echo(f"第 {version} 版已改用候選 {select}，版本間指標將在下次查看 history 時重新計算")
+        rows = story_store.get_candidates(story_id, version)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        return
+    except sqlite3.Error as e:
+        click.echo(f"資料庫錯誤: {str(e)}", err=True)
+        return
+    if not rows:
+        click.echo(f"故事 {story_id} 沒有保存的候選版本", err=True)
+        return
+    for row in rows:
+        mark = "*" if row['selected'] else " "
+        click.echo(
+            f"{mark} 第 {row['version']} 版 候選 {row['candidate']}：分數 {row['score']:.3f}，"
+            f"保留比例 {row['retention']:.0%}，關鍵元素涵蓋率 {row['coverage']:.0%}"
+        )
+        if show:
+            click.echo(f"{row['content']}\n")
+        else:
+            click.echo(f"    {row['content'][:60].replace(chr(10), ' ')}…")
+
+
+@cli.command()
+@click.option('--compact', is_flag=True, help='將舊格式的版本改存為壓縮、去重的內容並回收檔案空間')
+@click.option('--gc', 'collect', is_flag=True, help='清除不再被引用的內容')
+@click.option('--sample', default=200, show_default=True, type=click.IntRange(min=0),
+              help='量測讀取延遲的版本數')
+def db_stats(compact, collect, sample):
+    """顯示資料庫大小、內容去重與壓縮的節省比例，以及版本讀取延遲"""
+    try:
+        if compact:
+            converted = story_store.compact_legacy()
+            click.echo(f"已轉換 {converted} 個舊格式版本")
+        if collect or compact:
+            click.echo(f"已清除 {story_store.blobs.collect_garbage()} 筆未引用的內容")
+        if compact:
+            conn = story_store.db.connection()
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        stats = story_store.storage_stats()
+        conn = story_store.db.connection()
+        keys = conn.execute(
+            "SELECT story_id, version FROM story_versions ORDER BY rowid DESC LIMIT ?", (sample,)
+        ).fetchall()
+        story_store.blobs.clear_cache()
+        timings = []
+        for story_id, version in keys:
+            start = time.perf_counter()
+            story_store.get_version(story_id, version)
+            timings.append(time.perf_counter() - start)
+    except sqlite3.Error as e:
+        click.echo(f"資料庫錯誤: {str(e)}", err=True)
+        return
+
+    files = [DB_PATH, DB_PATH.with_name(DB_PATH.name + '-wal')]
+    file_bytes = sum(path.stat().st_size for path in files if path.exists())
+    blobs = stats['blobs']
+    click.echo(f"資料庫檔案: {file_bytes:,} bytes")
+    click.echo(f"故事版本: {stats['versions']}（舊格式 {stats['legacy_versions']}）")
+    click.echo(f"提示詞與內容原文: {stats['logical_bytes']:,} bytes")
+    click.echo(f"實際存放: {stats['stored_bytes']:,} bytes")
+    if stats['logical_bytes']:
+        click.echo(f"節省: {1 - stats['stored_bytes'] / stats['logical_bytes']:.1%}")
+    click.echo(f"內容筆數: {blobs['entries']}（段落清單 {blobs['manifests']}，壓縮 {blobs['compressed']}，"
+               f"未引用 {blobs['orphans']}）")
+    if timings:
+        click.echo(f"讀取延遲（最近 {len(timings)} 個版本）: p50 {_percentile(timings, 50) * 1000:.2f} 毫秒，"
+                   f"p95 {_percentile(timings, 95) * 1000:.2f} 毫秒")
+
+
+@cli.command()
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(['auto', 'jsonl', 'columnar']), default='auto',
+              show_default=True,
+              help='auto 依副檔名判斷（.jsonl、.jsonl.gz 為 jsonl，其餘為 columnar）；'
+                   'columnar 有安裝 pyarrow 時寫為 Parquet，否則為分批壓縮的欄式格式')
+@click.option('--batch-size', default=500, show_default=True, type=click.IntRange(min=1),
+              help='每次讀取與寫出的版本數')
+def export(path, fmt, batch_size):
+    """將所有故事與版本逐批匯出為檔案，記憶體用量與故事庫大小無關"""
+    import archive
+    if fmt == 'auto':
+        fmt = 'jsonl' if path.lower().endswith(('.jsonl', '.jsonl.gz')) else 'columnar'
+    start = time.perf_counter()
+    try:
+        records = archive.iter_records(story_store, batch_size)
+        if fmt == 'jsonl':
+            count = archive.write_jsonl(path, records)
+        else:
+            count, fmt = archive.write_columnar(path, records, batch_size)
+    except sqlite3.Error as e:
+        click.echo(f"資料庫錯誤: {str(e)}", err=True)
+        return
+    elapsed = time.perf_counter() - start
+    click.echo(f"已匯出 {count} 個版本至 {path}（{fmt}，{os.path.getsize(path):,} bytes），"
+               f"耗時 {elapsed:.2f} 秒（{count / elapsed if elapsed else 0:,.0f} 筆/秒）")
+
+
+@cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=500, show_default=True, type=click.IntRange(min=1),
+              help='每個交易寫入的版本數')
+@click.option('--keep-indexes', is_flag=True, help='匯入期間保留次要索引（少量匯入到大型故事庫時較快）')
+def import_archive(path, batch_size, keep_indexes):
+    """匯入 export 產生的檔案（自動判斷格式），故事會取得新的編號"""
+    import archive
+
+    def progress(stats):
+        rate = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0
+        click.echo(f"\r已匯入 {stats['rows']} 個版本、{stats['stories']} 個故事（{rate:,.0f} 筆/秒）", nl=False)
+
+    try:
+        stats = archive.import_records(
+            story_store, archive.read_records(path, batch_size), batch_size=batch_size,
+            defer_indexes=not keep_indexes, progress=progress
+        )
+    except (ValueError, sqlite3.Error) as e:
+        # 錯誤之前的批次已提交
+        click.echo(f"\n匯入失敗: {str(e)}", err=True)
+        return
+    rate = stats['rows'] / stats['elapsed'] if stats['elapsed'] else 0
+    click.echo(f"\n完成 {stats['rows']} 個版本、{stats['stories']} 個故事，耗時 {stats['elapsed']:.2f} 秒"
+               f"（{rate:,.0f} 筆/秒）")
+    click.echo("版本間指標可用 rescore 計算，全文檢索索引會在下次檢索時建立")
+
+
+@cli.command()
+@click.argument('keywords', nargs=-1, required=True)
+@click.option('--theme', help='只顯示此主題的故事')
+@click.option('--genre', help='只顯示此類型的故事')
+@click.option('--tone', help='只顯示此語氣的故事')
+@click.option('--min-rating', type=click.IntRange(1, 5), help='只顯示評分不低於此值的版本')
+@click.option('--limit', default=10, show_default=True, type=click.IntRange(min=1), help='最多顯示筆數')
+@click.option('--rebuild', is_flag=True, help='清空並重建全文檢索索引')
+def search(keywords, theme, genre, tone, min_rating, limit, rebuild):
+    """以關鍵字檢索過去的故事內容、提示詞與反饋，多個關鍵字須同時出現"""
+    query = " ".join(keywords)
+    try:
+        if rebuild:
+            search_index.rebuild()
+        pending = search_index.pending_count()
+        if pending:
+            click.echo(f"正在為 {pending} 個版本建立索引...")
+            search_index.sync()
+            if pending > 1000:
+                search_index.optimize()
+
+        # 關鍵字也需要分詞，先載入jieba，計時只包含檢索本身
+        from tokenizer import warm_up
+        warm_up()
+        start = time.perf_counter()
+        results = search_index.search(query, theme=theme, genre=genre, tone=tone,
+                                      min_rating=min_rating, limit=limit)
+        elapsed = time.perf_counter() - start
+    except ValueError as e:
+        click.echo(f"輸入錯誤: {str(e)}", err=True)
+        return
+    except sqlite3.Error as e:
+        click.echo(f"資料庫錯誤: {str(e)}", err=True)
+        return
+
+    print_search_results(query, results, elapsed)
 
 if __name__ == '__main__':
     cli() 
@@ -0,0 +1,365 @@
+import sqlite3
+
+# 資料庫結構版本管理
+# 每個遷移只會執行一次，並記錄在 schema_version 資料表中。
+# 新增結構變更時，請在 MIGRATIONS 末端加入新的版本，不要修改已發布的遷移。
+
+SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,       -- 遷移版本號
+    description TEXT NOT NULL,         -- 遷移說明
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# (版本號, 說明, SQL腳本)
+MIGRATIONS = [
+    (1, "建立故事記錄與思考鏈分析快取", """
+CREATE TABLE IF NOT EXISTS story_records (
+    version INTEGER PRIMARY KEY,        -- 版本號作為主鍵
+    theme TEXT NOT NULL,               -- 主題
+    genre TEXT NOT NULL,               -- 類型
+    tone TEXT NOT NULL,                -- 語氣
+    elements TEXT NOT NULL,            -- 關鍵元素 (JSON字符串)
+    prompt TEXT NOT NULL,              -- 使用的提示詞
+    content TEXT NOT NULL,             -- 生成的內容
+    feedback TEXT,                     -- 用戶反饋
+    rating INTEGER,                    -- 用戶評分 (1-5)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key TEXT PRIMARY KEY,        -- 偏好、提示詞模板與模型參數的雜湊
+    sub_analyses TEXT NOT NULL,        -- 各思考方向的分析 (JSON字符串)
+    guide TEXT NOT NULL,               -- 最終創作指南
+    size INTEGER NOT NULL,             -- 內容大小 (bytes)
+    created_at REAL NOT NULL,          -- 建立時間 (epoch秒)
+    last_accessed REAL NOT NULL        -- 最近使用時間，用於LRU淘汰
+);
+
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_accessed
+    ON analysis_cache (last_accessed);
+
+CREATE TABLE IF NOT EXISTS cache_stats (
+    name TEXT PRIMARY KEY,             -- 快取名稱
+    hits INTEGER NOT NULL DEFAULT 0,   -- 命中次數
+    misses INTEGER NOT NULL DEFAULT 0  -- 未命中次數
+);
+"""),
+    (2, "拆分為故事與故事版本資料表並建立索引", """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY,            -- 故事編號
+    session_id TEXT NOT NULL,          -- 工作階段識別碼
+    theme TEXT NOT NULL,               -- 主題
+    genre TEXT NOT NULL,               -- 類型
+    tone TEXT NOT NULL,                -- 語氣
+    elements TEXT NOT NULL,            -- 關鍵元素 (JSON字符串)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_stories_session ON stories (session_id);
+CREATE INDEX IF NOT EXISTS idx_stories_preferences ON stories (theme, genre, tone);
+CREATE INDEX IF NOT EXISTS idx_stories_created_at ON stories (created_at);
+
+CREATE TABLE IF NOT EXISTS story_versions (
+    story_id INTEGER NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,          -- 故事內的版本號
+    prompt TEXT NOT NULL,              -- 使用的提示詞
+    content TEXT NOT NULL,             -- 生成的內容
+    feedback TEXT,                     -- 用戶反饋
+    rating INTEGER,                    -- 用戶評分 (1-5)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (story_id, version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_story_versions_created_at ON story_versions (created_at);
+
+-- 舊資料庫只有一條故事線，整體搬移為一個故事
+INSERT INTO stories (session_id, theme, genre, tone, elements, created_at)
+SELECT 'legacy', theme, genre, tone, elements, created_at
+FROM story_records ORDER BY version LIMIT 1;
+
+INSERT INTO story_versions (story_id, version, prompt, content, feedback, rating, created_at)
+SELECT (SELECT id FROM stories WHERE session_id = 'legacy'),
+       version, prompt, content, feedback, rating, created_at
+FROM story_records;
+
+DROP TABLE story_records;
+
+-- 保留唯讀的 story_records 檢視表，方便直接以 SQL 查詢
+CREATE VIEW story_records AS
+SELECT v.story_id, s.session_id, v.version, s.theme, s.genre, s.tone, s.elements,
+       v.prompt, v.content, v.feedback, v.rating, v.created_at
+FROM story_versions v JOIN stories s ON s.id = v.story_id;
+"""),
+    (3, "保存各版本的長度與版本間評估指標", """
+CREATE TABLE IF NOT EXISTS version_metrics (
+    story_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,          -- 此版本
+    from_version INTEGER,              -- 比較的前一版本，第一版為 NULL
+    content_length INTEGER NOT NULL,   -- 內容長度 (字)
+    bleu_score REAL,                   -- 與前一版本的BLEU分數
+    change_rate REAL,                  -- 與前一版本的變化率
+    rouge_l_f REAL,                    -- ROUGE-L F1分數
+    rouge_1_f REAL,                    -- ROUGE-1 F1分數
+    rouge_2_f REAL,                    -- ROUGE-2 F1分數
+    PRIMARY KEY (story_id, version)
+);
+
+-- 版本內容被覆蓋時，移除依賴此內容的指標，下次分析時重新計算
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_content_changed
+AFTER UPDATE OF content ON story_versions
+WHEN OLD.content IS NOT NEW.content
+BEGIN
+    DELETE FROM version_metrics
+    WHERE story_id = NEW.story_id
+      AND (version = NEW.version OR from_version = NEW.version);
+END;
+"""),
+    (4, "在故事版本中保存分詞結果", """
+ALTER TABLE story_versions ADD COLUMN tokens TEXT;   -- 以空格分隔的分詞結果
+
+-- 版本內容被覆蓋時，已保存的分詞結果也隨之失效
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_tokens_stale
+AFTER UPDATE OF content ON story_versions
+WHEN OLD.content IS NOT NEW.content
+BEGIN
+    UPDATE story_versions SET tokens = NULL
+    WHERE story_id = NEW.story_id AND version = NEW.version;
+END;
+"""),
+    (5, "建立模型回應快取", """
+CREATE TABLE IF NOT EXISTS response_cache (
+    cache_key TEXT PRIMARY KEY,        -- 訊息列表、模型與取樣參數的雜湊
+    model TEXT,                        -- 模型名稱
+    codec TEXT NOT NULL,               -- 壓縮方式 (zstd 或 zlib)
+    body BLOB NOT NULL,                -- 壓縮後的回應 (JSON)
+    size INTEGER NOT NULL,             -- 壓縮後大小 (bytes)
+    created_at REAL NOT NULL,          -- 建立時間 (epoch秒)
+    last_accessed REAL NOT NULL        -- 最近使用時間，用於LRU淘汰
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_last_accessed
+ON response_cache(last_accessed);
+"""),
+    (6, "建立故事內容、提示詞與反饋的全文檢索索引", """
+-- 中文先以jieba分詞、以空格分隔後寫入，unicode61 即可依詞檢索
+CREATE VIRTUAL TABLE IF NOT EXISTS story_search USING fts5(
+    content, prompt, feedback,
+    tokenize = 'unicode61'
+);
+
+-- 索引列與故事版本的對應，doc_id 即 story_search 的 rowid
+CREATE TABLE IF NOT EXISTS search_docs (
+    doc_id INTEGER PRIMARY KEY,
+    story_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    UNIQUE (story_id, version)
+);
+
+-- 待分詞索引的版本，由觸發器維護，檢索前再批次處理
+CREATE TABLE IF NOT EXISTS search_pending (
+    story_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (story_id, version)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_search_insert
+AFTER INSERT ON story_versions
+BEGIN
+    INSERT OR IGNORE INTO search_pending (story_id, version) VALUES (NEW.story_id, NEW.version);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_search_update
+AFTER UPDATE OF prompt, content, feedback ON story_versions
+WHEN OLD.content IS NOT NEW.content OR OLD.prompt IS NOT NEW.prompt
+     OR OLD.feedback IS NOT NEW.feedback
+BEGIN
+    INSERT OR IGNORE INTO search_pending (story_id, version) VALUES (NEW.story_id, NEW.version);
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_search_delete
+AFTER DELETE ON story_versions
+BEGIN
+    DELETE FROM story_search WHERE rowid IN (
+        SELECT doc_id FROM search_docs WHERE story_id = OLD.story_id AND version = OLD.version
+    );
+    DELETE FROM search_docs WHERE story_id = OLD.story_id AND version = OLD.version;
+    DELETE FROM search_pending WHERE story_id = OLD.story_id AND version = OLD.version;
+END;
+
+-- 既有的版本全部列為待索引
+INSERT OR IGNORE INTO search_pending (story_id, version)
+SELECT story_id, version FROM story_versions;
+"""),
+    (7, "以內容雜湊存放提示詞與故事內容", """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,             -- 原文的雜湊 (BLAKE2b-128)
+    kind TEXT NOT NULL,                -- text: 原文；chunks: 段落清單 (JSON)
+    codec TEXT NOT NULL,               -- 壓縮方式 (none、zlib 或 zstd)
+    body BLOB NOT NULL,                -- 存放的內容
+    size INTEGER NOT NULL,             -- 原文大小 (bytes)
+    refs INTEGER NOT NULL DEFAULT 0    -- 引用此內容的版本欄位與段落清單數
+);
+
+-- 有引用時 prompt、content 欄位為空字串，內容由 blobs 讀取；
+-- 為 NULL 的舊版本仍直接存放在 prompt、content 欄位
+ALTER TABLE story_versions ADD COLUMN prompt_ref TEXT;
+ALTER TABLE story_versions ADD COLUMN content_ref TEXT;
+
+-- 內容改變的判斷改為同時比較欄位與引用
+DROP TRIGGER IF EXISTS trg_story_versions_content_changed;
+CREATE TRIGGER trg_story_versions_content_changed
+AFTER UPDATE OF content, content_ref ON story_versions
+WHEN OLD.content IS NOT NEW.content OR OLD.content_ref IS NOT NEW.content_ref
+BEGIN
+    DELETE FROM version_metrics
+    WHERE story_id = NEW.story_id
+      AND (version = NEW.version OR from_version = NEW.version);
+END;
+
+DROP TRIGGER IF EXISTS trg_story_versions_tokens_stale;
+CREATE TRIGGER trg_story_versions_tokens_stale
+AFTER UPDATE OF content, content_ref ON story_versions
+WHEN OLD.content IS NOT NEW.content OR OLD.content_ref IS NOT NEW.content_ref
+BEGIN
+    UPDATE story_versions SET tokens = NULL
+    WHERE story_id = NEW.story_id AND version = NEW.version;
+END;
+
+-- 觸發器內的 OR IGNORE 會被外層 UPSERT 的衝突處理覆蓋，改以 NOT EXISTS 避免重複
+DROP TRIGGER IF EXISTS trg_story_versions_search_insert;
+CREATE TRIGGER trg_story_versions_search_insert
+AFTER INSERT ON story_versions
+BEGIN
+    INSERT INTO search_pending (story_id, version)
+    SELECT NEW.story_id, NEW.version
+    WHERE NOT EXISTS (
+        SELECT 1 FROM search_pending WHERE story_id = NEW.story_id AND version = NEW.version
+    );
+END;
+
+DROP TRIGGER IF EXISTS trg_story_versions_search_update;
+CREATE TRIGGER trg_story_versions_search_update
+AFTER UPDATE OF prompt, content, feedback, prompt_ref, content_ref ON story_versions
+WHEN OLD.content IS NOT NEW.content OR OLD.prompt IS NOT NEW.prompt
+     OR OLD.feedback IS NOT NEW.feedback
+     OR OLD.content_ref IS NOT NEW.content_ref OR OLD.prompt_ref IS NOT NEW.prompt_ref
+BEGIN
+    INSERT INTO search_pending (story_id, version)
+    SELECT NEW.story_id, NEW.version
+    WHERE NOT EXISTS (
+        SELECT 1 FROM search_pending WHERE story_id = NEW.story_id AND version = NEW.version
+    );
+END;
+
+-- 直接刪除版本時只減少引用次數，歸零的內容由 BlobStore.collect_garbage 清除
+CREATE TRIGGER IF NOT EXISTS trg_story_versions_release_blobs
+AFTER DELETE ON story_versions
+BEGIN
+    UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.prompt_ref;
+    UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.content_ref;
+END;
+
+-- 檢視表無法解壓縮，改存於 blobs 的版本請透過 StoryStore 讀取內容
+DROP VIEW IF EXISTS story_records;
+CREATE VIEW story_records AS
+SELECT v.story_id, s.session_id, v.version, s.theme, s.genre, s.tone, s.elements,
+       v.prompt, v.content, v.feedback, v.rating, v.created_at, v.prompt_ref, v.content_ref
+FROM story_versions v JOIN stories s ON s.id = v.story_id;
+"""),
+    (8, "記錄重新計算指標的進度", """
+CREATE TABLE IF NOT EXISTS rescore_runs (
+    id INTEGER PRIMARY KEY,
+    reuse_tokens INTEGER NOT NULL,     -- 是否沿用已保存的分詞結果
+    started_at REAL NOT NULL,          -- 開始時間 (epoch秒)
+    finished_at REAL                   -- 完成時間，未完成為 NULL
+);
+
+-- 已完成的故事與結果在同一交易中寫入，中斷後由此繼續
+CREATE TABLE IF NOT EXISTS rescore_progress (
+    run_id INTEGER NOT NULL REFERENCES rescore_runs (id) ON DELETE CASCADE,
+    story_id INTEGER NOT NULL,
+    PRIMARY KEY (run_id, story_id)
+) WITHOUT ROWID;
+"""),
+    (9, "保存每輪重新生成的候選版本", """
+CREATE TABLE IF NOT EXISTS story_candidates (
+    story_id INTEGER NOT NULL REFERENCES stories (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,          -- 候選所屬的版本號
+    candidate INTEGER NOT NULL,        -- 候選編號，從1開始
+    content_ref TEXT NOT NULL,         -- 內容在 blobs 的雜湊
+    score REAL NOT NULL,               -- 綜合分數
+    retention REAL NOT NULL,           -- 估計的保留比例 (1 - 變化率)
+    coverage REAL NOT NULL,            -- 關鍵元素涵蓋率
+    selected INTEGER NOT NULL DEFAULT 0,  -- 是否為目前版本使用的內容
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (story_id, version, candidate)
+);
+
+-- 與故事版本相同，刪除時只減少引用次數
+CREATE TRIGGER IF NOT EXISTS trg_story_candidates_release_blobs
+AFTER DELETE ON story_candidates
+BEGIN
+    UPDATE blobs SET refs = refs - 1 WHERE hash = OLD.content_ref;
+END;
+"""),
+    (10, "記錄匯入期間暫時移除的索引", """
+-- 大量匯入前移除次要索引、完成後重建；中途終止時由此還原
+CREATE TABLE IF NOT EXISTS deferred_indexes (
+    name TEXT PRIMARY KEY,             -- 索引名稱
+    sql TEXT NOT NULL                  -- 建立索引的 SQL
+);
+"""),
+    (11, "記錄移除索引的匯入行程", """
+-- 匯入進行中時其他命令不重建索引，只有該行程已不存在時才還原
+ALTER TABLE deferred_indexes ADD COLUMN pid INTEGER;   -- 移除索引的行程編號
+"""),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    """讀取目前的結構版本，尚未建立版本表時回傳0"""
+    try:
+        row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] or 0
+
+
+def migrate(conn) -> int:
+    """
+    將資料庫升級到最新結構
+
+    已是最新版本時只會執行一次版本查詢。每個遷移在獨立交易中執行，
+    失敗時整個遷移會被撤銷，不會留下一半的結構。
+
+    Returns:
+        int: 遷移後的結構版本
+    """
+    version = current_version(conn)
+    if version >= LATEST_VERSION:
+        return version
+
+    conn.executescript(SCHEMA_VERSION_TABLE)
+    for number, description, script in MIGRATIONS:
+        if number <= version:
+            continue
+        try:
+            conn.executescript(
+                f"BEGIN IMMEDIATE;\n{script}\n"
+                f"INSERT INTO schema_version (version, description) "
+                f"VALUES ({number}, '{description.replace(chr(39), chr(39) * 2)}');\n"
+                f"COMMIT;"
+            )
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            # 其他行程可能已同時完成此遷移
+            if current_version(conn) >= number:
+                continue
+            raise
+        version = number
+    return version
@@ -0,0 +1,251 @@
+import re
+import threading
+from collections import OrderedDict
+from config import (
+    PROMPT_TOKEN_BUDGET,
+    GUIDE_TOKEN_BUDGET,
+    PATCH_MIN_RATING
+)
+from prompt_engineering import (
+    generate_regenerate_prompt,
+    generate_patch_prompt
+)
+from tokenizer import content_hash
+
+# 根據反饋重新生成時的提示詞組裝：估算 token 數、限制總長度，
+# 並以濃縮的創作指南與段落修改格式取代每輪重複附上的完整內容。
+
+_WIDE = '\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef'   # 中日韓文字與全形符號
+_WIDE_CHAR = re.compile(f'[{_WIDE}]')
+_NARROW_RUN = re.compile(f'[^\\s{_WIDE}]+')
+_SENTENCE = re.compile(r'.+?[。！？!?]')
+_PATCH_LINE = re.compile(r'^\[(\d+)(\+?)\]\s*(.*)$')
+_DELETED = '（刪除）'
+
+GUIDE_HEADER = "\n創作指南要點：\n"
+_CONDENSED_CACHE_SIZE = 32
+
+
+def count_tokens(text: str) -> int:
+    """
+    在本地估算 token 數
+
+    中文字與全形標點各算一個，其餘連續字元約每四個字元一個，不需要呼叫服務或載入分詞器。
+    """
+    if not text:
+        return 0
+    wide = len(_WIDE_CHAR.findall(text))
+    narrow = sum((len(run) + 3) // 4 for run in _NARROW_RUN.findall(text))
+    return wide + narrow
+
+
+_condensed = OrderedDict()
+_condensed_lock = threading.Lock()
+
+
+def condense_guide(guide: str, budget: int = GUIDE_TOKEN_BUDGET) -> str:
+    """
+    將創作指南濃縮為要點
+
+    每行只保留第一句並去除重複與格式符號，依序加入預算內放得下的要點。
+    結果依內容雜湊快取，同一份指南在之後的每一輪都直接沿用。
+    """
+    key = (content_hash(guide), budget)
+    with _condensed_lock:
+        cached = _condensed.get(key)
+        if cached is not None:
+            _condensed.move_to_end(key)
+            return cached
+
+    points, seen, used = [], set(), 0
+    for line in guide.splitlines():
+        line = line.strip().lstrip('#*>-•').replace('**', '').strip()
+        if not line:
+            continue
+        match = _SENTENCE.match(line)
+        sentence = match.group(0) if match else line
+        if sentence in seen:
+            continue
+        cost = count_tokens(sentence) + 1
+        if used + cost > budget:
+            continue
+        seen.add(sentence)
+        points.append(f"- {sentence}")
+        used += cost
+    condensed = "\n".join(points)
+
+    with _condensed_lock:
+        _condensed[key] = condensed
+        while len(_condensed) > _CONDENSED_CACHE_SIZE:
+            _condensed.popitem(last=False)
+    return condensed
+
+
+def split_paragraphs(content: str) -> list:
+    """依換行切分段落，忽略空行"""
+    return [p.strip() for p in content.splitlines() if p.strip()]
+
+
+def number_paragraphs(paragraphs: list, kept: list = None) -> str:
+    """加上段落編號；kept 為要列出的段落索引（從 0 開始），未列出的段落以一行說明代替"""
+    return _render(paragraphs, kept, numbered=True)
+
+
+def _render(paragraphs: list, kept: list = None, numbered: bool = False) -> str:
+    if kept is None:
+        kept = range(len(paragraphs))
+    lines, previous = [], -1
+    for index in list(kept) + [len(paragraphs)]:
+        if index > previous + 1:
+            first, last = previous + 2, index
+            span = f"第 {first} 段" if first == last else f"第 {first} 至 {last} 段"
+            lines.append(f"（{span}省略，維持不變）" if numbered else f"（此處省略{span}）")
+        if index < len(paragraphs):
+            lines.append(f"[{index + 1}] {paragraphs[index]}" if numbered else paragraphs[index])
+        previous = index
+    return ("\n" if numbered else "\n\n").join(lines)
+
+
+def _truncate(text: str, budget: int) -> str:
+    """保留開頭在預算內的部分"""
+    if budget <= 0:
+        return ""
+    end = len(text)
+    while end and count_tokens(text[:end]) > budget:
+        end = min(end - 1, end * budget // max(1, count_tokens(text[:end])))
+    return text[:end]
+
+
+def _select_paragraphs(paragraphs: list, budget: int, numbered: bool) -> list:
+    """
+    在預算內由頭尾交替挑選段落，保留故事的開場與結尾
+
+    Returns:
+        list[int]: 依順序排列的段落索引
+    """
+    head, tail = [], []
+    low, high = 0, len(paragraphs) - 1
+    # 預留兩行省略說明的長度
+    used = 2 * count_tokens(f"（第 {len(paragraphs)} 至 {len(paragraphs)} 段省略，維持不變）")
+    from_head = True
+    while low <= high:
+        index = low if from_head else high
+        line = f"[{index + 1}] {paragraphs[index]}" if numbered else paragraphs[index]
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        used += cost
+        if from_head:
+            head.append(index)
+            low += 1
+        else:
+            tail.append(index)
+            high -= 1
+        from_head = not from_head
+    return head + tail[::-1]
+
+
+def apply_patch(paragraphs: list, response: str):
+    """
+    將模型回傳的段落修改套用到上一版本
+
+    Returns:
+        str | None: 修改後的完整故事，回應中沒有任何可辨識的修改時回傳 None
+    """
+    replaced, inserted = {}, {}
+    current = None
+    for line in response.splitlines():
+        match = _PATCH_LINE.match(line.strip())
+        if match:
+            index, insert, text = int(match.group(1)), match.group(2), match.group(3)
+            if not 1 <= index <= len(paragraphs):
+                current = None
+                continue
+            current = inserted.setdefault(index, []) if insert else replaced.setdefault(index, [])
+            if insert:
+                current.append(text)
+            else:
+                current[:] = [text]
+        elif current is not None and line.strip():
+            # 同一段落跨多行時接在前一行之後
+            current[-1] = f"{current[-1]}{line.strip()}"
+
+    if not replaced and not inserted:
+        return None
+
+    result = []
+    for i, paragraph in enumerate(paragraphs, start=1):
+        text = "".join(replaced[i]) if i in replaced else paragraph
+        if text.strip() and text.strip() != _DELETED:
+            result.append(text)
+        result.extend(p for p in inserted.get(i, []) if p.strip())
+    return "\n\n".join(result)
+
+
+def assemble_regenerate_prompt(preferences: dict, previous_content: str, feedback: str,
+                               guide: str, budget: int = PROMPT_TOKEN_BUDGET,
+                               allow_patch: bool = True):
+    """
+    組裝根據反饋重新生成的提示詞
+
+    評分達到 PATCH_MIN_RATING 時改為送出加上編號的段落，只請模型回傳修改的部分；
+    創作指南以濃縮後的要點附加，超出預算時再縮短或省略。
+    上一版本本身就超出預算時，先改用段落修改格式（allow_patch 時），仍放不下再省略中間的段落，
+    保留開場與結尾；單一段落就超出預算時只保留其開頭。
+
+    Returns:
+        tuple[str, dict]: 提示詞與統計，統計包含 tokens、baseline_tokens（完整提示詞）、
+        saved_tokens、guide（full、shortened 或 omitted）、patch_fallback（因預算改用段落修改格式）、
+        omitted_paragraphs、truncated（第一段只保留開頭）、over_budget、overage（仍超出預算的 tokens）
+        與 paragraphs（段落修改模式時的上一版本段落，否則為 None）
+    """
+    paragraphs = None
+    if allow_patch and preferences['rating'] >= PATCH_MIN_RATING:
+        paragraphs = split_paragraphs(previous_content)
+        prompt = generate_patch_prompt(preferences, number_paragraphs(paragraphs), feedback)
+    else:
+        prompt = generate_regenerate_prompt(preferences, previous_content, feedback)
+
+    patch_fallback = False
+    if count_tokens(prompt) > budget and paragraphs is None and allow_patch:
+        paragraphs = split_paragraphs(previous_content)
+        prompt = generate_patch_prompt(preferences, number_paragraphs(paragraphs), feedback)
+        patch_fallback = True
+
+    omitted, truncated = 0, False
+    if count_tokens(prompt) > budget:
+        numbered = paragraphs is not None
+        story = list(paragraphs) if numbered else split_paragraphs(previous_content)
+        template = generate_patch_prompt if numbered else generate_regenerate_prompt
+        available = budget - count_tokens(template(preferences, "", feedback))
+        kept = _select_paragraphs(story, available, numbered)
+        if not kept and story:
+            # 連一段都放不下時只保留第一段的開頭
+            story[0] = _truncate(story[0], available - count_tokens("[1] ") - 1)
+            kept, truncated = ([0], True) if story[0] else ([], False)
+        omitted = len(story) - len(kept)
+        prompt = template(preferences, _render(story, kept, numbered), feedback)
+
+    remaining = budget - count_tokens(prompt) - count_tokens(GUIDE_HEADER)
+    condensed = condense_guide(guide)
+    guide_status = 'full'
+    if count_tokens(condensed) > remaining:
+        condensed = condense_guide(guide, remaining) if remaining > 0 else ""
+        guide_status = 'shortened' if condensed else 'omitted'
+    if condensed:
+        prompt += GUIDE_HEADER + condensed
+
+    tokens = count_tokens(prompt)
+    baseline = count_tokens(generate_regenerate_prompt(preferences, previous_content, feedback) + guide)
+    return prompt, {
+        "tokens": tokens,
+        "baseline_tokens": baseline,
+        "saved_tokens": baseline - tokens,
+        "guide": guide_status,
+        "patch_fallback": patch_fallback,
+        "omitted_paragraphs": omitted,
+        "truncated": truncated,
+        "over_budget": tokens > budget,
+        "overage": max(0, tokens - budget),
+        "paragraphs": paragraphs
+    }
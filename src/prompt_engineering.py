@@ -109,6 +109,65 @@ REGENERATE_PROMPT_TEMPLATE = """
 請以讀者的反饋為主要指導，創作一個更好的版本。重點關注讀者提出的具體建議，同時確保故事的整體品質。
 """
 
+# 高評分時只請模型回傳需要修改的段落
+PATCH_PROMPT_TEMPLATE = """
+作為一位經驗豐富的{genre}作家，讀者對這個故事相當滿意，請依照反饋做局部修改：
+
+讀者反饋：
+{feedback}
+
+原始故事（每段以編號標示）：
+{numbered_story}
+
+故事基本要求：
+- 主題：{theme}
+- 體裁：{genre}
+- 基調：{tone}
+- 關鍵元素：{elements}
+
+回覆格式：
+- 只輸出需要修改的段落，格式為「[編號] 修改後的整段內容」
+- 刪除段落請輸出「[編號] （刪除）」
+- 在某段之後新增段落請輸出「[編號+] 新段落內容」
+- 未修改的段落不要輸出，也不要加入任何說明
+"""
+
+# 評分對應的改寫幅度
+RATING_GUIDE = {
+    1: "請大幅改寫故事，保留不超過20%的原有內容。",
+    2: "請進行較大改寫，保留約30%的原有內容。",
+    3: "請適度改寫，保留約50%的原有內容。",
+    4: "請小幅改寫，保留約70%的原有內容。",
+    5: "請微調故事，保留約85%的原有內容。"
+}
+
+# 評分對應的目標保留比例，與 RATING_GUIDE 的說明一致，用於為候選版本評分
+RATING_RETENTION = {1: 0.2, 2: 0.3, 3: 0.5, 4: 0.7, 5: 0.85}
+
+# 思考鏈各方向分析的總結引導
+ANALYSIS_SUMMARY_REQUEST = """
+
+    請以自由的方式總結你的想法：
+    - 提供2-3個最具啟發性的見解
+    - 說明這些見解如何幫助故事創作
+    - 用生動的語言表達你的思考
+    """
+
+# 將思考鏈分析整合為創作指南的提示詞
+GUIDE_SYSTEM_PROMPT = "您是一位深諳文學創作的智者，請將這些思考整合為富有洞見的創作指南。"
+
+GUIDE_PROMPT_TEMPLATE = """
+                請將這些創作思路提煉為一份優雅簡潔的創作指南：
+
+                {context}
+
+                要求：
+                - 提供富有啟發性的創作建議
+                - 保持文學性與實用性的平衡
+                - 讓每個建議都能啟發創作靈感
+                - 注重表達的優美與準確
+                """
+
 
 def generate_story_prompt(preferences: dict) -> str:
     """生成初始提示詞"""
@@ -121,40 +180,28 @@ def generate_story_prompt(preferences: dict) -> str:
 
 def generate_regenerate_prompt(preferences: dict, previous_content: str, feedback: str) -> str:
     """根據反饋生成重新生成的提示詞"""
-    
+    prompt = REGENERATE_PROMPT_TEMPLATE.format(
+        genre=preferences['genre'],
+        feedback=feedback,
+        original_story=previous_content,
+        theme=preferences['theme'],
+        tone=preferences['tone'],
+        elements=', '.join(preferences['key_elements'])
+    )
     # 根據評分決定改變程度的提示
-    rating_guide = {
-        1: "請大幅改寫故事，保留不超過20%的原有內容。",
-        2: "請進行較大改寫，保留約30%的原有內容。",
-        3: "請適度改寫，保留約50%的原有內容。",
-        4: "請小幅改寫，保留約70%的原有內容。",
-        5: "請微調故事，保留約85%的原有內容。"
-    }
-    
-    base_prompt = f"""
-您是一位優秀的故事創作者。請根據以下資訊重新創作故事：
-
-主題：{preferences['theme']}
-類型：{preferences['genre']}
-語氣：{preferences['tone']}
-關鍵元素：{', '.join(preferences['key_elements'])}
-
-上一版本的內容：
-{previous_content}
+    return prompt + "\n" + RATING_GUIDE[preferences['rating']] + "\n"
 
-用戶反饋：
-{feedback}
-
-{rating_guide[preferences['rating']]}
-
-創作要求：
-1. 根據用戶反饋調整故事內容
-2. 保持故事的連貫性和完整性
-3. 確保符合主題和風格要求
-4. 加強情感表達和細節描寫
-5. 優化故事結構和節奏
-"""
-    return base_prompt
+def generate_patch_prompt(preferences: dict, numbered_story: str, feedback: str) -> str:
+    """生成只回傳修改段落的提示詞，numbered_story 為加上段落編號的上一版本"""
+    prompt = PATCH_PROMPT_TEMPLATE.format(
+        genre=preferences['genre'],
+        feedback=feedback,
+        numbered_story=numbered_story,
+        theme=preferences['theme'],
+        tone=preferences['tone'],
+        elements=', '.join(preferences['key_elements'])
+    )
+    return prompt + "\n" + RATING_GUIDE[preferences['rating']] + "\n"
 
 def chain_of_thought(task: dict) -> list[str]:
     """
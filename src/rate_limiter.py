@@ -0,0 +1,39 @@
+import time
+import threading
+
+
+class RateLimiter:
+    """
+    令牌桶速率限制
+
+    令牌以每秒 rate 個的速度補充，最多累積 burst 個，每個請求消耗一個。
+    多個執行緒共用同一個限制器，令牌不足時依序預約之後補充的令牌。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("rate必須大於0")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float = None) -> bool:
+        """
+        取得一個令牌，必要時等待
+
+        Returns:
+            bool: 需要等待的時間超過 timeout 時不取得令牌並回傳 False
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+            if timeout is not None and wait > timeout:
+                return False
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
@@ -0,0 +1,166 @@
+import os
+import time
+import signal
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from story_store import StoryStore
+
+# 以多個行程重新計算整個故事庫的分詞結果與版本間指標，例如更換分詞方式或新增指標之後。
+# 工作以故事為單位分批送出，每個工作行程只載入一次jieba詞典，
+# 每批的結果與進度在同一個交易中寫入，中斷後可從上次完成的故事繼續。
+
+_store = None
+
+
+def _init_worker(db_path):
+    """工作行程初始化：建立自己的資料庫連接並載入jieba詞典"""
+    global _store
+    # Ctrl-C 由主行程處理，已開始的批次會完成並寫入後才結束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from tokenizer import warm_up
+    _store = StoryStore(db_path)
+    warm_up()
+
+
+def _rescore_stories(run_id: int, story_ids: list, reuse_tokens: bool):
+    """
+    重新計算一批故事的指標並寫入
+
+    Returns:
+        tuple: (故事數, 版本數, 版本對數)
+    """
+    from batch_metrics import evaluate_pairs
+    from tokenizer import tokenize, serialize_tokens, deserialize_tokens
+
+    stories = []
+    pairs = []
+    for story_id in story_ids:
+        versions = _store.get_versions(story_id)
+        tokenized = [
+            tokenize(row['content'], deserialize_tokens(row['tokens'])
+                     if reuse_tokens and row['tokens'] is not None else None)
+            for row in versions
+        ]
+        stories.append((story_id, versions, tokenized))
+        pairs.extend(zip(tokenized, tokenized[1:]))
+    evaluations = iter(evaluate_pairs(pairs))
+
+    version_count = 0
+    with _store.db.transaction() as conn:
+        for story_id, versions, tokenized in stories:
+            previous = None
+            for row, tokens in zip(versions, tokenized):
+                _store.save_tokens(story_id, row['version'], serialize_tokens(tokens))
+                _store.save_metrics(
+                    story_id, row['version'], len(row['content']),
+                    from_version=previous,
+                    evaluation=next(evaluations) if previous is not None else None
+                )
+                previous = row['version']
+            version_count += len(versions)
+        conn.executemany(
+            "INSERT OR IGNORE INTO rescore_progress (run_id, story_id) VALUES (?, ?)",
+            [(run_id, story_id) for story_id in story_ids]
+        )
+    return len(story_ids), version_count, len(pairs)
+
+
+class Rescorer:
+    """
+    重新計算指標的執行紀錄與排程
+
+    Args:
+        workers: 工作行程數
+        chunk_size: 每個工作包含的故事數
+    """
+
+    def __init__(self, db_path, workers: int = None, chunk_size: int = 20):
+        self.db_path = db_path
+        self.store = StoryStore(db_path)
+        self.db = self.store.db
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+
+    def start_run(self, reuse_tokens: bool = False) -> int:
+        with self.db.transaction() as conn:
+            return conn.execute(
+                "INSERT INTO rescore_runs (reuse_tokens, started_at) VALUES (?, ?)",
+                (int(reuse_tokens), time.time())
+            ).lastrowid
+
+    def unfinished_run(self):
+        """最近一次未完成的執行，回傳 (run_id, reuse_tokens) 或 None"""
+        row = self.db.connection().execute(
+            "SELECT id, reuse_tokens FROM rescore_runs WHERE finished_at IS NULL ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        return (row[0], bool(row[1])) if row else None
+
+    def remaining(self, run_id: int) -> int:
+        return self.db.connection().execute("""
+            SELECT COUNT(*) FROM stories s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM rescore_progress p WHERE p.run_id = ? AND p.story_id = s.id
+            )
+        """, (run_id,)).fetchone()[0]
+
+    def _pending_chunks(self, run_id: int):
+        """依故事編號分頁讀取尚未完成的故事，每次產生一個工作"""
+        conn = self.db.connection()
+        after = 0
+        while True:
+            ids = [row[0] for row in conn.execute("""
+                SELECT s.id FROM stories s
+                WHERE s.id > ? AND NOT EXISTS (
+                    SELECT 1 FROM rescore_progress p WHERE p.run_id = ? AND p.story_id = s.id
+                )
+                ORDER BY s.id LIMIT ?
+            """, (after, run_id, self.chunk_size)).fetchall()]
+            if not ids:
+                return
+            after = ids[-1]
+            yield ids
+
+    def run(self, run_id: int, reuse_tokens: bool, progress=None) -> dict:
+        """
+        執行或繼續指定的重新計算
+
+        同時送出的工作數限制在工作行程數的兩倍，不必先讀出整個故事庫。
+
+        Args:
+            progress: 每完成一個工作以累計統計呼叫
+        """
+        from tokenizer import warm_up
+        # 先在主行程載入詞典，詞典檔只建立一次，以 fork 啟動的工作行程直接沿用
+        warm_up()
+        totals = {"stories": 0, "versions": 0, "pairs": 0}
+        start = time.perf_counter()
+        chunks = self._pending_chunks(run_id)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(str(self.db_path),)) as executor:
+            pending = set()
+            try:
+                while True:
+                    for story_ids in chunks:
+                        pending.add(executor.submit(_rescore_stories, run_id, story_ids, reuse_tokens))
+                        if len(pending) >= self.workers * 2:
+                            break
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        stories, versions, pairs = future.result()
+                        totals["stories"] += stories
+                        totals["versions"] += versions
+                        totals["pairs"] += pairs
+                    if progress:
+                        progress(dict(totals, elapsed=time.perf_counter() - start))
+            except BaseException:
+                # 已提交的批次都已記錄進度，未開始的工作直接取消
+                for future in pending:
+                    future.cancel()
+                raise
+
+        with self.db.transaction() as conn:
+            conn.execute("UPDATE rescore_runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+            conn.execute("DELETE FROM rescore_progress WHERE run_id = ?", (run_id,))
+        totals["elapsed"] = time.perf_counter() - start
+        return totals
@@ -0,0 +1,295 @@
+import time
+import random
+import threading
+from collections import deque
+from llm_backend import LLMBackend, BackendError
+from rate_limiter import RateLimiter
+from config import (
+    LLM_MAX_RETRIES,
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_CALL_DEADLINE,
+    LLM_BREAKER_THRESHOLD,
+    LLM_BREAKER_RESET
+)
+
+# 所有模型呼叫共用的容錯層：重試與退避、每次呼叫的期限、速率限制與斷路器。
+
+
+class CircuitOpenError(BackendError):
+    """斷路器開啟中，請求未送出即失敗"""
+
+
+class DeadlineExceeded(BackendError):
+    """在呼叫期限內未能取得回應"""
+
+    def __init__(self, message: str):
+        super().__init__(message, timeout=True)
+
+
+def is_retryable(error: BackendError) -> bool:
+    """429、5xx、逾時與連線錯誤可以重試，其他 4xx 代表請求本身有問題"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    status = error.status_code
+    return status is None or status == 429 or status >= 500
+
+
+def counts_as_failure(error: BackendError) -> bool:
+    """只有服務端錯誤、逾時與連線錯誤會讓斷路器累計失敗，429 只代表服務忙碌"""
+    return error.status_code is None or error.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    斷路器
+
+    連續失敗達到 failure_threshold 次後開啟，reset_timeout 秒內的請求直接失敗；
+    之後放行一個試探請求（半開），成功則關閉，失敗則再次開啟。
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_THRESHOLD,
+                 reset_timeout: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        確認是否可以送出請求
+
+        Raises:
+            CircuitOpenError: 斷路器開啟中，或半開狀態下已有試探請求
+        """
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    raise CircuitOpenError("模型服務暫時無法使用（斷路器開啟中）")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError("模型服務恢復檢查中（斷路器半開）")
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """請求以不影響健康狀態的錯誤結束時，讓半開狀態可以再放行試探請求"""
+        with self._lock:
+            self._probing = False
+
+
+class BackendMetrics:
+    """容錯層的呼叫統計，延遲只保留最近的樣本"""
+
+    def __init__(self, sample_size: int = 1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=sample_size)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.rate_limited = 0.0
+
+    def record(self, field: str, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def record_latency(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            result = {
+                "calls": self.calls,
+                "successes": self.successes,
+                "failures": self.failures,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "rate_limited_seconds": self.rate_limited
+            }
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+        result["latency_p50"] = percentile(50)
+        result["latency_p95"] = percentile(95)
+        return result
+
+
+def find_resilience_layer(backend: LLMBackend):
+    """在層層包裝的模型服務中找出容錯層，沒有時回傳 None"""
+    while backend is not None and not isinstance(backend, ResilientBackend):
+        backend = getattr(backend, 'backend', None)
+    return backend
+
+
+class ResilientBackend(LLMBackend):
+    """
+    為模型服務加上容錯處理
+
+    每次呼叫有總期限（包含重試與等待），可重試的錯誤以指數退避加上隨機抖動重試，
+    服務回報 Retry-After 時依其等待。串流請求只在收到第一段內容前重試。
+
+    Args:
+        backend: 實際送出請求的模型服務
+        limiter: 客戶端速率限制，None 表示不限制
+        breaker: 斷路器，預設建立新的斷路器
+        metrics: 呼叫統計，預設建立新的統計
+    """
+
+    def __init__(self, backend: LLMBackend, limiter: RateLimiter = None,
+                 breaker: CircuitBreaker = None, metrics: BackendMetrics = None,
+                 max_retries: int = LLM_MAX_RETRIES, backoff_base: float = LLM_BACKOFF_BASE,
+                 backoff_max: float = LLM_BACKOFF_MAX, deadline: float = LLM_CALL_DEADLINE):
+        self.backend = backend
+        self.name = backend.name
+        self.limiter = limiter
+        self.breaker = breaker or CircuitBreaker()
+        self.metrics = metrics or BackendMetrics()
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._random = random.Random()
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        """第 attempt 次重試前的等待秒數"""
+        if retry_after is not None:
+            return retry_after
+        return self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _attempts(self, params: dict):
+        """
+        依序產生每次嘗試可用的參數，呼叫端以 send 回報該次錯誤
+
+        處理期限、斷路器與速率限制，錯誤不可重試或期限已到時拋出。
+        """
+        expires = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"模型呼叫超過期限 {self.deadline:.0f} 秒")
+            self.breaker.before_call()
+            if self.limiter is not None:
+                waited = time.monotonic()
+                if not self.limiter.acquire(timeout=remaining):
+                    self.breaker.release()
+                    raise DeadlineExceeded("等待速率限制超過呼叫期限")
+                self.metrics.record('rate_limited', time.monotonic() - waited)
+                remaining = expires - time.monotonic()
+
+            timeout = params.get('timeout')
+            call_params = dict(params, timeout=min(timeout, remaining) if timeout else remaining)
+            error = yield call_params
+
+            if counts_as_failure(error):
+                self.breaker.record_failure()
+            else:
+                self.breaker.release()
+            if not is_retryable(error) or attempt >= self.max_retries:
+                raise error
+            delay = self.backoff(attempt, error.retry_after)
+            if delay >= expires - time.monotonic():
+                raise DeadlineExceeded(f"模型呼叫超過期限 {self.deadline:.0f} 秒: {str(error)}") from error
+            attempt += 1
+            self.metrics.record('retries')
+            time.sleep(delay)
+
+    def _run(self, messages: list, params: dict, send, complete: bool = True):
+        """
+        以 send(messages, params) 執行一次完整呼叫，包含重試與統計
+
+        Args:
+            complete: 為 False 時 send 成功後還不算完成，不記錄成功，由呼叫端之後以 _finish 記錄
+        """
+        self.metrics.record('calls')
+        start = time.monotonic()
+        attempts = self._attempts(params)
+        try:
+            call_params = next(attempts)
+            while True:
+                try:
+                    result = send(messages, call_params)
+                except BackendError as e:
+                    call_params = attempts.send(e)
+                    continue
+                if complete:
+                    self._finish(start)
+                return result
+        except CircuitOpenError:
+            self.metrics.record('rejected')
+            raise
+        except BackendError:
+            self.metrics.record('failures')
+            raise
+        except Exception:
+            # 無法辨識的錯誤不重試，也不影響斷路器
+            self.breaker.release()
+            self.metrics.record('failures')
+            raise
+        finally:
+            attempts.close()
+
+    def _finish(self, start: float, error: Exception = None):
+        """記錄一次呼叫的結果；error 為 None 表示成功"""
+        if error is None:
+            self.breaker.record_success()
+            self.metrics.record('successes')
+            self.metrics.record_latency(time.monotonic() - start)
+            return
+        if isinstance(error, BackendError) and counts_as_failure(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        self.metrics.record('failures')
+
+    def chat(self, messages: list, **params):
+        return self._run(messages, params, lambda m, p: self.backend.chat(m, **p))
+
+    def stream_chat(self, messages: list, **params):
+        # 先取得第一段內容，之前的錯誤可以重試；之後的錯誤直接拋出，避免重複輸出，
+        # 但同樣計入斷路器與統計，整個串流結束才算成功
+        def first_chunk(m, p):
+            stream = self.backend.stream_chat(m, **p)
+            return stream, next(stream, None)
+
+        start = time.monotonic()
+        stream, chunk = self._run(messages, params, first_chunk, complete=False)
+        try:
+            if chunk is not None:
+                yield chunk
+                yield from stream
+        except GeneratorExit:
+            # 呼叫端提前停止讀取，不影響服務的健康狀態
+            stream.close()
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._finish(start, e)
+            raise
+        self._finish(start)
@@ -0,0 +1,173 @@
+import json
+import time
+import hashlib
+from database import get_manager
+from blob_store import compress, decompress
+from llm_backend import LLMBackend, ChatResult, BackendError
+from config import RESPONSE_CACHE_MAX_BYTES
+
+# 不影響回應內容的請求參數，不納入快取鍵
+_IGNORED_PARAMS = ('timeout',)
+
+
+class ResponseCache:
+    """
+    模型回應的持久化快取
+
+    以完整訊息列表、模型與取樣參數的雜湊為鍵，回應壓縮後存放在 response_cache，
+    總大小超過上限時依LRU淘汰。
+    """
+    NAME = 'response'
+
+    def __init__(self, db_path, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.db_path = db_path
+        self.db = get_manager(db_path)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def make_key(messages: list, params: dict) -> str:
+        material = json.dumps({
+            "messages": messages,
+            "params": {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        查詢快取
+
+        Returns:
+            ChatResult | None
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT codec, body FROM response_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE response_cache SET last_accessed = ? WHERE cache_key = ?",
+                    (time.time(), key)
+                )
+            self._count(conn, hit=row is not None)
+
+        if not row:
+            return None
+        data = json.loads(decompress(row[0], row[1]))
+        return ChatResult(data['content'], data.get('prompt_tokens'), data.get('completion_tokens'))
+
+    def put(self, key: str, model: str, result: ChatResult):
+        """寫入快取並執行淘汰"""
+        codec, body = compress(json.dumps({
+            "content": result.content,
+            "prompt_tokens": result.prompt_tokens,
+            "completion_tokens": result.completion_tokens
+        }, ensure_ascii=False).encode('utf-8'))
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute("""
+                INSERT INTO response_cache
+                (cache_key, model, codec, body, size, created_at, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    model = excluded.model,
+                    codec = excluded.codec,
+                    body = excluded.body,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    last_accessed = excluded.last_accessed
+            """, (key, model, codec, body, len(body), now, now))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        """依最近使用時間淘汰超出大小上限的部分"""
+        conn.execute("""
+            DELETE FROM response_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key,
+                           SUM(size) OVER (ORDER BY last_accessed DESC, cache_key) AS running
+                    FROM response_cache
+                ) WHERE running > ?
+            )
+        """, (self.max_bytes,))
+
+    def _count(self, conn, hit: bool):
+        """累計命中與未命中次數"""
+        column = 'hits' if hit else 'misses'
+        conn.execute(
+            f"INSERT INTO cache_stats (name, {column}) VALUES (?, 1) "
+            f"ON CONFLICT(name) DO UPDATE SET {column} = {column} + 1",
+            (self.NAME,)
+        )
+
+    def stats(self) -> dict:
+        """回傳快取筆數、壓縮後大小與命中統計"""
+        conn = self.db.connection()
+        entries, total = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM response_cache"
+        ).fetchone()
+        counters = conn.execute(
+            "SELECT hits, misses FROM cache_stats WHERE name = ?",
+            (self.NAME,)
+        ).fetchone() or (0, 0)
+        return {
+            "entries": entries,
+            "bytes": total,
+            "hits": counters[0],
+            "misses": counters[1]
+        }
+
+    def clear(self):
+        """清空快取與統計"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM response_cache")
+            conn.execute("DELETE FROM cache_stats WHERE name = ?", (self.NAME,))
+
+
+class CachingBackend(LLMBackend):
+    """
+    在模型服務前加上回應快取
+
+    Args:
+        mode: on 先查快取，未命中才呼叫模型並記錄；
+              record 一律呼叫模型並覆蓋記錄；
+              replay 只從快取回放，未命中時直接失敗，不會呼叫模型
+    """
+    MODES = ('on', 'record', 'replay')
+
+    def __init__(self, backend: LLMBackend, cache: ResponseCache, mode: str = 'on'):
+        if mode not in self.MODES:
+            raise ValueError(f"不支援的快取模式: {mode}")
+        self.backend = backend
+        self.cache = cache
+        self.mode = mode
+        self.name = backend.name
+
+    def _lookup(self, key: str):
+        if self.mode == 'record':
+            return None
+        cached = self.cache.get(key)
+        if cached is None and self.mode == 'replay':
+            raise BackendError("重播模式下找不到對應的回應記錄", status_code=404)
+        return cached
+
+    def chat(self, messages: list, **params) -> ChatResult:
+        key = ResponseCache.make_key(messages, params)
+        cached = self._lookup(key)
+        if cached is not None:
+            return cached
+        result = self.backend.chat(messages, **params)
+        self.cache.put(key, params.get('model'), result)
+        return result
+
+    def stream_chat(self, messages: list, **params):
+        key = ResponseCache.make_key(messages, params)
+        cached = self._lookup(key)
+        if cached is not None:
+            yield cached.content
+            return
+        parts = []
+        for chunk in self.backend.stream_chat(messages, **params):
+            parts.append(chunk)
+            yield chunk
+        # 只記錄完整收到的回應
+        self.cache.put(key, params.get('model'), ChatResult("".join(parts)))
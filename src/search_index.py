@@ -0,0 +1,230 @@
+import re
+from database import get_manager
+from blob_store import BlobStore
+from tracing import tracer, traced
+from story_views import HIGHLIGHT_START, HIGHLIGHT_END
+
+# 全文檢索：故事內容、提示詞與反饋以jieba分詞後寫入 FTS5 的 story_search。
+# 寫入故事版本時只由觸發器記錄到 search_pending，分詞在檢索前才批次進行，
+# 不會拖慢生成與保存故事的流程。
+
+# bm25 的欄位權重，依序為 content、prompt、feedback；
+# 提示詞大多是相同的模板，權重較低
+_BM25_WEIGHTS = (1.0, 0.3, 1.5)
+
+# 非 ASCII 字元（中文與全形標點）旁的空格是分詞時加入的，判斷時略過標示字元
+_SEGMENT_SPACE = re.compile(
+    r'(?:(?<=[^\x00-\x7f])|(?<=[^\x00-\x7f][\x01\x02])) | (?=[\x01\x02]?[^\x00-\x7f])'
+)
+
+
+def build_query(text: str) -> str:
+    """
+    將使用者輸入的關鍵字轉為 FTS5 查詢
+
+    以空白分隔的每個關鍵字都必須出現，關鍵字分詞後的各個詞須依序相連。
+
+    Raises:
+        ValueError: 關鍵字分詞後沒有可檢索的詞
+    """
+    from tokenizer import segment
+    phrases = []
+    for keyword in text.split():
+        terms = [t for t in segment(keyword).split(" ") if any(c.isalnum() for c in t)]
+        if terms:
+            phrases.append('"' + " ".join(terms).replace('"', '""') + '"')
+    if not phrases:
+        raise ValueError("請輸入可檢索的關鍵字")
+    return " ".join(dict.fromkeys(phrases))
+
+
+def unsegment(text: str) -> str:
+    """移除分詞時加入的空格，還原為可閱讀的文字"""
+    return _SEGMENT_SPACE.sub('', text)
+
+
+class SearchIndex:
+    """
+    故事版本的全文檢索索引
+
+    索引以 search_docs 對應到 (story_id, version)，版本內容、提示詞或反饋改變時
+    由觸發器重新列入 search_pending，刪除版本時一併移除索引。
+    """
+
+    def __init__(self, db_path, batch_size: int = 200):
+        self.db_path = db_path
+        self.db = get_manager(db_path)
+        self.blobs = BlobStore(db_path)
+        self.batch_size = batch_size
+
+    def pending_count(self) -> int:
+        conn = self.db.connection()
+        return conn.execute("SELECT COUNT(*) FROM search_pending").fetchone()[0]
+
+    @traced('search.sync')
+    def sync(self, progress=None) -> int:
+        """
+        為待索引的版本分詞並寫入索引
+
+        Args:
+            progress: 每批完成後以已處理數呼叫
+
+        Returns:
+            int: 本次索引的版本數
+        """
+        from tokenizer import segment
+        conn = self.db.connection()
+        indexed, after = 0, (0, 0)
+        while True:
+            rows = conn.execute("""
+                SELECT p.story_id, p.version, v.prompt, v.content, v.feedback,
+                       v.prompt_ref, v.content_ref, v.tokens
+                FROM search_pending p
+                JOIN story_versions v ON v.story_id = p.story_id AND v.version = p.version
+                WHERE (p.story_id, p.version) > (?, ?)
+                ORDER BY p.story_id, p.version
+                LIMIT ?
+            """, (*after, self.batch_size)).fetchall()
+            if not rows:
+                break
+            after = rows[-1][:2]
+
+            # 分詞在交易外進行，寫入前再確認內容沒有在這段期間被修改
+            documents = []
+            for row in rows:
+                story_id, version, prompt, content, feedback, prompt_ref, content_ref, tokens = row
+                try:
+                    if prompt_ref is not None:
+                        prompt = self.blobs.get(prompt_ref)
+                    if content_ref is not None:
+                        content = self.blobs.get(content_ref)
+                except KeyError:
+                    # 版本在查詢後被覆蓋，留待下次處理
+                    continue
+                documents.append((
+                    story_id, version, row[2:7],
+                    tokens or segment(content), segment(prompt), segment(feedback)
+                ))
+            with self.db.transaction():
+                for story_id, version, source, content, prompt, feedback in documents:
+                    current = conn.execute(
+                        "SELECT prompt, content, feedback, prompt_ref, content_ref FROM story_versions "
+                        "WHERE story_id = ? AND version = ?",
+                        (story_id, version)
+                    ).fetchone()
+                    if current != source:
+                        continue
+                    self._write(conn, story_id, version, content, prompt, feedback)
+                    indexed += 1
+            if progress:
+                progress(indexed)
+        tracer.current().set(indexed=indexed)
+        return indexed
+
+    @staticmethod
+    def _write(conn, story_id: int, version: int, content: str, prompt: str, feedback: str):
+        row = conn.execute(
+            "SELECT doc_id FROM search_docs WHERE story_id = ? AND version = ?",
+            (story_id, version)
+        ).fetchone()
+        if row:
+            doc_id = row[0]
+            conn.execute("DELETE FROM story_search WHERE rowid = ?", (doc_id,))
+        else:
+            doc_id = conn.execute(
+                "INSERT INTO search_docs (story_id, version) VALUES (?, ?)",
+                (story_id, version)
+            ).lastrowid
+        conn.execute(
+            "INSERT INTO story_search (rowid, content, prompt, feedback) VALUES (?, ?, ?, ?)",
+            (doc_id, content, prompt, feedback)
+        )
+        conn.execute(
+            "DELETE FROM search_pending WHERE story_id = ? AND version = ?",
+            (story_id, version)
+        )
+
+    def rebuild(self) -> int:
+        """清空索引並將所有版本重新列入待索引，回傳待索引的版本數"""
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM story_search")
+            conn.execute("DELETE FROM search_docs")
+            conn.execute("""
+                INSERT OR IGNORE INTO search_pending (story_id, version)
+                SELECT story_id, version FROM story_versions
+            """)
+            return conn.execute("SELECT COUNT(*) FROM search_pending").fetchone()[0]
+
+    def optimize(self):
+        """合併 FTS5 的索引分段，大量寫入後可加快查詢"""
+        with self.db.transaction() as conn:
+            conn.execute("INSERT INTO story_search (story_search) VALUES ('optimize')")
+
+    @traced('search.query')
+    def search(self, query: str, theme: str = None, genre: str = None, tone: str = None,
+               min_rating: int = None, limit: int = 10, snippet_tokens: int = 24) -> list:
+        """
+        依關鍵字檢索故事版本，依 bm25 相關度排序
+
+        Returns:
+            list: 每筆包含故事編號、版本、偏好設定、評分、摘要與分數
+
+        Raises:
+            ValueError: 關鍵字分詞後沒有可檢索的詞
+        """
+        match = build_query(query)
+        conditions, params = [], []
+        for column, value in (('s.theme', theme), ('s.genre', genre), ('s.tone', tone)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if min_rating is not None:
+            conditions.append("v.rating >= ?")
+            params.append(min_rating)
+
+        # 先依分數取出前 limit 筆，只為這些版本產生摘要；
+        # 沒有篩選條件時排序不需要關聯其他資料表
+        bm25 = f"bm25(story_search, {', '.join(map(str, _BM25_WEIGHTS))})"
+        if conditions:
+            top = f"""
+                SELECT story_search.rowid AS doc_id, {bm25} AS score
+                FROM story_search
+                JOIN search_docs d ON d.doc_id = story_search.rowid
+                JOIN story_versions v ON v.story_id = d.story_id AND v.version = d.version
+                JOIN stories s ON s.id = d.story_id
+                WHERE story_search MATCH ? AND {' AND '.join(conditions)}
+                ORDER BY score LIMIT ?
+            """
+        else:
+            top = f"""
+                SELECT rowid AS doc_id, {bm25} AS score
+                FROM story_search WHERE story_search MATCH ?
+                ORDER BY score LIMIT ?
+            """
+        conn = self.db.connection()
+        rows = conn.execute(f"""
+            WITH top AS ({top})
+            SELECT d.story_id, d.version, s.theme, s.genre, s.tone, v.rating,
+                   snippet(story_search, -1, ?, ?, '…', ?), top.score
+            FROM top
+            JOIN story_search ON story_search.rowid = top.doc_id
+            JOIN search_docs d ON d.doc_id = top.doc_id
+            JOIN story_versions v ON v.story_id = d.story_id AND v.version = d.version
+            JOIN stories s ON s.id = d.story_id
+            WHERE story_search MATCH ?
+            ORDER BY top.score
+        """, [match] + params + [limit, HIGHLIGHT_START, HIGHLIGHT_END, snippet_tokens, match]).fetchall()
+        tracer.current().set(results=len(rows))
+        return [
+            {
+                'story_id': r[0],
+                'version': r[1],
+                'theme': r[2],
+                'genre': r[3],
+                'tone': r[4],
+                'rating': r[5],
+                'snippet': unsegment(r[6]),
+                'score': -r[7]
+            }
+            for r in rows
+        ]
@@ -0,0 +1,195 @@
+import json
+import time
+import http.client
+from urllib.parse import urlsplit, urlencode
+import click
+from config import STORY_SERVER_HOST, STORY_SERVER_PORT
+from story_views import (
+    print_history_analysis,
+    print_prompt_stats,
+    print_generation,
+    print_session_summary,
+    print_search_results
+)
+
+# 常駐服務（python src/main.py serve）的客戶端，命令與 main.py 相同，
+# 只載入 click 與標準函式庫，jieba、模型客戶端與資料庫都由服務端預先準備。
+
+
+class ClientError(Exception):
+    """服務回應錯誤或無法連線"""
+
+
+class StoryClient:
+    """
+    以 JSON 呼叫常駐服務
+
+    Args:
+        url: 服務位址，如 http://127.0.0.1:8780
+        timeout: 單一請求的逾時秒數，生成故事可能需要數十秒
+        verbose: 每個請求完成後顯示服務端處理時間與往返時間
+    """
+
+    def __init__(self, url: str, timeout: float = 600, verbose: bool = False):
+        parts = urlsplit(url)
+        self.host = parts.hostname or STORY_SERVER_HOST
+        self.port = parts.port or STORY_SERVER_PORT
+        self.timeout = timeout
+        self.verbose = verbose
+
+    def request(self, method: str, path: str, body: dict = None, query: dict = None) -> dict:
+        """
+        Raises:
+            ClientError: 無法連線或服務回應錯誤
+        """
+        if query:
+            path += "?" + urlencode({k: v for k, v in query.items() if v is not None})
+        data = json.dumps(body or {}, ensure_ascii=False).encode('utf-8')
+        start = time.perf_counter()
+        # 本地連線的建立成本很低，每個請求使用新的連線，不必處理閒置連線被服務端關閉的情況
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=data if method != 'GET' else None,
+                               headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b'{}')
+        except ConnectionRefusedError:
+            raise ClientError(
+                f"無法連線到 {self.host}:{self.port}，請先以 python src/main.py serve 啟動服務"
+            ) from None
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            raise ClientError(f"與服務通訊失敗: {str(e)}") from e
+        finally:
+            connection.close()
+        if self.verbose:
+            click.echo(
+                f"（{method} {path.split('?')[0]}：服務處理 {payload.get('server_ms', 0):.1f} 毫秒，"
+                f"往返 {(time.perf_counter() - start) * 1000:.1f} 毫秒）", err=True
+            )
+        if response.status >= 400:
+            raise ClientError(payload.get('error') or f"HTTP {response.status}")
+        return payload
+
+
+@click.group()
+@click.option('--url', envvar='STORY_SERVER_URL', default=f"http://{STORY_SERVER_HOST}:{STORY_SERVER_PORT}",
+              show_default=True, help='常駐服務位址，也可用 STORY_SERVER_URL 設定')
+@click.option('--verbose', '-v', is_flag=True, help='顯示每個請求的服務端處理時間與往返時間')
+@click.pass_context
+def cli(ctx, url, verbose):
+    """AI故事生成工具（常駐服務客戶端）"""
+    ctx.obj = StoryClient(url, verbose=verbose)
+
+
+@cli.command()
+@click.option('--cot-workers', type=click.IntRange(min=1), help='思考鏈分析同時送出的請求數，預設依服務設定')
+@click.option('--no-cache', is_flag=True, help='略過思考鏈分析快取，重新分析')
+@click.option('--candidates', type=click.IntRange(1, 10),
+              help='每輪根據反饋同時生成的候選版本數，預設依服務設定')
+@click.pass_obj
+def create_story(client, cot_workers, no_cache, candidates):
+    """創建新故事"""
+    theme = click.prompt("主題 (如：AI/科幻/奇幻/愛情)", type=str)
+    genre = click.prompt("類型 (如：短文/對話/小說)", type=str)
+    tone = click.prompt("語氣 (如：樂觀/陰沉/幽默)", type=str)
+    key_elements = click.prompt("關鍵元素 (用逗號分隔)", type=str).split(',')
+
+    session_id = None
+    try:
+        result = client.request('POST', '/sessions', {
+            "theme": theme,
+            "genre": genre,
+            "tone": tone,
+            "key_elements": key_elements,
+            "cot_workers": cot_workers,
+            "no_cache": no_cache,
+            "candidates": candidates
+        })
+        session_id = result['session_id']
+        print(f"\n生成故事的提示詞:\n{result['prompt']}")
+        print_generation(result)
+
+        while click.confirm("\n您想要提供反饋嗎？"):
+            feedback = click.prompt("請輸入您的反饋意見", type=str)
+            rating = click.prompt("請給這個版本評分 (1-5)", type=int, default=3)
+            result = client.request('POST', f'/sessions/{session_id}/revisions',
+                                    {"feedback": feedback, "rating": rating})
+            print_prompt_stats(result['prompt_stats'])
+            print_generation(result)
+            if click.confirm("您滿意這個版本嗎？", default=True):
+                break
+
+        # 服務端等待背景計算完成後回傳版本歷史分析
+        summary = client.request('POST', f'/sessions/{session_id}/finish')
+        session_id = None
+        if summary['history']:
+            print_history_analysis(summary['history'])
+        print_session_summary(summary)
+        click.echo("感謝使用！")
+    except ClientError as e:
+        click.echo(f"發生錯誤: {str(e)}", err=True)
+    finally:
+        # 中途離開時結束服務端的工作階段
+        if session_id is not None:
+            try:
+                client.request('POST', f'/sessions/{session_id}/finish')
+            except ClientError:
+                pass
+
+
+@cli.command()
+@click.argument('story_id', type=int)
+@click.pass_obj
+def history(client, story_id):
+    """顯示故事的版本歷史分析，缺少的指標會先補算"""
+    try:
+        result = client.request('GET', f'/stories/{story_id}/history')
+    except ClientError as e:
+        click.echo(str(e), err=True)
+        return
+    print_history_analysis(result['history'])
+
+
+@cli.command()
+@click.argument('keywords', nargs=-1, required=True)
+@click.option('--theme', help='只顯示此主題的故事')
+@click.option('--genre', help='只顯示此類型的故事')
+@click.option('--tone', help='只顯示此語氣的故事')
+@click.option('--min-rating', type=click.IntRange(1, 5), help='只顯示評分不低於此值的版本')
+@click.option('--limit', default=10, show_default=True, type=click.IntRange(min=1), help='最多顯示筆數')
+@click.pass_obj
+def search(client, keywords, theme, genre, tone, min_rating, limit):
+    """以關鍵字檢索過去的故事內容、提示詞與反饋，多個關鍵字須同時出現"""
+    query = " ".join(keywords)
+    try:
+        result = client.request('GET', '/search', query={
+            "q": query, "theme": theme, "genre": genre, "tone": tone,
+            "min_rating": min_rating, "limit": limit
+        })
+    except ClientError as e:
+        click.echo(f"輸入錯誤: {str(e)}", err=True)
+        return
+    if result['indexed']:
+        click.echo(f"已為 {result['indexed']} 個版本建立索引")
+    print_search_results(query, result['results'], result['elapsed'])
+
+
+@cli.command()
+@click.pass_obj
+def status(client):
+    """顯示服務的執行時間、進行中的工作階段與各路由的請求延遲"""
+    try:
+        result = client.request('GET', '/health')
+    except ClientError as e:
+        click.echo(str(e), err=True)
+        return
+    click.echo(f"服務執行 {result['uptime']:.0f} 秒，進行中的工作階段: {result['sessions']}")
+    for route, stats in sorted(result['requests'].items()):
+        click.echo(
+            f"{route}: {stats['count']} 次（錯誤 {stats['errors']}），"
+            f"p50 {stats['p50_ms']:.1f} 毫秒，p95 {stats['p95_ms']:.1f} 毫秒"
+        )
+
+
+if __name__ == '__main__':
+    cli()
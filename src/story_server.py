@@ -0,0 +1,181 @@
+import re
+import sys
+import json
+import time
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+from llm_backend import BackendError
+
+# 常駐服務的 HTTP 層：以 JSON 交換請求與回應，每個連線由一個執行緒處理，
+# 模型呼叫、分詞與資料庫都是阻塞式的，同時進行的工作階段各自佔用一個執行緒。
+# 路由與工作階段的內容由 main.py 的 StoryService 提供。
+
+
+class RequestError(Exception):
+    """以指定的 HTTP 狀態碼回應的錯誤"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class LatencyStats:
+    """各路由的請求數、錯誤數與最近的處理延遲"""
+
+    def __init__(self, sample_size: int = 1000):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self.sample_size = sample_size
+
+    def record(self, route: str, seconds: float, error: bool):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {"count": 0, "errors": 0,
+                                               "latencies": deque(maxlen=self.sample_size)}
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["latencies"].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            routes = {route: (s["count"], s["errors"], sorted(s["latencies"]))
+                      for route, s in self._routes.items()}
+
+        def percentile(values, p):
+            return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+        return {
+            route: {
+                "count": count,
+                "errors": errors,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95)
+            }
+            for route, (count, errors, latencies) in routes.items()
+        }
+
+
+class StoryRequestHandler(BaseHTTPRequestHandler):
+    """依路由表分派請求，回應 JSON 並附上服務端處理時間"""
+    protocol_version = 'HTTP/1.1'
+    # 閒置的長連線在此秒數後關閉
+    timeout = 60
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method: str):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        route, status = f"{method} ?", 200
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            try:
+                body = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                raise RequestError(400, "請求內容不是有效的 JSON")
+            handler, route, args = self.server.match(method, url.path)
+            payload = handler(*args, query=dict(parse_qsl(url.query)), body=body)
+        except RequestError as e:
+            status, payload = e.status, {"error": str(e)}
+        except BackendError as e:
+            status, payload = 502, {"error": f"模型服務錯誤: {str(e)}"}
+        except Exception as e:
+            status, payload = 500, {"error": f"{type(e).__name__}: {str(e)}"}
+        elapsed = time.perf_counter() - start
+        self.server.stats.record(route, elapsed, status >= 400)
+        payload["server_ms"] = elapsed * 1000
+        self._send_json(status, payload)
+        if not self.server.quiet:
+            sys.stderr.write(f"{method} {url.path} {status} {elapsed * 1000:.1f}ms\n")
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Server-Time', f"{payload['server_ms']:.1f}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # 存取日誌由 _dispatch 以處理時間的格式輸出
+        pass
+
+
+class StoryServer(ThreadingHTTPServer):
+    """
+    本地故事服務
+
+    Args:
+        routes: [(方法, 路徑的正規表示式, 處理函式)]，處理函式以路徑中的群組為位置參數，
+            另以 query、body 關鍵字參數取得查詢字串與 JSON 內容，回傳回應的 dict
+        status: 回傳額外狀態的函式，附加在 /health 的回應中
+        on_thread_exit: 每個連線的執行緒結束前呼叫，如關閉該執行緒的資料庫連接
+        housekeeping: 每隔 housekeeping_interval 秒由主執行緒呼叫，沒有請求時也會執行，
+            如關閉閒置的工作階段
+        quiet: 不輸出每個請求的日誌
+    """
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, routes: list, status=None, on_thread_exit=None,
+                 housekeeping=None, housekeeping_interval: float = 30, quiet: bool = False):
+        super().__init__((host, port), StoryRequestHandler)
+        self.routes = [(method, re.compile(f"^{pattern}$"), pattern, handler)
+                       for method, pattern, handler in routes]
+        self.routes.append(('GET', re.compile('^/health$'), '/health', self._health))
+        self.status = status
+        self.on_thread_exit = on_thread_exit
+        self.housekeeping = housekeeping
+        self.housekeeping_interval = housekeeping_interval
+        self._next_housekeeping = time.monotonic() + housekeeping_interval
+        self.quiet = quiet
+        self.stats = LatencyStats()
+        self.started = time.time()
+
+    def service_actions(self):
+        # serve_forever 每次輪詢（約 0.5 秒）都會呼叫
+        if self.housekeeping and time.monotonic() >= self._next_housekeeping:
+            self._next_housekeeping = time.monotonic() + self.housekeeping_interval
+            try:
+                self.housekeeping()
+            except Exception as e:
+                sys.stderr.write(f"定期維護失敗: {type(e).__name__}: {str(e)}\n")
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            if self.on_thread_exit:
+                self.on_thread_exit()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def match(self, method: str, path: str):
+        """
+        Returns:
+            tuple: (處理函式, 路由名稱, 路徑參數)
+
+        Raises:
+            RequestError: 找不到對應的路由
+        """
+        for route_method, regex, pattern, handler in self.routes:
+            found = regex.match(path)
+            if found and route_method == method:
+                return handler, f"{method} {pattern}", found.groups()
+        raise RequestError(404, f"找不到 {method} {path}")
+
+    def _health(self, query=None, body=None) -> dict:
+        result = {"status": "ok", "uptime": time.time() - self.started, "requests": self.stats.snapshot()}
+        if self.status:
+            result.update(self.status())
+        return result
@@ -0,0 +1,382 @@
+import json
+from database import get_manager
+from blob_store import BlobStore
+
+
+class StoryStore:
+    """
+    故事資料存取層
+
+    故事 (stories) 記錄一次創作的偏好設定與所屬的工作階段，
+    每個故事的各個版本存放在 story_versions，以 (story_id, version) 為主鍵。
+    提示詞與內容存放在 blobs（見 blob_store.py），讀取時自動還原。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.db = get_manager(db_path)
+        self.blobs = BlobStore(db_path)
+
+    def create_story(self, session_id: str, theme: str, genre: str, tone: str, elements: list) -> int:
+        """建立新故事並回傳故事編號"""
+        elements_json = json.dumps(elements, ensure_ascii=False)
+        with self.db.transaction() as conn:
+            cursor = conn.execute("""
+                INSERT INTO stories (session_id, theme, genre, tone, elements)
+                VALUES (?, ?, ?, ?, ?)
+            """, (session_id, theme, genre, tone, elements_json))
+            return cursor.lastrowid
+
+    def save_version(self, story_id: int, version: int, prompt: str, content: str,
+                     feedback: str = None, rating: int = None):
+        """寫入故事版本，已存在時直接覆蓋，並釋放舊版本不再使用的內容"""
+        with self.db.transaction() as conn:
+            previous = conn.execute(
+                "SELECT prompt_ref, content_ref FROM story_versions WHERE story_id = ? AND version = ?",
+                (story_id, version)
+            ).fetchone()
+            prompt_ref = self.blobs.acquire(prompt)
+            content_ref = self.blobs.acquire(content)
+            conn.execute("""
+                INSERT INTO story_versions
+                (story_id, version, prompt, content, feedback, rating, prompt_ref, content_ref)
+                VALUES (?, ?, '', '', ?, ?, ?, ?)
+                ON CONFLICT(story_id, version) DO UPDATE SET
+                    prompt = excluded.prompt,
+                    content = excluded.content,
+                    feedback = excluded.feedback,
+                    rating = excluded.rating,
+                    prompt_ref = excluded.prompt_ref,
+                    content_ref = excluded.content_ref
+            """, (story_id, version, feedback, rating, prompt_ref, content_ref))
+            for ref in previous or ():
+                if ref is not None:
+                    self.blobs.release(ref)
+
+    def _text(self, value: str, ref: str) -> str:
+        """有引用時由 blobs 讀取，否則為直接存放的舊版本"""
+        return self.blobs.get(ref) if ref is not None else value
+
+    def get_story(self, story_id: int):
+        """獲取故事的偏好設定"""
+        conn = self.db.connection()
+        row = conn.execute("""
+            SELECT id, session_id, theme, genre, tone, elements, created_at
+            FROM stories WHERE id = ?
+        """, (story_id,)).fetchone()
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'session_id': row[1],
+            'theme': row[2],
+            'genre': row[3],
+            'tone': row[4],
+            'elements': json.loads(row[5]),
+            'created_at': row[6]
+        }
+
+    def find_stories(self, theme: str = None, genre: str = None, tone: str = None, limit: int = 20):
+        """依偏好條件查詢最近的故事"""
+        conditions, params = [], []
+        for column, value in (('theme', theme), ('genre', genre), ('tone', tone)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self.db.connection()
+        rows = conn.execute(f"""
+            SELECT id, session_id, theme, genre, tone, created_at
+            FROM stories {where}
+            ORDER BY created_at DESC LIMIT ?
+        """, params + [limit]).fetchall()
+        return [
+            {'id': r[0], 'session_id': r[1], 'theme': r[2], 'genre': r[3], 'tone': r[4], 'created_at': r[5]}
+            for r in rows
+        ]
+
+    def get_version_numbers(self, story_id: int) -> list:
+        """獲取故事的所有版本號"""
+        conn = self.db.connection()
+        rows = conn.execute(
+            "SELECT version FROM story_versions WHERE story_id = ? ORDER BY version",
+            (story_id,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_version(self, story_id: int, version: int):
+        """獲取指定版本的內容、反饋與評分"""
+        conn = self.db.connection()
+        row = conn.execute("""
+            SELECT version, prompt, content, feedback, rating, created_at, prompt_ref, content_ref
+            FROM story_versions WHERE story_id = ? AND version = ?
+        """, (story_id, version)).fetchone()
+        if not row:
+            return None
+        return {
+            'version': row[0],
+            'prompt': self._text(row[1], row[6]),
+            'content': self._text(row[2], row[7]),
+            'feedback': row[3],
+            'rating': row[4],
+            'created_at': row[5]
+        }
+
+    def get_versions(self, story_id: int) -> list:
+        """依版本順序獲取故事所有版本的內容、反饋與已保存的分詞結果"""
+        conn = self.db.connection()
+        rows = conn.execute("""
+            SELECT version, content, feedback, rating, tokens, content_ref
+            FROM story_versions WHERE story_id = ?
+            ORDER BY version
+        """, (story_id,)).fetchall()
+        return [
+            {'version': r[0], 'content': self._text(r[1], r[5]), 'feedback': r[2], 'rating': r[3],
+             'tokens': r[4]}
+            for r in rows
+        ]
+
+    def iter_all_versions(self, batch_size: int = 500):
+        """
+        依故事編號與版本號逐筆產生所有版本（含所屬故事的偏好設定），用於匯出整個故事庫
+
+        只開啟一個查詢並以 fetchmany 分批讀取，讀取期間看到的是同一個資料庫快照，
+        記憶體用量與故事庫大小無關。
+        """
+        conn = self.db.connection()
+        cursor = conn.execute("""
+            SELECT v.story_id, s.session_id, s.theme, s.genre, s.tone, s.elements, s.created_at,
+                   v.version, v.prompt, v.content, v.feedback, v.rating, v.created_at,
+                   v.prompt_ref, v.content_ref
+            FROM story_versions v JOIN stories s ON s.id = v.story_id
+            ORDER BY v.story_id, v.version
+        """)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for r in rows:
+                    yield {
+                        'story_id': r[0],
+                        'session_id': r[1],
+                        'theme': r[2],
+                        'genre': r[3],
+                        'tone': r[4],
+                        'elements': json.loads(r[5]),
+                        'story_created_at': r[6],
+                        'version': r[7],
+                        'prompt': self._text(r[8], r[13]),
+                        'content': self._text(r[9], r[14]),
+                        'feedback': r[10],
+                        'rating': r[11],
+                        'created_at': r[12]
+                    }
+        finally:
+            cursor.close()
+
+    def save_tokens(self, story_id: int, version: int, tokens: str):
+        """保存版本內容的分詞結果"""
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE story_versions SET tokens = ? WHERE story_id = ? AND version = ?",
+                (tokens, story_id, version)
+            )
+
+    def save_metrics(self, story_id: int, version: int, content_length: int,
+                     from_version: int = None, evaluation: dict = None):
+        """保存版本長度與和前一版本比較的評估指標"""
+        evaluation = evaluation or {}
+        rouge_scores = evaluation.get('rouge_scores', {})
+        with self.db.transaction() as conn:
+            conn.execute("""
+                INSERT INTO version_metrics
+                (story_id, version, from_version, content_length, bleu_score,
+                 change_rate, rouge_l_f, rouge_1_f, rouge_2_f)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(story_id, version) DO UPDATE SET
+                    from_version = excluded.from_version,
+                    content_length = excluded.content_length,
+                    bleu_score = excluded.bleu_score,
+                    change_rate = excluded.change_rate,
+                    rouge_l_f = excluded.rouge_l_f,
+                    rouge_1_f = excluded.rouge_1_f,
+                    rouge_2_f = excluded.rouge_2_f
+            """, (story_id, version, from_version, content_length,
+                  evaluation.get('bleu_score'), evaluation.get('change_rate'),
+                  rouge_scores.get('rouge_l_f'), rouge_scores.get('rouge_1_f'),
+                  rouge_scores.get('rouge_2_f')))
+
+    def get_version_history(self, story_id: int) -> list:
+        """
+        依版本順序獲取反饋與已保存的評估指標，不讀取故事內容
+
+        尚未計算指標的版本，其 content_length 為 None。
+        """
+        conn = self.db.connection()
+        rows = conn.execute("""
+            SELECT v.version, v.feedback, v.rating, m.from_version, m.content_length,
+                   m.bleu_score, m.change_rate, m.rouge_l_f, m.rouge_1_f, m.rouge_2_f
+            FROM story_versions v
+            LEFT JOIN version_metrics m
+                ON m.story_id = v.story_id AND m.version = v.version
+            WHERE v.story_id = ?
+            ORDER BY v.version
+        """, (story_id,)).fetchall()
+        return [
+            {
+                'version': r[0],
+                'feedback': r[1],
+                'rating': r[2],
+                'from_version': r[3],
+                'content_length': r[4],
+                'bleu_score': r[5],
+                'change_rate': r[6],
+                'rouge_scores': {'rouge_l_f': r[7], 'rouge_1_f': r[8], 'rouge_2_f': r[9]}
+            }
+            for r in rows
+        ]
+
+    def save_candidates(self, story_id: int, version: int, candidates: list):
+        """
+        保存一輪重新生成的所有候選版本，取代該版本先前保存的候選
+
+        Args:
+            candidates: [{'content', 'score', 'retention', 'coverage', 'selected'}, ...]，依候選編號排列
+        """
+        with self.db.transaction() as conn:
+            # 先取得新內容的引用再刪除舊資料，相同的內容不會被提前刪除
+            refs = [self.blobs.acquire(c['content']) for c in candidates]
+            previous = conn.execute(
+                "SELECT content_ref FROM story_candidates WHERE story_id = ? AND version = ?",
+                (story_id, version)
+            ).fetchall()
+            conn.execute(
+                "DELETE FROM story_candidates WHERE story_id = ? AND version = ?", (story_id, version)
+            )
+            conn.executemany("""
+                INSERT INTO story_candidates
+                (story_id, version, candidate, content_ref, score, retention, coverage, selected)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (story_id, version, number, ref, c['score'], c['retention'], c['coverage'], int(c['selected']))
+                for number, (ref, c) in enumerate(zip(refs, candidates), start=1)
+            ])
+            # 刪除觸發器只減少引用次數，歸零的內容在此一併清除
+            for (ref,) in previous:
+                self.blobs.release_orphan(ref)
+
+    def get_candidates(self, story_id: int, version: int = None) -> list:
+        """依版本與候選編號獲取保存的候選版本，未指定版本時回傳所有版本的候選"""
+        conn = self.db.connection()
+        query = """
+            SELECT version, candidate, content_ref, score, retention, coverage, selected
+            FROM story_candidates WHERE story_id = ?
+        """
+        params = [story_id]
+        if version is not None:
+            query += " AND version = ?"
+            params.append(version)
+        rows = conn.execute(query + " ORDER BY version, candidate", params).fetchall()
+        return [
+            {'version': r[0], 'candidate': r[1], 'content': self.blobs.get(r[2]), 'score': r[3],
+             'retention': r[4], 'coverage': r[5], 'selected': bool(r[6])}
+            for r in rows
+        ]
+
+    def select_candidate(self, story_id: int, version: int, candidate: int):
+        """
+        以指定的候選內容取代該版本的內容，原本的提示詞、反饋與評分不變
+
+        Raises:
+            ValueError: 找不到版本或候選
+        """
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT content_ref FROM story_candidates WHERE story_id = ? AND version = ? AND candidate = ?",
+                (story_id, version, candidate)
+            ).fetchone()
+            current = self.get_version(story_id, version)
+            if row is None or current is None:
+                raise ValueError(f"找不到故事 {story_id} 第 {version} 版的候選 {candidate}")
+            self.save_version(story_id, version, current['prompt'], self.blobs.get(row[0]),
+                              current['feedback'], current['rating'])
+            conn.execute(
+                "UPDATE story_candidates SET selected = (candidate = ?) WHERE story_id = ? AND version = ?",
+                (candidate, story_id, version)
+            )
+
+    def compact_legacy(self, batch_size: int = 200) -> int:
+        """
+        將直接存放在 prompt、content 欄位的舊版本改存到 blobs
+
+        內容不變，因此保留已計算的指標、分詞結果與全文檢索狀態。
+
+        Returns:
+            int: 轉換的版本數
+        """
+        converted = 0
+        conn = self.db.connection()
+        while True:
+            with self.db.transaction():
+                rows = conn.execute("""
+                    SELECT story_id, version, prompt, content, tokens
+                    FROM story_versions WHERE content_ref IS NULL LIMIT ?
+                """, (batch_size,)).fetchall()
+                if not rows:
+                    return converted
+                for story_id, version, prompt, content, tokens in rows:
+                    key = (story_id, version, version)
+                    metrics = conn.execute(
+                        "SELECT * FROM version_metrics WHERE story_id = ? AND (version = ? OR from_version = ?)",
+                        key
+                    ).fetchall()
+                    pending = conn.execute(
+                        "SELECT 1 FROM search_pending WHERE story_id = ? AND version = ?",
+                        (story_id, version)
+                    ).fetchone()
+
+                    conn.execute("""
+                        UPDATE story_versions SET prompt = '', content = '', prompt_ref = ?, content_ref = ?
+                        WHERE story_id = ? AND version = ?
+                    """, (self.blobs.acquire(prompt), self.blobs.acquire(content), story_id, version))
+
+                    # 觸發器視為內容改變，將其結果還原
+                    conn.execute(
+                        "UPDATE story_versions SET tokens = ? WHERE story_id = ? AND version = ?",
+                        (tokens, story_id, version)
+                    )
+                    if metrics:
+                        conn.executemany(
+                            f"INSERT OR REPLACE INTO version_metrics VALUES ({','.join('?' * len(metrics[0]))})",
+                            metrics
+                        )
+                    if not pending:
+                        conn.execute(
+                            "DELETE FROM search_pending WHERE story_id = ? AND version = ?",
+                            (story_id, version)
+                        )
+                converted += len(rows)
+
+    def storage_stats(self) -> dict:
+        """各版本提示詞與內容的原文總大小，以及實際存放的大小"""
+        conn = self.db.connection()
+        versions, legacy, legacy_bytes = conn.execute("""
+            SELECT COUNT(*), COALESCE(SUM(content_ref IS NULL), 0),
+                   COALESCE(SUM(length(CAST(prompt AS BLOB)) + length(CAST(content AS BLOB))), 0)
+            FROM story_versions
+        """).fetchone()
+        logical = conn.execute("""
+            SELECT (SELECT COALESCE(SUM(b.size), 0)
+                    FROM story_versions v JOIN blobs b ON b.hash = v.prompt_ref)
+                 + (SELECT COALESCE(SUM(b.size), 0)
+                    FROM story_versions v JOIN blobs b ON b.hash = v.content_ref)
+        """).fetchone()[0]
+        blobs = self.blobs.stats()
+        return {
+            "versions": versions,
+            "legacy_versions": legacy,
+            "logical_bytes": logical + legacy_bytes,
+            "stored_bytes": blobs["stored_bytes"] + legacy_bytes,
+            "blobs": blobs
+        }
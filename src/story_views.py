@@ -0,0 +1,102 @@
+import click
+
+# 命令輸出的格式，本地命令（main.py）與常駐服務的客戶端（story_client.py）共用，
+# 只依賴 click 與各步驟回傳的結果字典，不載入資料庫或其他重量級模組。
+
+# 檢索摘要中標示命中詞的控制字元，由 search_index 寫入摘要，顯示時再換成顏色
+HIGHLIGHT_START, HIGHLIGHT_END = '\x01', '\x02'
+
+
+def print_history_analysis(history_analysis: dict):
+    """顯示版本歷史分析報告"""
+    print("========================")
+    click.echo("\n版本歷史分析：")
+    click.echo(f"總版本數: {history_analysis['version_count']}")
+
+    if history_analysis['content_length_trend']:
+        click.echo("\n內容長度變化:")
+        for length_data in history_analysis['content_length_trend']:
+            click.echo(f"版本 {length_data['version']}: {length_data['length']} 字")
+
+    if history_analysis.get('version_changes'):
+        click.echo("\n版本間變化:")
+        for change in history_analysis['version_changes']:
+            click.echo(
+                f"版本 {change['from_version']} -> {change['to_version']}:"
+                f"\nBLEU分數: {change['bleu_score']:.2f}"
+                f"\n變化率: {change['change_rate']:.2f}"
+                f"\nROUGE-L: {change['rouge_scores']['rouge_l_f']:.2f}"
+                f"\nROUGE-1: {change['rouge_scores']['rouge_1_f']:.2f}"
+                f"\nROUGE-2: {change['rouge_scores']['rouge_2_f']:.2f}"
+            )
+
+    if history_analysis['feedback_analysis']:
+        click.echo("\n歷史反饋:")
+        for feedback_data in history_analysis['feedback_analysis']:
+            click.echo(f"版本 {feedback_data['version']}: {feedback_data['feedback']}")
+
+
+def print_prompt_stats(prompt_stats: dict):
+    """顯示重新生成提示詞的 token 數與節省量"""
+    click.echo(
+        f"\n提示詞約 {prompt_stats['tokens']} tokens"
+        f"（完整提示詞約 {prompt_stats['baseline_tokens']} tokens，"
+        f"節省 {prompt_stats['saved_tokens']} tokens）"
+    )
+    if prompt_stats['patch_fallback']:
+        click.echo("上一版本超過提示詞預算，改以段落修改格式送出", err=True)
+    if prompt_stats['omitted_paragraphs']:
+        click.echo(f"上一版本省略了 {prompt_stats['omitted_paragraphs']} 段以符合預算", err=True)
+    if prompt_stats['truncated']:
+        click.echo("上一版本的第一段超過預算，只保留開頭", err=True)
+    if prompt_stats['guide'] != 'full':
+        click.echo("創作指南已縮短" if prompt_stats['guide'] == 'shortened' else "已省略創作指南", err=True)
+    if prompt_stats['over_budget']:
+        click.echo(f"提示詞仍超過預算約 {prompt_stats['overage']} tokens", err=True)
+
+
+def print_generation(result: dict, show_content: bool = True):
+    """
+    顯示生成結果：段落修改的 token 數、候選版本的選擇與新版本內容
+
+    Args:
+        show_content: 內容已以串流顯示時為 False
+    """
+    patch = result.get('patch')
+    if patch:
+        click.echo(f"回應約 {patch['response_tokens']} tokens，完整故事約 {patch['story_tokens']} tokens")
+    ranking = result.get('ranking')
+    if ranking:
+        click.echo(
+            f"\n已生成 {ranking['count']} 個候選版本，選用第 {ranking['candidate']} 個："
+            f"分數 {ranking['score']:.3f}，保留比例 {ranking['retention']:.0%}"
+            f"（目標 {ranking['target']:.0%}），關鍵元素涵蓋率 {ranking['coverage']:.0%}"
+        )
+    print("========================")
+    if show_content:
+        click.echo(f"\n第 {result['version']} 版故事：\n")
+        click.echo(result['content'])
+
+
+def print_session_summary(summary: dict):
+    """顯示工作階段結束時的耗時與故事編號"""
+    click.echo(
+        f"\n從開始生成到接受第 {summary['version']} 版共 {summary['elapsed']:.1f} 秒，"
+        f"其中等待模型生成 {summary['model_seconds']:.1f} 秒"
+    )
+    click.echo(f"故事編號 {summary['story_id']}，可用 history {summary['story_id']} 再次查看版本歷史分析")
+
+
+def print_search_results(query: str, results: list, elapsed: float):
+    """顯示全文檢索結果，命中的詞以顏色標示"""
+    if not results:
+        click.echo(f"找不到符合「{query}」的版本（{elapsed * 1000:.1f} 毫秒）")
+        return
+    click.echo(f"找到 {len(results)} 筆（{elapsed * 1000:.1f} 毫秒）:")
+    for r in results:
+        rating = f"，評分 {r['rating']}" if r['rating'] is not None else ""
+        click.echo(f"\n故事 {r['story_id']} 版本 {r['version']}"
+                   f"（{r['theme']} / {r['genre']} / {r['tone']}{rating}）")
+        snippet = r['snippet'].replace("\n", " ")
+        snippet = snippet.replace(HIGHLIGHT_START, "\x1b[1;33m").replace(HIGHLIGHT_END, "\x1b[0m")
+        click.echo(f"  {snippet}")
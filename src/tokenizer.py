@@ -0,0 +1,181 @@
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import Counter, OrderedDict
+from config import TOKEN_CACHE_SIZE, JIEBA_DICT_MODE, JIEBA_DICT_DIR, JIEBA_USER_DICT
+from tracing import span, traced
+
+_jieba = None
+_jieba_lock = threading.Lock()
+
+
+def _get_jieba():
+    """第一次分詞時才載入jieba"""
+    global _jieba
+    if _jieba is None:
+        with _jieba_lock:
+            if _jieba is None:
+                with span('jieba.import'):
+                    import jieba
+                # 設置jieba的日誌級別為WARNING以上，避免顯示載入訊息
+                jieba.setLogLevel(logging.WARNING)
+                if JIEBA_DICT_MODE == 'mmap':
+                    _load_mapped_dictionary(jieba)
+                _jieba = jieba
+    return _jieba
+
+
+def _dictionary_path(jieba) -> Path:
+    """預先建立的詞典檔路徑，檔名為詞典與使用者詞典內容的雜湊"""
+    from prefix_dict import dictionary_key
+    with jieba.dt.get_dict_file() as f:
+        dictionary = f.read()
+    user_dict = Path(JIEBA_USER_DICT).read_bytes() if JIEBA_USER_DICT else b""
+    return JIEBA_DICT_DIR / f"prefix-{dictionary_key(dictionary, user_dict)}.dict"
+
+
+@traced('jieba.build')
+def _build_dictionary(jieba, path: Path):
+    """以jieba本身的方式建立前綴詞典（含使用者詞典）並寫為詞典檔"""
+    from prefix_dict import write
+    builder = jieba.Tokenizer()
+    builder.FREQ, builder.total = builder.gen_pfdict(builder.get_dict_file())
+    builder.initialized = True
+    if JIEBA_USER_DICT:
+        builder.load_userdict(JIEBA_USER_DICT)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write(path, builder.FREQ, builder.total)
+
+
+@traced('jieba.mmap')
+def _load_mapped_dictionary(jieba):
+    """載入（必要時先建立）詞典檔，取代jieba的前綴詞典；失敗時保留jieba內建的載入方式"""
+    from prefix_dict import MappedPrefixDict
+    try:
+        path = _dictionary_path(jieba)
+        if not path.exists():
+            _build_dictionary(jieba, path)
+        freq = MappedPrefixDict(path)
+    except (OSError, ValueError) as e:
+        print(f"無法載入預先建立的jieba詞典，改用jieba內建的載入方式: {str(e)}")
+        return
+    with jieba.dt.lock:
+        jieba.dt.FREQ, jieba.dt.total = freq, freq.total
+        jieba.dt.initialized = True
+
+
+@traced('jieba.load')
+def warm_up():
+    """預先載入jieba詞典，之後的第一次分詞不必等待"""
+    _get_jieba().initialize()
+
+
+def add_words(words):
+    """
+    將自訂詞（如使用者輸入的關鍵元素）加入詞典，讓它們被切為完整的詞
+
+    只影響目前行程，不會寫入詞典檔。詞典改變後，之前快取的分詞結果不再使用。
+    """
+    global _dictionary_generation
+    jieba = _get_jieba()
+    added = False
+    for word in words:
+        word = word.strip()
+        if word and not jieba.dt.FREQ.get(word):
+            jieba.add_word(word)
+            added = True
+    if added:
+        with _cache_lock:
+            _dictionary_generation += 1
+
+
+def content_hash(text: str) -> str:
+    """計算文本的內容雜湊"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class TokenizedText:
+    """
+    分詞後的文本
+
+    同一段文本只分詞一次，BLEU、ROUGE 與變化率都讀取這裡預先算好的
+    詞序列、n-gram 計數與詞集合。空白不視為詞。
+    """
+    __slots__ = ('content_hash', 'tokens', '_token_set', '_ngram_counts')
+
+    def __init__(self, content_hash: str, tokens: list):
+        self.content_hash = content_hash
+        self.tokens = tokens
+        self._token_set = None
+        self._ngram_counts = {}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def token_set(self) -> set:
+        if self._token_set is None:
+            self._token_set = set(self.tokens)
+        return self._token_set
+
+    def ngram_counts(self, n: int) -> Counter:
+        """n-gram 出現次數"""
+        counts = self._ngram_counts.get(n)
+        if counts is None:
+            tokens = self.tokens
+            counts = Counter(tuple(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+            self._ngram_counts[n] = counts
+        return counts
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# 詞典的版本，add_words 加入新詞時遞增，作為分詞快取鍵的一部分
+_dictionary_generation = 0
+
+
+def tokenize(text: str, tokens: list = None) -> TokenizedText:
+    """
+    將文本分詞，結果依詞典版本與內容雜湊快取，超過 TOKEN_CACHE_SIZE 時淘汰最久未使用的項目
+
+    Args:
+        tokens: 已保存的分詞結果，提供時直接使用，不再呼叫jieba
+    """
+    text_key = content_hash(text)
+    with _cache_lock:
+        key = (_dictionary_generation, text_key)
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    if tokens is None:
+        tokens = [token for token in _get_jieba().cut(text) if token.strip()]
+    result = TokenizedText(text_key, tokens)
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > TOKEN_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def serialize_tokens(tokenized: TokenizedText) -> str:
+    """轉為可存入資料庫的字串，詞本身不含空白，因此以空格分隔"""
+    return " ".join(tokenized.tokens)
+
+
+def deserialize_tokens(value: str) -> list:
+    return value.split(" ") if value else []
+
+
+def segment(text: str) -> str:
+    """
+    分詞後以空格連接，供全文檢索索引使用
+
+    不經過分詞快取，避免大量建立索引時擠掉評估用的快取項目。
+    """
+    if not text:
+        return ""
+    return " ".join(token for token in _get_jieba().cut(text) if token.strip())
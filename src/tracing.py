@@ -0,0 +1,174 @@
+import json
+import time
+import functools
+import threading
+import itertools
+import contextvars
+
+# 輕量的區段計時：記錄每個區段的耗時、token 用量與寫入的位元組數，
+# 可輸出為 JSONL 追蹤檔，或在結束時彙總成表格。未啟用時 span() 只回傳共用的空區段。
+
+_current = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """一個計時區段，屬性以 set() 累加"""
+    __slots__ = ('tracer', 'name', 'span_id', 'parent_id', 'attrs', 'start', '_wall', '_token')
+
+    def __init__(self, tracer, name: str, attrs: dict):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = next(tracer._ids)
+        parent = _current.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self._token = None
+
+    def set(self, **attrs):
+        """設定屬性，數值屬性會與既有的值相加"""
+        for key, value in attrs.items():
+            if value is None:
+                continue
+            previous = self.attrs.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) \
+                    and isinstance(previous, (int, float)):
+                self.attrs[key] = previous + value
+            else:
+                self.attrs[key] = value
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self._wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._finish(self, duration)
+        return False
+
+
+class _NoopSpan:
+    """追蹤關閉時使用的空區段"""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Tracer:
+    """區段追蹤器，預設關閉，以 configure() 啟用"""
+
+    def __init__(self):
+        self.enabled = False
+        self._file = None
+        self._profile = False
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def configure(self, path=None, profile: bool = False):
+        """
+        Args:
+            path: JSONL 追蹤檔路徑，每個區段結束時附加一行
+            profile: 是否彙總各區段的統計
+        """
+        self.close()
+        self._profile = profile
+        self._stats = {}
+        if path:
+            self._file = open(path, 'a', encoding='utf-8')
+        self.enabled = bool(path) or profile
+
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            return _NOOP
+        return Span(self, name, attrs)
+
+    def current(self):
+        """目前執行中的區段，未啟用時回傳空區段"""
+        if not self.enabled:
+            return _NOOP
+        return _current.get() or _NOOP
+
+    def _finish(self, span: Span, duration: float):
+        with self._lock:
+            if self._file is not None:
+                self._file.write(json.dumps({
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "thread": threading.current_thread().name,
+                    "start": span._wall,
+                    "duration_ms": round(duration * 1000, 3),
+                    **span.attrs
+                }, ensure_ascii=False) + "\n")
+                self._file.flush()
+            if self._profile:
+                stats = self._stats.setdefault(span.name, {
+                    "count": 0, "total": 0.0, "max": 0.0,
+                    "prompt_tokens": 0, "completion_tokens": 0, "bytes_written": 0
+                })
+                stats["count"] += 1
+                stats["total"] += duration
+                stats["max"] = max(stats["max"], duration)
+                for key in ("prompt_tokens", "completion_tokens", "bytes_written"):
+                    value = span.attrs.get(key)
+                    if isinstance(value, (int, float)):
+                        stats[key] += value
+
+    def summary(self) -> list:
+        """依總耗時排序的各區段統計"""
+        with self._lock:
+            rows = [dict(stats, name=name) for name, stats in self._stats.items()]
+        return sorted(rows, key=lambda r: r["total"], reverse=True)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self.enabled = False
+
+
+tracer = Tracer()
+span = tracer.span
+
+
+def traced(name: str):
+    """將整個函式記錄為一個區段，函式內可用 tracer.current().set() 加上屬性"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with Span(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def format_summary(rows: list) -> str:
+    """將 summary() 的結果排成表格"""
+    header = f"{'區段':<24}{'次數':>6}{'總耗時(秒)':>12}{'平均(毫秒)':>12}{'最長(毫秒)':>12}" \
+             f"{'輸入tokens':>12}{'輸出tokens':>12}{'寫入bytes':>12}"
+    lines = [header]
+    for r in rows:
+        lines.append(
+            f"{r['name']:<24}{r['count']:>6}{r['total']:>12.3f}"
+            f"{r['total'] / r['count'] * 1000:>12.1f}{r['max'] * 1000:>12.1f}"
+            f"{r['prompt_tokens']:>12}{r['completion_tokens']:>12}{r['bytes_written']:>12}"
+        )
+    return "\n".join(lines)